@@ -0,0 +1,550 @@
+'''
+The advise operation proposes indexes for the SQL queries of the
+postgres panels of the dashboards of a local grape project.
+
+The queries are read from the dashboards in the local grafana server
+or from a saved archive (-f) and the columns that they filter on
+(WHERE and the $__timeFilter macros), group by and order by are
+collected for each table. They are compared with the existing indexes
+in the database of their datasource and a btree index is proposed for
+each combination that is not covered: the equality columns followed by
+a range or an ordering column. The queries of each database are
+advised separately.
+
+The benefit of each proposed index is estimated by explaining the
+panel queries that use its table with and without the index. If the
+hypopg extension is available, hypothetical indexes are used,
+otherwise the index is created in a transaction that is rolled back.
+
+The proposed CREATE INDEX statements are printed and they are
+created in their databases when --apply is specified.
+'''
+import argparse
+import os
+import re
+import sys
+from typing import Dict, List, Optional, Set, Tuple
+
+from grape.common.args import DEFAULT_NAME, CLI, add_common_args, args_get_text
+from grape.common.log import initv, info, warn, debug
+from grape.common.conf import get_conf
+from grape.common.filters import get_filters
+from grape.common.pg import explain_all, pipe, query
+from grape.profile_queries import add_query_args, get_project_queries, get_queries
+from grape.profile_queries import read_services
+from grape import __version__
+
+
+# The maximum length of a postgres identifier.
+MAX_NAME_LEN = 63
+
+# The maximum number of equality columns in a proposed index.
+MAX_EQ_COLUMNS = 2
+
+# Identifiers, possibly qualified and quoted.
+IDENT = r'(?:"[^"]+"|[A-Za-z_]\w*)(?:\.(?:"[^"]+"|[A-Za-z_]\w*))?'
+
+# The tables in FROM and JOIN clauses with their optional aliases.
+TABLE_RE = re.compile(r'\b(?:FROM|JOIN)\s+(' + IDENT + r')'
+                      r'(?:\s+(?:AS\s+)?("[^"]+"|[A-Za-z_]\w*))?', re.IGNORECASE)
+
+# Column predicates.
+EQ_RE = re.compile(r'(' + IDENT + r')\s*(?:=|\bIN\s*\(|\bIS\s+(?:NOT\s+)?NULL\b)', re.IGNORECASE)
+JOIN_RE = re.compile(r'=\s*(' + IDENT + r')\b(?!\s*\()')
+RANGE_RE = re.compile(r'(' + IDENT + r')\s*(?:<=|>=|<(?!>)|>|\bBETWEEN\b)', re.IGNORECASE)
+
+# The grafana macros whose first argument is a time column.
+MACRO_RE = re.compile(r'\$__(?:timeFilter|timeGroup|timeGroupAlias|unixEpochFilter|'
+                      r'unixEpochNanoFilter|unixEpochGroup|unixEpochGroupAlias)'
+                      r'\(\s*(' + IDENT + r')')
+
+# The GROUP BY and ORDER BY lists.
+ORDER_RE = re.compile(r'\b(?:GROUP|ORDER)\s+BY\s+(.*?)'
+                      r'(?=\b(?:HAVING|ORDER|LIMIT|OFFSET|UNION|WINDOW)\b|\)|;|$)',
+                      re.IGNORECASE | re.DOTALL)
+
+# Words that are not table aliases.
+KEYWORDS = {'where', 'join', 'inner', 'left', 'right', 'full', 'outer', 'cross', 'on', 'using',
+            'group', 'order', 'limit', 'offset', 'having', 'union', 'window', 'natural',
+            'lateral', 'as', 'select', 'and', 'or', 'not', 'in', 'is', 'null', 'between'}
+
+
+def getopts() -> argparse.Namespace:
+    '''Process the command line options.
+
+    Returns:
+       opts: The argument namespace.
+    '''
+    argparse._ = args_get_text  # type: ignore
+    base = os.path.basename(sys.argv[0])
+    usage = '\n {0} [OPTIONS]'.format(base)
+    desc = 'DESCRIPTION:{0}'.format('\n  '.join(__doc__.split('\n')))
+    epilog = '''
+EXAMPLES:
+    # ------------------------------------------------
+    # Example 1: Help.
+    # ------------------------------------------------
+        $ {2} {0} -h
+
+    # ------------------------------------------------
+    # Example 2: Propose indexes for the panel queries
+    #            of all of the dashboards.
+    # ------------------------------------------------
+        $ {2} {0} -v -n {3} -g 4600
+
+    # ------------------------------------------------
+    # Example 3: Propose indexes for the panel queries
+    #            in an archive and save them.
+    # ------------------------------------------------
+        $ {2} {0} -n {3} -f {3}.zip > indexes.sql
+
+    # ------------------------------------------------
+    # Example 4: Create the indexes that reduce the
+    #            estimated cost by at least 50%.
+    # ------------------------------------------------
+        $ {2} {0} -v -n {3} -g 4600 --min-benefit 50 --apply
+
+VERSION:
+   {1}
+'''.format(base, __version__, CLI, DEFAULT_NAME).strip()
+    afc = argparse.RawTextHelpFormatter
+    parser = argparse.ArgumentParser(formatter_class=afc,
+                                     description=desc[:-2],
+                                     usage=usage,
+                                     epilog=epilog.rstrip() + '\n ')
+    add_common_args(parser, '--filter', '-f', '-g', '-n', '-p')
+    add_query_args(parser)
+    parser.add_argument('--apply',
+                        action='store_true',
+                        help='''\
+Create the proposed indexes in the
+database.
+ ''')
+
+    parser.add_argument('--min-benefit',
+                        action='store',
+                        type=float,
+                        default=10,
+                        metavar=('PERCENT'),
+                        help='''\
+Only propose the indexes that reduce the
+estimated cost of the panel queries that
+use the table by at least this percent.
+
+The default is %(default)s.
+ ''')
+
+    parser.add_argument('--timeout',
+                        action='store',
+                        type=float,
+                        default=300,
+                        metavar=('SECONDS'),
+                        help='''\
+The statement timeout for the estimates.
+It limits the time to create an index
+when hypopg is not available.
+
+The default is %(default)s.
+ ''')
+
+    opts = parser.parse_args()
+    return opts
+
+
+def unquote(name: str) -> str:
+    '''Normalize an identifier.
+
+    Args:
+        name: The identifier, it may be quoted.
+
+    Returns:
+        name: The unquoted identifier, unquoted identifiers are
+            folded to lower case like postgres does.
+    '''
+    if name.startswith('"'):
+        return name[1:-1]
+    return name.lower()
+
+
+def quote(name: str) -> str:
+    '''Quote an identifier if needed.
+
+    Args:
+        name: The identifier.
+
+    Returns:
+        name: The identifier, it is quoted if it is not lower case.
+    '''
+    if re.fullmatch(r'[a-z_][a-z0-9_]*', name):
+        return name
+    return '"' + name.replace('"', '""') + '"'
+
+
+def strip_sql(sql: str) -> str:
+    '''Remove the comments and string literals of a query.
+
+    Args:
+        sql: The SQL.
+
+    Returns:
+        sql: The SQL with comments removed and literals replaced by ''.
+    '''
+    sql = re.sub(r'--[^\n]*|/\*.*?\*/', ' ', sql, flags=re.DOTALL)
+    return re.sub(r"'(?:[^']|'')*'", "''", sql)
+
+
+def get_schema(conf: dict, dbname: str) -> Tuple[Dict[str, Set[str]], Dict[str, List[List[str]]]]:
+    '''Get the table columns and the indexes of a database.
+
+    Args:
+        conf: The configuration data.
+        dbname: The database.
+
+    Returns:
+        columns: The column names by table name.
+        indexes: The column lists of the indexes by table name.
+    '''
+    columns: Dict[str, Set[str]] = {}
+    rows = query(conf, "SELECT table_name, column_name FROM information_schema.columns "
+                       "WHERE table_schema NOT IN ('pg_catalog', 'information_schema')",
+                 dbname)
+    for table, column in rows:
+        columns.setdefault(table, set()).add(column)
+
+    indexes: Dict[str, List[List[str]]] = {}
+    rows = query(conf, 'SELECT t.relname, '
+                       "string_agg(COALESCE(a.attname, ''), ',' ORDER BY k.n) "
+                       'FROM pg_index x '
+                       'JOIN pg_class t ON t.oid = x.indrelid '
+                       'JOIN pg_namespace s ON s.oid = t.relnamespace '
+                       'CROSS JOIN LATERAL unnest(x.indkey) WITH ORDINALITY AS k(attnum, n) '
+                       'LEFT JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum '
+                       "WHERE s.nspname NOT IN ('pg_catalog', 'information_schema', 'pg_toast') "
+                       'GROUP BY x.indexrelid, t.relname',
+                 dbname)
+    for table, cols in rows:
+        indexes.setdefault(table, []).append(cols.split(','))
+    return columns, indexes
+
+
+def resolve(name: str, tables: Dict[str, str],
+            columns: Dict[str, Set[str]]) -> Optional[Tuple[str, str]]:
+    '''Resolve a column reference to its table.
+
+    Args:
+        name: The column reference, it may be qualified by a table
+            name or an alias.
+        tables: The table names of the query by alias.
+        columns: The column names by table name.
+
+    Returns:
+        column: The (table, column) tuple or None if the reference
+            is not a column of a table in the database.
+    '''
+    parts = [unquote(part) for part in re.findall(r'"[^"]+"|[^.]+', name)]
+    if len(parts) == 2:
+        table = tables.get(parts[0])
+        if table and parts[1] in columns.get(table, set()):
+            return table, parts[1]
+        return None
+    matches = {table for table in tables.values() if parts[0] in columns.get(table, set())}
+    if len(matches) == 1:
+        return matches.pop(), parts[0]
+    return None
+
+
+def get_candidates(sql: str, columns: Dict[str, Set[str]]) -> List[Tuple[str, Tuple[str, ...]]]:
+    '''Get the candidate indexes of a panel query.
+
+    For each table the candidate is the equality columns followed by
+    the first range column, time macro column or ordering column.
+
+    Args:
+        sql: The raw SQL of the panel target, the macros are used to
+            find the time columns.
+        columns: The column names by table name.
+
+    Returns:
+        candidates: The (table, columns) tuples.
+    '''
+    sql = strip_sql(sql)
+    tables = {}
+    for match in TABLE_RE.finditer(sql):
+        table = unquote(match.group(1).split('.')[-1])
+        if table not in columns:
+            continue
+        tables[table] = table
+        alias = match.group(2)
+        if alias and alias.lower() not in KEYWORDS:
+            tables[unquote(alias)] = table
+
+    def collect(names: List[str]) -> Dict[str, List[str]]:
+        result: Dict[str, List[str]] = {}
+        for name in names:
+            col = resolve(name, tables, columns)
+            if col and col[1] not in result.setdefault(col[0], []):
+                result[col[0]].append(col[1])
+        return result
+
+    eqs = collect(EQ_RE.findall(sql) + JOIN_RE.findall(sql))
+    ranges = collect(MACRO_RE.findall(sql) + RANGE_RE.findall(sql))
+    orders = collect([item.split()[0] for clause in ORDER_RE.findall(sql)
+                      for item in clause.split(',') if item.split()])
+    candidates = []
+    for table in sorted(set(tables.values())):
+        cols = eqs.get(table, [])[:MAX_EQ_COLUMNS]
+        last = [col for col in ranges.get(table, []) + orders.get(table, []) if col not in cols]
+        cols += last[:1]
+        if cols:
+            candidates.append((table, tuple(cols)))
+    return candidates
+
+
+def is_covered(cols: Tuple[str, ...], indexes: List[List[str]]) -> bool:
+    '''Check if a candidate index is covered by an existing index.
+
+    It is covered if its columns are a prefix of the columns of an
+    existing index.
+
+    Args:
+        cols: The candidate columns.
+        indexes: The column lists of the existing indexes of the
+            table.
+
+    Returns:
+        covered: True if an existing index covers the candidate.
+    '''
+    return any(tuple(index[:len(cols)]) == cols for index in indexes)
+
+
+def get_index_sql(table: str, cols: Tuple[str, ...], hypothetical: bool = False) -> str:
+    '''Get the CREATE INDEX statement of a candidate.
+
+    Args:
+        table: The table name.
+        cols: The columns.
+        hypothetical: Get the statement for hypopg_create_index, it
+            does not have a name.
+
+    Returns:
+        sql: The statement.
+    '''
+    target = f'ON {quote(table)} ({", ".join(quote(col) for col in cols)})'
+    if hypothetical:
+        return f'CREATE INDEX {target}'
+    name = '_'.join((table,) + cols)[:MAX_NAME_LEN - 4] + '_idx'
+    return f'CREATE INDEX IF NOT EXISTS {quote(name)} {target};'
+
+
+def get_setup(table: str, cols: Tuple[str, ...], hypopg: bool) -> str:
+    '''Get the SQL that creates a candidate index for explain_all.
+
+    Args:
+        table: The table name.
+        cols: The columns.
+        hypopg: Create a hypothetical index with hypopg instead of
+            a real one.
+
+    Returns:
+        setup: The SQL statements.
+    '''
+    if not hypopg:
+        return get_index_sql(table, cols)
+    hypo = get_index_sql(table, cols, hypothetical=True).replace("'", "''")
+    return ('CREATE EXTENSION IF NOT EXISTS hypopg;\n'
+            f"SELECT indexrelid FROM hypopg_create_index('{hypo}');")
+
+
+def has_hypopg(conf: dict) -> bool:
+    '''Check if the hypopg extension is available in the database.
+
+    Args:
+        conf: The configuration data.
+
+    Returns:
+        available: True if hypothetical indexes can be used.
+    '''
+    rows = query(conf, "SELECT count(*) FROM pg_available_extensions WHERE name = 'hypopg'")
+    return rows[0][0] != '0'
+
+
+def get_cost(results: List[Tuple[list, str]]) -> List[Optional[float]]:
+    '''Get the estimated costs from the plans.
+
+    Args:
+        results: The plans and the errors from explain_all.
+
+    Returns:
+        costs: The total cost of each plan or None if it failed.
+    '''
+    return [plan[0]['Plan']['Total Cost'] if plan else None for plan, _ in results]
+
+
+def get_baseline(conf: dict, candidates: Dict[Tuple[str, Tuple[str, ...]], List[dict]],
+                 timeout: float, dbname: str) -> Dict[int, float]:
+    '''Get the estimated costs of the panel queries without the
+    candidate indexes.
+
+    Args:
+        conf: The configuration data.
+        candidates: The panel queries that use the table of each
+            candidate.
+        timeout: The statement timeout in seconds.
+        dbname: The database of the panel queries.
+
+    Returns:
+        baseline: The total cost by the id of the query record, the
+            queries that cannot be explained are not included.
+    '''
+    recs = list({id(rec): rec for recs in candidates.values() for rec in recs}.values())
+    results = explain_all(conf, [rec['expanded'] for rec in recs], options='COSTS',
+                          timeout=timeout, dbname=dbname)
+    baseline = {}
+    for rec, (plan, error) in zip(recs, results):
+        if error:
+            warn(f'cannot explain {rec["name"]}: {error.splitlines()[0]}')
+        else:
+            baseline[id(rec)] = plan[0]['Plan']['Total Cost']
+    return baseline
+
+
+def estimate(conf: dict, candidates: Dict[Tuple[str, Tuple[str, ...]], List[dict]],
+             timeout: float, dbname: str) -> List[dict]:
+    '''Estimate the benefit of the candidate indexes.
+
+    Args:
+        conf: The configuration data.
+        candidates: The panel queries that use the table of each
+            candidate.
+        timeout: The statement timeout in seconds.
+        dbname: The database of the panel queries.
+
+    Returns:
+        proposals: A record for each candidate with the statement,
+            the database, the number of queries and the total cost
+            before and after.
+    '''
+    hypopg = has_hypopg(conf)
+    if hypopg:
+        info('using hypopg hypothetical indexes')
+    else:
+        info('hypopg is not available, creating the indexes in transactions that are rolled back')
+    baseline = get_baseline(conf, candidates, timeout, dbname)
+
+    proposals: List[dict] = []
+    for (table, cols), recs in candidates.items():
+        recs = [rec for rec in recs if id(rec) in baseline]
+        if not recs:
+            continue
+        sql = get_index_sql(table, cols)
+        info(f'estimating {sql}')
+        costs = get_cost(explain_all(conf, [rec['expanded'] for rec in recs], options='COSTS',
+                                     setup=get_setup(table, cols, hypopg), timeout=timeout,
+                                     dbname=dbname))
+        before = sum(baseline[id(rec)] for rec in recs)
+        after = sum(cost if cost is not None else baseline[id(rec)]
+                    for rec, cost in zip(recs, costs))
+        proposals.append({
+            'sql': sql,
+            'dbname': dbname,
+            'table': table,
+            'columns': cols,
+            'queries': len(recs),
+            'before': before,
+            'after': after,
+            'benefit': 100 * (before - after) / before if before else 0,
+        })
+    return drop_covered(proposals)
+
+
+def drop_covered(proposals: List[dict]) -> List[dict]:
+    '''Drop the proposals that are covered by a better proposal.
+
+    Args:
+        proposals: The proposals from estimate.
+
+    Returns:
+        result: The remaining proposals ordered by benefit.
+    '''
+    result: List[dict] = []
+    for rec in sorted(proposals, key=lambda rec: rec['benefit'], reverse=True):
+        better = [list(x['columns']) for x in result if x['table'] == rec['table']]
+        if not is_covered(rec['columns'], better):
+            result.append(rec)
+    return result
+
+
+def collect_candidates(queries: List[dict], columns: Dict[str, Set[str]],
+                       indexes: Dict[str, List[List[str]]]
+                       ) -> Dict[Tuple[str, Tuple[str, ...]], List[dict]]:
+    '''Collect the candidates that are not covered by existing indexes
+    and the panel queries that use their tables.
+
+    Args:
+        queries: The panel queries of a database.
+        columns: The column names by table name.
+        indexes: The column lists of the indexes by table name.
+
+    Returns:
+        candidates: The panel queries that use the table of each
+            candidate.
+    '''
+    keys = []
+    tables: Dict[str, List[dict]] = {}
+    for rec in queries:
+        for table, cols in get_candidates(rec['sql'], columns):
+            if rec not in tables.setdefault(table, []):
+                tables[table].append(rec)
+            if is_covered(cols, indexes.get(table, [])):
+                debug(f'{table} ({", ".join(cols)}) is covered by an existing index')
+            elif (table, cols) not in keys:
+                keys.append((table, cols))
+    return {key: tables[key[0]] for key in keys}
+
+
+def main():
+    '''Advise command main.
+
+    This is the command line entry point for the advise command.
+    '''
+    opts = getopts()
+    initv(opts.verbose)
+    info(f'advising indexes for the panel queries of {opts.base}')
+    conf = get_conf(opts.base, opts.fname, opts.grxport, opts.pgxport)
+    zgr = read_services(conf, get_filters(opts))
+    queries = get_project_queries(conf, get_queries(opts, zgr))
+    info(f'found {len(queries)} postgres panel queries')
+
+    # The queries of each database are advised separately.
+    dbqueries: Dict[str, List[dict]] = {}
+    for rec in queries:
+        dbqueries.setdefault(rec['dbname'], []).append(rec)
+    found = 0
+    proposals = []
+    for dbname, recs in dbqueries.items():
+        columns, indexes = get_schema(conf, dbname)
+        candidates = collect_candidates(recs, columns, indexes)
+        info(f'found {len(candidates)} candidate indexes in database "{dbname}"')
+        found += len(candidates)
+        if candidates:
+            proposals += [rec for rec in estimate(conf, candidates, opts.timeout, dbname)
+                          if rec['benefit'] >= opts.min_benefit]
+    if not found:
+        print('-- no indexes to propose')
+        return
+
+    for rec in proposals:
+        print(f'-- {rec["queries"]} panel queries in {rec["dbname"]}, estimated cost '
+              f'{rec["before"]:0.1f} -> {rec["after"]:0.1f} ({rec["benefit"]:0.1f}% less)')
+        print(rec['sql'])
+    if not proposals:
+        print(f'-- no indexes reduce the estimated cost by at least {opts.min_benefit}%')
+    elif opts.apply:
+        for dbname in dbqueries:
+            stmts = [rec['sql'] for rec in proposals if rec['dbname'] == dbname]
+            if stmts:
+                info(f'creating {len(stmts)} indexes in database "{dbname}"')
+                sql = '\n'.join(stmts) + '\n'
+                pipe(conf, f'indexes of {dbname}', lambda ofp, sql=sql: ofp.write(sql),
+                     dbname=dbname)
+    info('done')
@@ -7,7 +7,8 @@ This allows the user to only deal with a single interface.
 import os
 import sys
 from grape import __version__
-from grape import create, delete, save, load, ximport, xexport, status, tree
+from grape import create, delete, save, load, ximport, xexport, status, tree, clone, ingest, gen
+from grape import profile_queries, advise, loadtest, lint, dbstats
 
 
 PROGRAM = os.path.splitext(os.path.basename(sys.argv[0]))[0]
@@ -59,6 +60,44 @@ COMMANDS:
     load        The load operation updates the visualization
                 environment from a saved state (zip file).
 
+    clone       The clone operation creates a copy of a local
+                visualization environment under a new name by
+                copying its storage directly. It is much faster
+                than a save followed by a load.
+
+    ingest      The ingest operation loads a CSV file directly
+                into the database of a local visualization
+                environment. The table column types are
+                inferred from the data.
+
+    gen         The gen operation generates a synthetic time
+                series table in the database of a local
+                visualization environment for performance
+                testing. The rows are generated by postgres.
+
+    profile-queries
+                The profile-queries operation runs the SQL
+                queries of the postgres panels of the dashboards
+                with EXPLAIN ANALYZE and ranks the panels by
+                execution time, rows scanned and sequential
+                scans.
+
+    advise      The advise operation proposes indexes for the
+                columns that the postgres panel queries filter,
+                group and order by and estimates their benefit.
+
+    loadtest    The loadtest operation replays the panel queries
+                of a dashboard with concurrent virtual users and
+                reports the latency percentiles of each panel.
+
+    lint        The lint operation checks dashboards for
+                performance anti-patterns and exits with a
+                non-zero status if it finds any.
+
+    dbstats     The dbstats operation reports the top queries,
+                the cache hit ratio, the table and index sizes
+                and the sequential scan counts of the database.
+
     import      The import operation captures an external
                 grafana environment for the purposes of
                 experimenting or working locally.
@@ -126,6 +165,14 @@ def main():
         'delete': delete.main,
         'save': save.main,
         'load': load.main,
+        'clone': clone.main,
+        'ingest': ingest.main,
+        'gen': gen.main,
+        'profile-queries': profile_queries.main,
+        'advise': advise.main,
+        'loadtest': loadtest.main,
+        'lint': lint.main,
+        'dbstats': dbstats.main,
         'import': ximport.main,
         'export': xexport.main,
         'status': status.main,
@@ -0,0 +1,179 @@
+'''
+The clone operation creates a new local grape project that is a copy
+of an existing one without a save/load round trip.
+
+It copies the grafana (gr/mnt) and postgres (pg/mnt) storage
+directories of the source project directly using copy-on-write
+reflinks if the filesystem supports them, starts new containers on
+the copies and points the datasource at the new database container.
+
+The source database container is stopped while its storage is copied
+to guarantee a consistent copy and then it is restarted. The grafana
+database is copied using the SQLite online backup API so the source
+grafana container keeps running.
+'''
+import argparse
+import os
+import sys
+
+import docker  # type: ignore
+
+from grape.common.args import DEFAULT_NAME, CLI, add_common_args, args_get_text
+from grape.common.log import initv, info, err
+from grape.common.conf import get_conf, save_pg_settings, set_pg_settings
+from grape.common.gr import update_datasource
+from grape.common.snapshot import backup_grdb, check_persistent, clone_dir, grdb_path
+from grape.common.snapshot import stop_container
+from grape.create import create, create_containers
+from grape import __version__
+
+
+def getopts() -> argparse.Namespace:
+    '''Process the command line options.
+
+    Returns:
+       opts: The argument namespace.
+    '''
+    argparse._ = args_get_text  # type: ignore
+    base = os.path.basename(sys.argv[0])
+    usage = '\n {0} [OPTIONS]'.format(base)
+    desc = 'DESCRIPTION:{0}'.format('\n  '.join(__doc__.split('\n')))
+    epilog = '''
+EXAMPLES:
+    # ------------------------------------------------
+    # Example 1: Help.
+    # ------------------------------------------------
+        $ {2} {0} -h
+
+    # ------------------------------------------------
+    # Example 2: Clone the local modeling environment.
+    # ------------------------------------------------
+        $ {2} {0} -v -n {3} -N {3}fork -g 4710
+
+VERSION:
+   {1}
+'''.format(base, __version__, CLI, DEFAULT_NAME).strip()
+    afc = argparse.RawTextHelpFormatter
+    parser = argparse.ArgumentParser(formatter_class=afc,
+                                     description=desc[:-2],
+                                     usage=usage,
+                                     epilog=epilog.rstrip() + '\n ')
+    add_common_args(parser, '-g', '-n', '-p', '-w')
+    parser.add_argument('-N', '--new-name',
+                        action='store',
+                        type=str,
+                        dest='new_base',
+                        required=True,
+                        help='''\
+The base name of the new project.
+
+The -g and -p options specify the host
+interface ports of the new project. The
+ports of the source project are read from
+its containers.
+ ''')
+    opts = parser.parse_args()
+    return opts
+
+
+def get_xport(cname: str, iport: int) -> int:
+    '''Get the host interface port of a running container.
+
+    Args:
+        cname: The container name.
+        iport: The internal container port.
+
+    Returns:
+        xport: The host interface port or 0 if the container is not
+            running.
+    '''
+    client = docker.from_env()
+    containers = client.containers.list(filters={'name': cname})
+    if not containers:
+        return 0
+    bindings = containers[0].attrs['HostConfig']['PortBindings'] or {}
+    recs = bindings.get(f'{iport}/tcp') or [{}]
+    return int(recs[0].get('HostPort', 0))
+
+
+def get_src_conf(base: str) -> dict:
+    '''Get the configuration of the source project.
+
+    The ports are not known so they are read from the running
+    containers.
+
+    Args:
+        base: The source project base name.
+
+    Returns:
+        conf: The configuration data.
+    '''
+    conf = get_conf(base, '', 0, 0)
+    grxport = get_xport(conf['gr']['cname'], conf['gr']['iport'])
+    pgxport = get_xport(conf['pg']['cname'], conf['pg']['iport'])
+    if not grxport:
+        grxport = pgxport - 1 if pgxport else 4600
+    return get_conf(base, '', grxport, pgxport)
+
+
+def clone(src: dict, dst: dict, wait: float):
+    '''Clone a grape project.
+
+    Args:
+        src: The source configuration data.
+        dst: The destination configuration data.
+        wait: The container create wait time.
+    '''
+    if not os.path.exists(src['base']):
+        err(f'project directory does not exist: {src["base"]}')
+    if os.path.exists(dst['base']):
+        err(f'project directory already exists: {dst["base"]}')
+    check_persistent(src, 'gr')
+    check_persistent(src, 'pg')
+
+    # Copy the grafana storage. The grafana database is replaced
+    # by a consistent copy because grafana may be writing to it.
+    os.makedirs(os.path.dirname(dst['gr']['mnt']))
+    clone_dir(src['gr']['mnt'], dst['gr']['mnt'])
+    dbsrc = grdb_path(src)
+    if os.path.exists(dbsrc):
+        dbdst = grdb_path(dst)
+        for ext in ['', '-journal', '-shm', '-wal']:
+            if os.path.exists(dbdst + ext):
+                os.unlink(dbdst + ext)
+        backup_grdb(dbsrc, dbdst)
+
+    # Copy the postgres storage while the database is stopped.
+    os.makedirs(os.path.dirname(dst['pg']['mnt']))
+    running = stop_container(src, 'pg')
+    try:
+        clone_dir(src['pg']['mnt'], dst['pg']['mnt'])
+    finally:
+        if running:
+            create_containers(src, wait, ['pg'])
+
+    # Copy the postgres settings so that the new database container
+    # is created and restarted with them.
+    set_pg_settings(dst, src['pg']['settings'])
+    save_pg_settings(dst)
+
+    # Start the new project and point the copied datasource at the
+    # new database container.
+    create(dst, wait)
+    update_datasource(dst, src['pg']['name'])
+
+
+def main():
+    '''Clone command main.
+
+    This is the command line entry point for the clone command.
+    '''
+    opts = getopts()
+    initv(opts.verbose)
+    info(f'cloning {opts.base} to {opts.new_base}')
+    src = get_src_conf(opts.base)
+    dst = get_conf(opts.new_base, '', opts.grxport, opts.pgxport)
+    if dst['gr']['xport'] in (src['gr']['xport'], src['pg']['xport']):
+        err(f'grafana port {dst["gr"]["xport"]} is used by {opts.base}, use -g to change it')
+    clone(src, dst, opts.wait)
+    info('done')
@@ -50,6 +50,64 @@ The file name for load, save, import, export
 and tree operations.
 
 If not specified the default is the BASE.zip.
+ ''')
+
+    if '--filter' in enable:
+        parser.add_argument('--folder',
+                            action='append',
+                            metavar=('FOLDER'),
+                            help='''\
+Only select dashboards in this folder.
+The folder can be specified by title,
+uid or id. The "General" folder is id 0.
+
+It can be specified multiple times.
+ ''')
+
+        parser.add_argument('--tag',
+                            action='append',
+                            metavar=('TAG'),
+                            help='''\
+Only select dashboards with this tag.
+
+If it is specified multiple times, the
+dashboards must have all of the tags.
+ ''')
+
+        parser.add_argument('--title-regex',
+                            action='store',
+                            metavar=('REGEX'),
+                            help='''\
+Only select dashboards whose title
+matches this regular expression.
+ ''')
+
+        parser.add_argument('--uid',
+                            action='append',
+                            metavar=('UID'),
+                            help='''\
+Only select the dashboard with this uid.
+
+It can be specified multiple times.
+ ''')
+
+    if '--ephemeral' in enable:
+        parser.add_argument('--ephemeral',
+                            action='store',
+                            nargs='?',
+                            const='pg',
+                            choices=['pg', 'all'],
+                            help='''\
+Put the postgresql data directory (pg) or
+the postgresql and grafana data directories
+(all) on tmpfs and turn off fsync,
+synchronous_commit and full_page_writes.
+It is used by the create and load commands
+for throwaway prototypes and CI.
+
+The state is lost when the containers stop.
+
+If no value is specified, it is pg.
  ''')
 
     if '-g' in enable:
@@ -113,6 +171,23 @@ than the grafana port. Thus if the
 grafana host interface port is specified
 as 4400, the default postgres server
 host interface port will be 4401.
+ ''')
+
+    if '-r' in enable:
+        parser.add_argument('-r', '--resume',
+                            action='store_true',
+                            help='''\
+Resume an interrupted import or export.
+
+Each completed object is recorded in a
+checkpoint journal next to the archive
+(FILE.journal). When this option is
+specified, the objects recorded in the
+journal are skipped so that only the
+requests that were not done are sent.
+
+The journal is removed when the operation
+completes.
  ''')
 
     if '-s' in enable:
@@ -172,6 +247,11 @@ this:
   username: 'bigbob'
   password: 'supersecret'
 
+  # Alternatively, an API key or service account
+  # token can be specified. If it is, the username
+  # and password are not needed.
+  # token: 'glsa_...'
+
   # The passwords for each database can optionally
   # be specified. If they are not specified, then
   # the user will be prompted for them.
@@ -4,7 +4,8 @@ The conf data for all tools.
 import datetime
 import json
 import os
-from typing import Any, Dict
+import re
+from typing import Any, Dict, List
 
 from grape.common.log import debug
 from grape import __version__
@@ -14,6 +15,25 @@ DEFAULT_USERNAME = 'admin'
 DEFAULT_PASSWORD = 'admin'
 DEFAULT_AUTH = (DEFAULT_USERNAME, DEFAULT_PASSWORD)
 
+# The container data directories that are mounted on tmpfs in
+# ephemeral mode.
+TMPFS_PATHS = {'gr': '/mnt/grdata', 'pg': '/mnt/pgdata'}
+
+# The postgres settings that trade durability for speed in ephemeral
+# mode, the data is lost when the container stops anyway.
+EPHEMERAL_SETTINGS = {
+    'fsync': 'off',
+    'synchronous_commit': 'off',
+    'full_page_writes': 'off',
+}
+
+# The docker default size of /dev/shm and the postgres memory units.
+# The postgres parallel queries allocate their shared memory in
+# /dev/shm so the default is too small for the tuning profiles.
+MIN_SHM_SIZE = 64 * 1024 * 1024
+PG_MEMORY_UNITS = {'': 8192, 'kB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
+PG_MEMORY_RE = re.compile(r'\s*([0-9]+)\s*(kB|MB|GB|TB)?\s*')
+
 
 def get_conf(bname: str, fname: str, grxport: int, pgxport: int) -> Dict[str, Any]:
     '''Get the grape project configuration data used by all tools.
@@ -68,6 +88,8 @@ def get_conf(bname: str, fname: str, grxport: int, pgxport: int) -> Dict[str, An
             'cname': '/' + grname,  # docker container path
             'xport': grxport,
             'iport': 3000,  # default grafana port
+            'mnt': grpath_mnt,
+            'ephemeral': False,  # see set_ephemeral
             'username': DEFAULT_USERNAME,
             'password': DEFAULT_PASSWORD,
             'host': 'localhost',
@@ -116,10 +138,12 @@ def get_conf(bname: str, fname: str, grxport: int, pgxport: int) -> Dict[str, An
             'xport': pgxport,
             'iport': 5432,  # default postgres port
             'mnt': pgpath_mnt,
+            'ephemeral': False,  # see set_ephemeral
             'dbname': 'postgres',
             'username': 'postgres',
             'password': 'password',
             'host': 'localhost',
+            'settings': {},  # postgres server settings, see set_pg_settings
         },
     }
 
@@ -145,5 +169,119 @@ def get_conf(bname: str, fname: str, grxport: int, pgxport: int) -> Dict[str, An
         f'{conf["pg"]["iport"]}/tcp': conf['pg']['xport'],
     }
 
+    # Add in the recorded postgres server settings.
+    fname = get_pg_settings_path(conf)
+    if os.path.exists(fname):
+        with open(fname, 'r', encoding='utf-8') as ifp:
+            set_pg_settings(conf, json.load(ifp))
+
     debug(f'conf:\n{json.dumps(conf, indent=2)}')
     return conf
+
+
+def get_pg_settings_path(conf: dict) -> str:
+    '''Get the path of the file that records the postgres server
+    settings of the project.
+
+    Args:
+        conf: The configuration data.
+
+    Returns:
+        path: The file path.
+    '''
+    return os.path.join(os.path.dirname(conf['pg']['mnt']), 'settings.json')
+
+
+def set_pg_settings(conf: dict, settings: Dict[str, str]):
+    '''Set the postgres server settings.
+
+    They are passed to the server as -c options when the
+    container is created. The existing settings are updated.
+
+    Args:
+        conf: The configuration data, it is updated.
+        settings: The settings by name.
+    '''
+    conf['pg']['settings'].update(settings)
+    set_pg_command(conf)
+
+
+def set_pg_command(conf: dict):
+    '''Set the postgres container command from the server settings.
+
+    The ephemeral mode settings are added to the recorded settings.
+
+    Args:
+        conf: The configuration data, it is updated.
+    '''
+    settings = dict(conf['pg']['settings'])
+    if conf['pg']['ephemeral']:
+        settings.update(EPHEMERAL_SETTINGS)
+    kwargs = conf['pg']['client.containers.run']
+    kwargs.pop('command', None)
+    kwargs.pop('shm_size', None)
+    shm_size = get_shm_size(settings)
+    if shm_size:
+        kwargs['shm_size'] = shm_size
+    if settings:
+        command = ['postgres']
+        for name, value in settings.items():
+            command += ['-c', f'{name}={value}']
+        kwargs['command'] = command
+
+
+def get_shm_size(settings: Dict[str, str]) -> int:
+    '''Get the size of /dev/shm for the postgres server settings.
+
+    It is at least the size of the shared buffers so that the
+    parallel queries of a tuned server do not run out of shared
+    memory.
+
+    Args:
+        settings: The settings by name.
+
+    Returns:
+        size: The size in bytes or 0 for the docker default if
+            shared_buffers is not set.
+    '''
+    match = PG_MEMORY_RE.fullmatch(settings.get('shared_buffers', ''))
+    if not match:
+        return 0
+    size = int(match.group(1)) * PG_MEMORY_UNITS[match.group(2) or '']
+    return max(size, MIN_SHM_SIZE)
+
+
+def set_ephemeral(conf: dict, keys: List[str]):
+    '''Put the data directories of the containers on tmpfs.
+
+    The data is kept in memory and it is lost when the container
+    stops. The postgres durability settings are turned off but they
+    are not recorded so the container runs with the recorded settings
+    when it is created without ephemeral mode.
+
+    Args:
+        conf: The configuration data, it is updated.
+        keys: The containers, pg and/or gr.
+    '''
+    for key in keys:
+        conf[key]['ephemeral'] = True
+        conf[key]['client.containers.run']['tmpfs'] = {
+            TMPFS_PATHS[key]: f'rw,uid={os.getuid()},gid={os.getgid()},mode=0700',
+        }
+    set_pg_command(conf)
+
+
+def save_pg_settings(conf: dict):
+    '''Record the postgres server settings in the project directory
+    so that the commands that restart the container reuse them.
+
+    Args:
+        conf: The configuration data.
+    '''
+    fname = get_pg_settings_path(conf)
+    if conf['pg']['settings']:
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        with open(fname, 'w', encoding='utf-8') as ofp:
+            json.dump(conf['pg']['settings'], ofp, indent=2)
+    elif os.path.exists(fname):
+        os.unlink(fname)
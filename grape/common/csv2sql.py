@@ -0,0 +1,933 @@
+'''
+CSV to SQL conversion.
+
+This reads a CSV data file with a header row and converts it to SQL
+instructions that create and populate a table generically. It figures
+out the column types by analyzing the data.
+
+It is used by the ingest command and by the tools/csv2sql.py tool.
+
+The CSV file is streamed twice, once to infer the column types and
+once to write the SQL, so memory use does not depend on the file size.
+
+Several CSV files with the same header can be converted into one
+table. The files are analyzed and written in parallel by a pool of
+worker processes, one file at a time per worker, and the column types
+of all of the files are merged into one table definition.
+
+The input files can be compressed with gzip, bzip2, xz or zstd, they
+are recognized by their magic bytes and decompressed while they are
+streamed. JSON Lines files (.jsonl or .ndjson) are read as rows with
+the keys of the first record as the header.
+
+The input handling, the type inference, the append modes and the
+rollups are in the csvio, csvtypes, csvappend and csvrollup modules.
+'''
+import argparse
+import datetime
+import itertools
+import os
+from pathlib import Path
+import shutil
+import tempfile
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple, TextIO
+
+from grape.common.csvappend import create_sql_append, create_sql_merge, get_append_columns
+from grape.common.csvappend import check_append_args, get_stage, is_old_row
+from grape.common.csvio import CHUNK_ROWS, copy_escape, map_files, read_rows, split_ext
+from grape.common.csvrollup import Rollup, check_rollup_args, rollup_rows
+from grape.common.csvtypes import col_fits, get_column_recs, to_datetime, widen_column
+from grape.common.csvtypes import write_schema
+from grape.common.log import info, err
+
+
+# The partition intervals.
+PARTITION_INTERVALS = ['day', 'week', 'month']
+
+
+def add_csv_args(parser: argparse.ArgumentParser, output: bool = True):
+    '''Add the command line arguments that control the conversion.
+
+    They are shared by the ingest command and the csv2sql.py tool.
+
+    Args:
+        parser: The parser object.
+        output: If false, the arguments that control the SQL output
+            format are not added because the caller decides it.
+    '''
+    parser.add_argument('-a', '--append',
+                        action='store_true',
+                        help='''\
+Append the rows to the table instead of
+replacing it.
+
+The table is created if it does not
+exist. If it does exist, the columns are
+checked against it before any rows are
+added. The check fails if a column does
+not exist or if its type cannot store the
+inferred values, for example a float
+column in an INT table column.
+ ''')
+
+    if output:
+        parser.add_argument('-b', '--batch',
+                            action='store',
+                            type=int,
+                            default=0,
+                            metavar=('N'),
+                            help='''\
+Split the INSERT statement into batches
+of N rows.
+
+A single INSERT statement for millions of
+rows must be parsed by postgres in one go
+which is slow and uses a lot of memory.
+
+The default is a single statement.
+ ''')
+
+    parser.add_argument('-c', '--conversion',
+                        action='append',
+                        help='''\
+Define conversion substitutions.
+
+This is a key/value pair of the
+form: KEY=VALUE.
+
+It can be used to map strings like ZERO
+or NA to a number like 0 for cases where
+there are strings in a column that is
+known to be integers or floats.
+ ''')
+
+    parser.add_argument('-d', '--date',
+                        action='store',
+                        dest='sql_date_type',
+                        default='TIMESTAMP',
+                        help='''\
+The SQL date type to use.
+
+The default is %(default)s.
+ ''')
+
+    parser.add_argument('-f', '--float',
+                        action='store',
+                        dest='sql_float_type',
+                        default='NUMERIC',
+                        help='''\
+The SQL float type to use.
+
+The default is %(default)s.
+ ''')
+
+    parser.add_argument('--high-water',
+                        action='store',
+                        default='',
+                        metavar=('COLUMN'),
+                        help='''\
+Skip the rows with a date in COLUMN that
+is at or below the maximum (the high
+water mark) of the table column before
+the rows are added.
+
+It requires --append or --upsert. The
+ingest command reads the high water mark
+before the rows are sent so the old rows
+are never sent.
+ ''')
+
+    parser.add_argument('-i', '--int',
+                        action='store',
+                        dest='sql_int_type',
+                        default='INT',
+                        help='''\
+The SQL integer type to use.
+
+The default is %(default)s.
+ ''')
+
+    if output:
+        parser.add_argument('-F', '--format',
+                            action='store',
+                            choices=['insert', 'copy'],
+                            default='insert',
+                            help='''\
+The format of the data rows.
+
+   insert - INSERT INTO ... VALUES
+            statements.
+   copy   - COPY ... FROM STDIN with tab
+            separated rows. This is the
+            fastest way to load data using
+            psql.
+
+The default is %(default)s.
+ ''')
+
+        parser.add_argument('-H', '--header',
+                            action='store_true',
+                            dest='header_only',
+                            default='',
+                            help='''\
+Only print the header.
+
+This is useful for verifying that
+the type analysis worked.
+ ''')
+
+    parser.add_argument('-j', '--jobs',
+                        action='store',
+                        type=int,
+                        default=0,
+                        metavar=('N'),
+                        help='''\
+The number of worker processes that
+analyze and convert multiple CSV files in
+parallel, one file at a time per worker.
+
+The default is the number of CPUs.
+ ''')
+
+    parser.add_argument('--no-raw',
+                        action='store_true',
+                        help='''\
+Do not create the raw table, only the
+rollup tables (see --rollup).
+ ''')
+
+    parser.add_argument('--partition',
+                        action='store',
+                        default='',
+                        metavar=('COLUMN'),
+                        help='''\
+Create a table that is partitioned by
+range on the date column COLUMN.
+
+A partition is created for each interval
+(see --partition-interval) that has rows
+plus a default partition for any other
+rows. Queries that filter on the column,
+for example with the grafana $__timeFilter
+macro, only scan the partitions in the
+time range.
+ ''')
+
+    parser.add_argument('--partition-interval',
+                        action='store',
+                        choices=PARTITION_INTERVALS,
+                        default='month',
+                        help='''\
+The time interval of each partition.
+
+Weeks start on Monday.
+
+The default is %(default)s.
+ ''')
+
+    parser.add_argument('--rollup',
+                        action='append',
+                        default=[],
+                        metavar=('BUCKET'),
+                        help='''\
+Create a rollup table that aggregates the
+rows in time buckets of size BUCKET while
+they are streamed. It can be specified
+multiple times.
+
+The size is a number followed by a unit:
+s (seconds), m (minutes), h (hours),
+d (days) or w (weeks), for example 5m or
+1h. The table is named TABLE_BUCKET, for
+example metrics_1h.
+
+The rows are grouped by the time bucket
+and the string columns. The numeric
+columns are aggregated (see --rollup-agg)
+and the number of rows in each group is
+stored in the "count" column.
+ ''')
+
+    parser.add_argument('--rollup-agg',
+                        action='append',
+                        default=[],
+                        metavar=('COLUMN=FUNCS'),
+                        help='''\
+The aggregate functions for a numeric
+column, for example: value=avg,max.
+
+The functions are: avg, sum, min, max,
+first and last. The default for each
+numeric column is avg.
+ ''')
+
+    parser.add_argument('--rollup-time',
+                        action='store',
+                        default='',
+                        metavar=('COLUMN'),
+                        help='''\
+The date column that defines the rollup
+time buckets.
+
+The default is the partition column if
+it is specified, otherwise the first date
+column.
+ ''')
+
+    parser.add_argument('--sample',
+                        action='store',
+                        type=int,
+                        default=0,
+                        metavar=('N'),
+                        help='''\
+Infer the column types from a sample of
+N rows instead of all of the rows.
+
+The sample is the first N/2 rows plus a
+random (reservoir) sample of N/2 of the
+remaining rows.
+
+Every row is validated against the
+inferred types while the SQL is written.
+If a value does not fit, the column type
+is widened with an ALTER TABLE statement
+before the row is inserted.
+ ''')
+
+    parser.add_argument('--schema',
+                        action='store',
+                        default='',
+                        metavar=('FILE'),
+                        help='''\
+Read the column types from a schema file
+that was written by --schema-out and skip
+the type inference.
+
+The rows are validated as they are for
+--sample.
+ ''')
+
+    parser.add_argument('--schema-out',
+                        action='store',
+                        default='',
+                        metavar=('FILE'),
+                        help='''\
+Write the column types to a schema file
+that can be used by --schema in later
+runs. It includes any type widening.
+ ''')
+
+    parser.add_argument('-s', '--str',
+                        action='store',
+                        dest='sql_str_type',
+                        default='TEXT',
+                        help='''\
+The SQL string type to use.
+
+The default is %(default)s.
+ ''')
+
+    parser.add_argument('--upsert',
+                        action='store',
+                        default='',
+                        metavar=('KEYS'),
+                        help='''\
+Insert or update the rows using the comma
+separated key columns KEYS, for example:
+--upsert host,time. It implies --append.
+
+A unique index is created on the keys if
+it does not exist and the rows are staged
+in a temporary table and merged into the
+table using INSERT ... ON CONFLICT. If the
+same keys appear more than once, the last
+row wins.
+
+If the files are ingested in parallel,
+files with the same keys can deadlock.
+ ''')
+
+    parser.add_argument('--time-index',
+                        action='store',
+                        choices=['none', 'brin', 'btree'],
+                        default='none',
+                        help='''\
+Create an index on each date column
+after the rows are loaded.
+
+   none  - No indexes.
+   brin  - Block range indexes. They are
+           very small and fast for time
+           ordered data like metrics.
+   btree - B-tree indexes. They are
+           larger but they work for any
+           row order.
+
+The default is %(default)s.
+ ''')
+
+    parser.add_argument('-t', '--table',
+                        action='store',
+                        default='',
+                        help='''\
+The SQL table name.
+
+If not specified the default name
+is derived from the CSV file name. It
+must be specified for multiple files.
+ ''')
+
+
+def check_csv_args(args: argparse.Namespace, paths: List[str]):
+    '''Check the conversion arguments and fill in the derived values.
+
+    Args:
+        args: The command line arguments from add_csv_args.
+        paths: The CSV file paths from expand_paths.
+    '''
+    if not args.table:
+        if len(paths) > 1:
+            err('the table name (-t) must be specified for multiple CSV files')
+        args.table = Path(split_ext(paths[0])[0]).name
+
+    if args.conversion:
+        for cvt in args.conversion:
+            if '=' not in cvt:
+                err(f'invalid conversion specification: "{cvt}", '
+                    'it must have an equals sign')
+    args.cmap = get_conversions(args)
+
+    if args.sample < 0:
+        err(f'invalid sample size: {args.sample}')
+    if getattr(args, 'batch', 0) < 0:
+        err(f'invalid batch size: {args.batch}')
+    if args.jobs < 0:
+        err(f'invalid number of jobs: {args.jobs}')
+    if not args.jobs:
+        args.jobs = os.cpu_count() or 1
+    if args.schema and not os.path.exists(args.schema):
+        err(f'schema file does not exist: "{args.schema}"')
+    check_append_args(args)
+    check_rollup_args(args)
+
+
+def get_conversions(args: argparse.Namespace) -> Dict[str, str]:
+    '''Create the conversion map from the conversion specifications.
+
+    The map is created once so that the specifications are not
+    split for every column value. The first specification for a
+    key wins.
+
+    Args:
+        args: The command line arguments.
+
+    Returns:
+        cmap: The map of values to their replacements.
+    '''
+    cmap : Dict[str, str] = {}
+    for cvt in args.conversion or []:
+        key, value = cvt.split('=', 1)
+        cmap.setdefault(key, value)
+    return cmap
+
+
+def convert_col(cmap: Dict[str, str], col: str) -> str:
+    '''Convert the column value if necessary.
+
+    Args:
+        cmap: The conversion map from get_conversions.
+        col: The column value.
+
+    Returns:
+        value: The updated value.
+    '''
+    return cmap.get(col, col)
+
+
+def get_bucket(value: datetime.datetime, interval: str) -> datetime.date:
+    '''Get the start of the partition interval of a date.
+
+    Args:
+        value: The date.
+        interval: The partition interval: day, week or month.
+
+    Returns:
+        start: The first day of the interval.
+    '''
+    day = value.date()
+    if interval == 'week':
+        return day - datetime.timedelta(days=day.weekday())
+    if interval == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def get_bucket_end(start: datetime.date, interval: str) -> datetime.date:
+    '''Get the end of a partition interval.
+
+    Args:
+        start: The first day of the interval.
+        interval: The partition interval: day, week or month.
+
+    Returns:
+        end: The first day of the next interval.
+    '''
+    if interval == 'week':
+        return start + datetime.timedelta(days=7)
+    if interval == 'month':
+        return (start.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+    return start + datetime.timedelta(days=1)
+
+
+def scan_buckets(args: argparse.Namespace, col: int, path: str) -> Set[datetime.date]:
+    '''Find the partition intervals that have rows in a CSV file.
+
+    It is called by the worker processes.
+
+    Args:
+        args: The command line arguments.
+        col: The index of the partition column.
+        path: The CSV file path.
+
+    Returns:
+        buckets: The first days of the intervals.
+    '''
+    cmap = args.cmap
+    interval = args.partition_interval
+    buckets = set()
+    rows = read_rows(path)
+    next(rows, None)  # skip the header
+    while True:
+        chunk = list(itertools.islice(rows, CHUNK_ROWS))
+        if not chunk:
+            break
+        for val in {cmap.get(row[col], row[col]) for row in chunk if col < len(row)}:
+            value = to_datetime(val)
+            if value is not None:
+                buckets.add(get_bucket(value, interval))
+    return buckets
+
+
+def get_partitions(args: argparse.Namespace,
+                   paths: List[str],
+                   crecs: list) -> List[Tuple[str, str, str]]:
+    '''Get the partitions of the table.
+
+    The CSV files are scanned in parallel to find the partition
+    intervals that have rows.
+
+    Args:
+        args: The command line arguments.
+        paths: The CSV file paths.
+        crecs: The column records with the types populated.
+
+    Returns:
+        partitions: The partition name, lower bound and upper bound
+            of each partition in time order.
+    '''
+    crec = next((crec for crec in crecs if crec['title'] == args.partition), None)
+    if crec is None:
+        err(f'partition column does not exist: {args.partition}')
+    assert crec
+    if crec['kind'] != 'date':
+        err(f'partition column {args.partition} is not a date column, it is {crec["type"]}')
+    info(f'scanning the {args.partition} column for partitions')
+    buckets: Set[datetime.date] = set()
+    for fbuckets in map_files(scan_buckets, paths, args.jobs, args, crec['index']):
+        buckets |= fbuckets
+    interval = args.partition_interval
+    info(f'found {len(buckets)} {interval} partitions')
+    return [(f'{args.table}_p{start:%Y%m%d}',
+             start.isoformat(),
+             get_bucket_end(start, interval).isoformat())
+            for start in sorted(buckets)]
+
+
+def create_sql_table(ofp: TextIO,  # pylint: disable=too-many-arguments,too-many-positional-arguments
+                     crecs: list,
+                     tname: str,
+                     maxc: int,
+                     partition: str = '',
+                     partitions: Optional[List[Tuple[str, str, str]]] = None,
+                     append: bool = False):
+    '''Create the SQL table commands.
+
+    Writes the SQL commands to the output.
+
+    If a partition column is specified, the table is partitioned by
+    range on it. The primary key of a partitioned table must include
+    the partition column.
+
+    In append mode the table and the partitions are only created if
+    they do not exist.
+
+    Args:
+        ofp: The output file pointer.
+        crecs: The column records with the types populated.
+        tname: The table name.
+        maxc: The maximum column title width.
+        partition: The partition column title.
+        partitions: The partitions from get_partitions.
+        append: Keep the existing table.
+
+    Usage:
+        create_sql_table(sys.stdout, crecs, tname, maxc)
+    '''
+    stmts = []
+    if append:
+        stmts.append(f'CREATE TABLE IF NOT EXISTS {tname} (\n')
+    else:
+        stmts.append(f'DROP TABLE IF EXISTS {tname};\n')
+        stmts.append(f'CREATE TABLE {tname} (\n')
+    if partition:
+        stmts.append(f'  {"id":<{maxc}} SERIAL')
+    else:
+        stmts.append(f'  {"id":<{maxc}} SERIAL PRIMARY KEY')
+    for col in crecs:
+        title = col['title']
+        ctype = col['type']
+        stmts.append(f',\n  {title:<{maxc}} {ctype}')
+    if partition:
+        exists = 'IF NOT EXISTS ' if append else ''
+        stmts.append(f',\n  PRIMARY KEY (id, {partition})')
+        stmts.append(f') PARTITION BY RANGE ({partition});\n')
+        for name, lower, upper in partitions or []:
+            stmts.append(f'CREATE TABLE {exists}{name} PARTITION OF {tname}\n'
+                         f"  FOR VALUES FROM ('{lower}') TO ('{upper}');\n")
+        stmts.append(f'CREATE TABLE {exists}{tname}_default PARTITION OF {tname} DEFAULT;\n')
+    else:
+        stmts.append(');\n')
+    ofp.write(''.join(stmts))
+
+
+def create_sql_indexes(ofp: TextIO, crecs: list, tname: str, method: str):
+    '''Create the indexes on the date columns.
+
+    They are created after the rows are loaded because that is much
+    faster than updating them for each row. The indexes of a
+    partitioned table are created on each partition.
+
+    Args:
+        ofp: The output file pointer.
+        crecs: The column records with the types populated.
+        tname: The table name.
+        method: The index method: none, brin or btree.
+    '''
+    if method == 'none':
+        return
+    stmts = []
+    for crec in crecs:
+        if crec['kind'] == 'date':
+            title = crec['title']
+            stmts.append(f'CREATE INDEX IF NOT EXISTS {tname}_{title}_idx '
+                         f'ON {tname} USING {method} ({title});\n')
+    ofp.write(''.join(stmts))
+
+
+def get_row_statements(args: argparse.Namespace, crecs: list, target: str) -> Tuple[str, str]:
+    '''Get the statements that start and end a set of rows.
+
+    Args:
+        args: The command line arguments.
+        crecs: The column records with the types populated.
+        target: The table that the rows are written to.
+
+    Returns:
+        hdr: The statement that starts a set of rows.
+        end: The statement that ends it.
+    '''
+    titles = [crec['title'] for crec in crecs]
+    if args.format == 'copy':
+        return f'COPY {target} ({", ".join(titles)}) FROM STDIN;\n', '\\.\n'
+    hdr = f'INSERT INTO {target} ('
+    hdr += ', '.join(f'\n  {title}' for title in titles)
+    return hdr + ')\nVALUES', ';\n'
+
+
+def format_row(row: list, crecs: list, copy: bool, first: bool) -> str:
+    '''Format a converted row for the output.
+
+    Args:
+        row: The converted row.
+        crecs: The column records with the types populated.
+        copy: Format the row as COPY text data.
+        first: The row is the first of an INSERT statement.
+
+    Returns:
+        stmt: The formatted row.
+    '''
+    if copy:
+        return '\t'.join(copy_escape(col) for col in row) + '\n'
+    stmt = '' if first else ','
+    stmt += '\n  ('
+    for j, col in enumerate(row):
+        pre = ', ' if j else ''
+        if crecs[j]['quote']:
+            col = col.replace("'", "''")
+            stmt += f"{pre}'{col}'"
+        else:
+            stmt += f'{pre}{col}'
+    return stmt + ')'
+
+
+def read_new_rows(args: argparse.Namespace, path: str, crecs: list) -> Iterator[list]:
+    '''Read the converted rows of a CSV file.
+
+    If the high water mark is known, the rows at or below it are
+    skipped.
+
+    Args:
+        args: The command line arguments.
+        path: The CSV file path.
+        crecs: The column records with the types populated.
+
+    Yields:
+        row: The next converted row.
+    '''
+    _, hwj = get_append_columns(args, crecs) if args.append else ([], -1)
+    mark = args.high_water_mark
+    skipped = 0
+    rows = read_rows(path)
+    next(rows, None)  # skip the header
+    for row in rows:
+        row = [convert_col(args.cmap, col) for col in row]
+        if is_old_row(row, hwj, mark):
+            skipped += 1
+            continue
+        yield row
+    if skipped:
+        info(f'skipped {skipped} rows at or below the high water mark in "{path}"')
+
+
+def widen_row(args: argparse.Namespace,  # pylint: disable=too-many-arguments,too-many-positional-arguments
+              row: list,
+              crecs: list,
+              tnames: List[str],
+              path: str,
+              widen: bool) -> List[str]:
+    '''Widen the columns that the values of a row do not fit.
+
+    Args:
+        args: The command line arguments.
+        row: The converted row.
+        crecs: The column records, the types are updated.
+        tnames: The tables that have the columns.
+        path: The CSV file path.
+        widen: If false, a value that does not fit is an error.
+
+    Returns:
+        stmts: The SQL statements that change the column types.
+    '''
+    stmts = []
+    for j, col in enumerate(row):
+        if j < len(crecs) and not col_fits(crecs[j]['kind'], col):
+            if not widen:
+                err(f'value "{col}" in "{path}" does not fit column '
+                    f'{crecs[j]["title"]} ({crecs[j]["type"]}), '
+                    'use one job (-j 1) to widen the column')
+            stmts.append(widen_column(args, crecs[j], col, tnames))
+    return stmts
+
+
+def create_sql_insert_values(args: argparse.Namespace,  # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+                             ofp: TextIO,
+                             path: str,
+                             crecs: list,
+                             tname: str,
+                             progress: Optional[Callable[[int], None]] = None,
+                             widen: bool = True,
+                             rollup: Optional[Rollup] = None) -> int:
+    '''Create the SQL insert commands.
+
+    This is the second pass. The rows are streamed from the CSV file,
+    converted and written to the output in chunks of CHUNK_ROWS rows
+    so that the output flows while it is being produced.
+
+    The rows are written as INSERT statements, with at most
+    args.batch rows per statement if it is set, or as COPY FROM
+    STDIN data if args.format is 'copy'.
+
+    If the types were not inferred from all of the rows, each value
+    is validated. If a value does not fit, the current statement is
+    ended, the column is widened with an ALTER TABLE statement and a
+    new statement is started.
+
+    In append mode the rows may be staged and merged into the table
+    or old rows may be skipped, see csvappend.
+
+    Args:
+        args: The command line arguments.
+        ofp: The output file pointer.
+        path: The CSV file path.
+        crecs: The column records with the types populated.
+        tname: The table name.
+        progress: Optional function that is called with the number
+            of rows written after each chunk.
+        widen: If false, a value that does not fit is an error. It
+            is used when files are written in parallel because the
+            workers cannot share the widened types.
+        rollup: Optional rollup that the rows are added to. If
+            args.no_raw is set, the rows are only added to it.
+
+    Returns:
+        total: The number of rows written.
+
+    Usage:
+        create_sql_table(ofp, crecs, tname, maxc)
+        create_sql_insert_values(args, ofp, path, crecs, tname)
+    '''
+    if args.no_raw:
+        assert rollup
+        return rollup_rows(args, path, rollup, progress)
+
+    # The staged rows are merged into the table so a widened column
+    # is widened in both of them.
+    stage, stmt = get_stage(args, crecs, tname)
+    stmts = [stmt]
+    target = stage or tname
+    tnames = [stage, tname] if stage else [tname]
+
+    # The statement that starts a set of rows is only written with
+    # the first row of the set so that a widening ALTER TABLE
+    # statement never lands inside an open statement, even for the
+    # first row.
+    hdr, end = get_row_statements(args, crecs, target)
+    copy = args.format == 'copy'
+    validate = bool(args.sample or args.schema)
+    batch = 0 if copy else args.batch
+    num = 0  # the number of rows in the current statement
+    total = 0
+    for row in read_new_rows(args, path, crecs):
+        alters = widen_row(args, row, crecs, tnames, path, widen) if validate else []
+        if alters or (batch and num == batch):
+            if num:
+                stmts.append(end)
+                num = 0
+            stmts.extend(alters)
+        if rollup:
+            rollup.add(row)
+        if not num:
+            stmts.append(hdr)
+        stmts.append(format_row(row, crecs, copy, not num))
+        num += 1
+        total += 1
+        if len(stmts) >= CHUNK_ROWS:
+            ofp.write(''.join(stmts))
+            stmts = []
+            if progress:
+                progress(total)
+    if num:
+        stmts.append(end)
+    if stage:
+        stmts.append(create_sql_merge(args, crecs, tname, stage))
+    ofp.write(''.join(stmts))
+    if progress:
+        progress(total)
+    return total
+
+
+def write_part(args: argparse.Namespace,
+               crecs: list,
+               tmp: str,
+               path: str) -> Tuple[str, int, Optional[Rollup]]:
+    '''Write the rows of one CSV file to a part file.
+
+    It is called by the worker processes.
+
+    Args:
+        args: The command line arguments.
+        crecs: The column records with the types populated.
+        tmp: The directory for the part file.
+        path: The CSV file path.
+
+    Returns:
+        part: The part file path.
+        total: The number of rows written.
+        rollup: The rollup of the file rows if rollups are enabled.
+    '''
+    rollup = Rollup(args, crecs) if args.rollup else None
+    fd, part = tempfile.mkstemp(suffix='.sql', dir=tmp)
+    with open(fd, 'w', encoding='utf-8') as ofp:
+        total = create_sql_insert_values(args, ofp, path, crecs, args.table,
+                                         widen=False, rollup=rollup)
+    return part, total, rollup
+
+
+def write_parts(args: argparse.Namespace,
+                paths: List[str],
+                crecs: list,
+                ofp: TextIO,
+                rollup: Optional[Rollup] = None):
+    '''Write the rows of the CSV files in parallel.
+
+    Each worker writes the rows of a file to a temporary part file
+    and the parts are appended to the output in order as they are
+    finished.
+
+    Args:
+        args: The command line arguments.
+        paths: The CSV file paths.
+        crecs: The column records with the types populated.
+        ofp: The output file pointer.
+        rollup: The rollup that the file rollups are merged into.
+    '''
+    info(f'writing {len(paths)} files with {min(args.jobs, len(paths))} jobs')
+    with tempfile.TemporaryDirectory(prefix='csv2sql-') as tmp:
+        for part, _, prollup in map_files(write_part, paths, args.jobs, args, crecs, tmp):
+            with open(part, encoding='utf-8') as ifp:
+                shutil.copyfileobj(ifp, ofp)
+            os.unlink(part)
+            if rollup and prollup:
+                rollup.merge(prollup)
+
+
+def sql(args: argparse.Namespace, paths: List[str], ofp: TextIO):
+    '''Generate the SQL.
+
+    This assumes that the first line of each CSV file is the header
+    and that all of the files have the same header.
+
+    Each CSV file is read twice. The first pass analyzes all of the
+    rows to figure out the types and the second pass writes the SQL.
+    Only one row per file is held in memory at a time.
+
+    If there are multiple files and jobs, both passes are run in
+    parallel.
+
+    If rollups are specified, the rows are aggregated in the second
+    pass and the rollup tables are written at the end.
+
+    Args:
+        args: The command line arguments.
+        paths: The CSV file paths.
+        ofp: The output file pointer.
+    '''
+    tname = args.table
+    maxc, crecs = get_column_recs(args, paths)
+    partitions = get_partitions(args, paths, crecs) if args.partition else []
+    rollup = Rollup(args, crecs) if args.rollup else None
+
+    if args.rollup and args.high_water and args.high_water_mark is None:
+        err('--rollup cannot be used with --high-water because the high water '
+            'mark is not known, use the ingest command')
+
+    # Define and populate the SQL table.
+    if not args.no_raw:
+        create_sql_table(ofp, crecs, tname, maxc, args.partition, partitions, args.append)
+    if args.append:
+        create_sql_append(args, ofp, crecs, tname)
+
+    if not args.header_only:
+        if args.jobs > 1 and len(paths) > 1:
+            write_parts(args, paths, crecs, ofp, rollup)
+        else:
+            for path in paths:
+                create_sql_insert_values(args, ofp, path, crecs, tname, rollup=rollup)
+
+    if not args.no_raw:
+        create_sql_indexes(ofp, crecs, tname, args.time_index)
+    if rollup:
+        rollup.write(ofp)
+    ofp.write('\n')
+    if args.schema_out:
+        write_schema(args, crecs)
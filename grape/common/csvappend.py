@@ -0,0 +1,194 @@
+'''
+Append and upsert support for the CSV to SQL conversion.
+
+In append mode the rows are added to an existing table. The table
+columns are checked in the database before any rows are written.
+
+For upserts, and for high water marks that are not known in advance,
+the rows are written to a temporary staging table and then merged
+into the table with one INSERT ... SELECT statement. If the high water
+mark is known, the old rows are skipped while the rows are streamed.
+'''
+import argparse
+import datetime
+from typing import List, Optional, Tuple, TextIO
+
+from grape.common.csvtypes import to_datetime
+from grape.common.log import err
+
+
+def check_append_args(args: argparse.Namespace):
+    '''Check the append arguments.
+
+    An upsert implies append mode. The high water mark is set when it
+    is known in advance, see the ingest command.
+
+    Args:
+        args: The command line arguments from add_csv_args.
+    '''
+    if args.upsert:
+        args.append = True
+    if args.high_water and not args.append:
+        err('--high-water requires --append or --upsert')
+    if args.no_raw and args.append:
+        err('--no-raw cannot be used with --append or --upsert')
+    args.high_water_mark = None
+
+
+def get_append_columns(args: argparse.Namespace, crecs: list) -> Tuple[List[str], int]:
+    '''Get the upsert key columns and the high water mark column.
+
+    Args:
+        args: The command line arguments.
+        crecs: The column records with the types populated.
+
+    Returns:
+        keys: The upsert key column titles.
+        hwj: The index of the high water mark column or -1.
+    '''
+    titles = [crec['title'] for crec in crecs]
+    keys = [key.strip() for key in args.upsert.split(',') if key.strip()]
+    for key in keys:
+        if key not in titles:
+            err(f'upsert key column does not exist: {key}')
+    hwj = -1
+    if args.high_water:
+        if args.high_water not in titles:
+            err(f'high water mark column does not exist: {args.high_water}')
+        hwj = titles.index(args.high_water)
+        if crecs[hwj]['kind'] != 'date':
+            err(f'high water mark column {args.high_water} is not a date column')
+    return keys, hwj
+
+
+def create_sql_append(args: argparse.Namespace, ofp: TextIO, crecs: list, tname: str):
+    '''Create the SQL commands that prepare an existing table for
+    appending rows.
+
+    They check that the table columns can store the rows, create the
+    unique index for the upsert keys and, if the high water mark is
+    not known, save it in a temporary table so that the rows can be
+    filtered in the database.
+
+    Args:
+        args: The command line arguments.
+        ofp: The output file pointer.
+        crecs: The column records with the types populated.
+        tname: The table name.
+    '''
+    keys, hwj = get_append_columns(args, crecs)
+    values = ',\n      '.join(f"('{crec['title'].lower()}', '{crec['kind']}')" for crec in crecs)
+    stmts = [f'''DO $$
+DECLARE
+  rec RECORD;
+  typ RECORD;
+BEGIN
+  FOR rec IN SELECT * FROM (VALUES
+      {values}) AS c(name, kind)
+  LOOP
+    SELECT t.typname, t.typcategory INTO typ
+      FROM pg_attribute a JOIN pg_type t ON t.oid = a.atttypid
+      WHERE a.attrelid = '{tname}'::regclass AND a.attname = rec.name
+        AND a.attnum > 0 AND NOT a.attisdropped;
+    IF NOT FOUND THEN
+      RAISE EXCEPTION 'column % does not exist in table {tname}', rec.name;
+    END IF;
+    IF NOT (rec.kind = '?' OR typ.typcategory = 'S'
+            OR (rec.kind = 'int' AND typ.typcategory = 'N')
+            OR (rec.kind = 'float' AND typ.typcategory = 'N'
+                AND typ.typname NOT IN ('int2', 'int4', 'int8'))
+            OR (rec.kind = 'date' AND typ.typcategory = 'D')) THEN
+      RAISE EXCEPTION 'column % of table {tname} is %, it cannot store % values',
+        rec.name, typ.typname, rec.kind;
+    END IF;
+  END LOOP;
+END $$;
+''']
+    if keys:
+        stmts.append(f'CREATE UNIQUE INDEX IF NOT EXISTS {tname}_upsert_idx '
+                     f'ON {tname} ({", ".join(keys)});\n')
+    if hwj >= 0 and args.high_water_mark is None:
+        stmts.append(f'DROP TABLE IF EXISTS {tname}_mark;\n')
+        stmts.append(f'CREATE TEMP TABLE {tname}_mark AS '
+                     f'SELECT max({args.high_water}) AS mark FROM {tname};\n')
+    ofp.write(''.join(stmts))
+
+
+def get_stage(args: argparse.Namespace, crecs: list, tname: str) -> Tuple[str, str]:
+    '''Get the staging table of the rows of a CSV file.
+
+    The rows are staged for upserts and for high water marks that are
+    not known in advance.
+
+    Args:
+        args: The command line arguments.
+        crecs: The column records with the types populated.
+        tname: The table name.
+
+    Returns:
+        stage: The staging table name or an empty string if the rows
+            are written to the table directly.
+        stmt: The SQL commands that create the staging table.
+    '''
+    if not args.append:
+        return '', ''
+    keys, hwj = get_append_columns(args, crecs)
+    if not keys and (hwj < 0 or args.high_water_mark is not None):
+        return '', ''
+    stage = f'{tname}_stage'
+    stmt = f'DROP TABLE IF EXISTS {stage};\n'
+    stmt += f'CREATE TEMP TABLE {stage} (\n  seq BIGSERIAL'
+    stmt += ''.join(f',\n  {crec["title"]} {crec["type"]}' for crec in crecs)
+    return stage, stmt + ');\n'
+
+
+def is_old_row(row: list, hwj: int, mark: Optional[datetime.datetime]) -> bool:
+    '''Is the row at or below a known high water mark?
+
+    Args:
+        row: The converted row.
+        hwj: The index of the high water mark column or -1.
+        mark: The high water mark or None if it is not known.
+
+    Returns:
+        flag: True if the row is skipped.
+    '''
+    if mark is None or not 0 <= hwj < len(row):
+        return False
+    value = to_datetime(row[hwj])
+    return value is not None and value.replace(tzinfo=None) <= mark
+
+
+def create_sql_merge(args: argparse.Namespace, crecs: list, tname: str, stage: str) -> str:
+    '''Create the SQL command that merges the staged rows into the
+    table.
+
+    Args:
+        args: The command line arguments.
+        crecs: The column records with the types populated.
+        tname: The table name.
+        stage: The staging table name.
+
+    Returns:
+        stmt: The SQL commands.
+    '''
+    keys, hwj = get_append_columns(args, crecs)
+    titles = ', '.join(crec['title'] for crec in crecs)
+    src = stage
+    if keys:
+        # ON CONFLICT cannot update the same row twice so only the
+        # last row of each key is merged.
+        kcols = ', '.join(keys)
+        src = f'(SELECT DISTINCT ON ({kcols}) * FROM {stage} ORDER BY {kcols}, seq DESC) AS s'
+    stmt = f'INSERT INTO {tname} ({titles})\nSELECT {titles} FROM {src}'
+    if hwj >= 0 and args.high_water_mark is None:
+        stmt += (f"\nWHERE {args.high_water} > "
+                 f"(SELECT coalesce(mark, '-infinity') FROM {tname}_mark)")
+    if keys:
+        updates = [f'{crec["title"]} = EXCLUDED.{crec["title"]}'
+                   for crec in crecs if crec['title'] not in keys]
+        if updates:
+            stmt += f'\nON CONFLICT ({", ".join(keys)}) DO UPDATE SET\n  ' + ',\n  '.join(updates)
+        else:
+            stmt += f'\nON CONFLICT ({", ".join(keys)}) DO NOTHING'
+    return stmt + f';\nDROP TABLE {stage};\n'
@@ -0,0 +1,301 @@
+'''
+CSV input and output helpers for the CSV to SQL conversion.
+
+The input files are streamed one row at a time so memory use does not
+depend on the file size. They can be compressed with gzip, bzip2, xz
+or zstd, they are recognized by their magic bytes and decompressed
+while they are streamed. JSON Lines files (.jsonl or .ndjson) are read
+as rows with the keys of the first record as the header.
+
+Several files are processed in parallel by a pool of worker
+processes, one file at a time per worker.
+'''
+import bz2
+from concurrent.futures import ProcessPoolExecutor
+import csv as csvmod
+import glob
+import gzip
+import json
+import lzma
+import os
+from typing import Any, Callable, Iterator, List, Tuple, TextIO
+
+try:
+    import zstandard  # type: ignore
+except ImportError:  # zstd input is optional
+    zstandard = None
+
+from grape.common import log
+from grape.common.log import warn, err
+
+
+# The number of rows analyzed or written to the output at a time.
+CHUNK_ROWS = 1000
+
+# The input file extensions. The files that are read from a
+# directory must have one of them optionally followed by one of the
+# compression extensions.
+CSV_EXTS = ['.csv']
+JSONL_EXTS = ['.jsonl', '.ndjson']
+COMPRESSION_EXTS = ['.gz', '.bz2', '.xz', '.zst']
+
+# The compression formats recognized by the magic bytes at the start
+# of the file.
+MAGIC = [
+    (b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bzip2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'\x28\xb5\x2f\xfd', 'zstd'),
+]
+
+# The characters that are escaped in the COPY text format, the
+# backslash is escaped separately.
+COPY_ESCAPES = str.maketrans({'\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def expand_paths(specs: List[str]) -> List[str]:
+    '''Expand the CSV file specifications into a list of files.
+
+    A specification can be a file, a directory or a glob pattern.
+    All of the input files (see split_ext) in a directory are used.
+    The files are sorted within each specification and duplicates
+    are removed.
+
+    Args:
+        specs: The CSV file specifications.
+
+    Returns:
+        paths: The CSV file paths.
+    '''
+    paths = []
+    seen = set()
+    for spec in specs:
+        found = []
+        if os.path.isdir(spec):
+            found = sorted(path for path in glob.glob(os.path.join(glob.escape(spec), '*'))
+                           if os.path.isfile(path) and split_ext(path)[1])
+        elif glob.has_magic(spec):
+            found = sorted(path for path in glob.glob(spec) if os.path.isfile(path))
+        elif os.path.exists(spec):
+            found = [spec]
+        else:
+            err(f'CSV file does not exist: "{spec}"')
+        if not found:
+            err(f'no input files found for "{spec}"')
+        for path in found:
+            if path not in seen:
+                seen.add(path)
+                paths.append(path)
+    return paths
+
+
+def map_files(fct: Callable, paths: List[str], jobs: int, *fargs) -> Iterator:
+    '''Call a function for each file, in parallel if possible.
+
+    The function is called as fct(*fargs, path). If there is more
+    than one file and more than one job, the calls are made by a
+    pool of worker processes so the function and its arguments must
+    be picklable.
+
+    Args:
+        fct: The function.
+        paths: The file paths.
+        jobs: The maximum number of worker processes.
+        fargs: The leading function arguments.
+
+    Yields:
+        result: The function results in the order of the paths.
+    '''
+    if jobs <= 1 or len(paths) <= 1:
+        for path in paths:
+            yield fct(*fargs, path)
+        return
+    # The workers report through the grape logger so they need it
+    # to be initialized in case they are not forked.
+    with ProcessPoolExecutor(max_workers=min(jobs, len(paths)),
+                             initializer=log.init,
+                             initargs=(log.LEVEL,)) as pool:
+        futures = [pool.submit(fct, *fargs, path) for path in paths]
+        try:
+            for future in futures:
+                yield future.result()
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+
+def split_ext(path: str) -> Tuple[str, str]:
+    '''Split the input extension and the compression extension from
+    a file path.
+
+    Args:
+        path: The file path.
+
+    Returns:
+        root: The path without the extensions.
+        ext: The input extension (.csv, .jsonl or .ndjson) with the
+            compression extension, if any. It is empty if the path
+            is not an input file.
+    '''
+    root, ext = os.path.splitext(path)
+    cext = ''
+    if ext.lower() in COMPRESSION_EXTS:
+        cext = ext
+        root, ext = os.path.splitext(root)
+    if ext.lower() in CSV_EXTS + JSONL_EXTS:
+        return root, ext + cext
+    return os.path.splitext(path)[0], ''
+
+
+def is_jsonl(path: str) -> bool:
+    '''Is the file a JSON Lines file?
+
+    Args:
+        path: The file path.
+
+    Returns:
+        flag: True if the file has a JSON Lines extension.
+    '''
+    ext = split_ext(path)[1].lower()
+    return any(ext.startswith(jext) for jext in JSONL_EXTS)
+
+
+def open_input(path: str) -> TextIO:
+    '''Open an input file for reading as text.
+
+    Compressed files are recognized by their magic bytes, not by
+    their extensions, and they are decompressed as they are read so
+    a decompressed copy is never written to disk.
+
+    Args:
+        path: The file path.
+
+    Returns:
+        ifp: The text stream. The newlines are not translated as
+            required by the csv module.
+    '''
+    with open(path, 'rb') as ifp:
+        magic = ifp.read(6)
+    fmt = next((name for prefix, name in MAGIC if magic.startswith(prefix)), '')
+    if fmt == 'gzip':
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    if fmt == 'bzip2':
+        return bz2.open(path, 'rt', encoding='utf-8', newline='')
+    if fmt == 'xz':
+        return lzma.open(path, 'rt', encoding='utf-8', newline='')
+    if fmt == 'zstd':
+        if zstandard is None:
+            err(f'the zstandard package is required to read "{path}", '
+                'install it with: pip install zstandard')
+        return zstandard.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, 'rt', encoding='utf-8', newline='')  # pylint: disable=consider-using-with
+
+
+def json_value(value: Any) -> str:
+    '''Convert a JSON value to a column value.
+
+    Args:
+        value: The JSON value.
+
+    Returns:
+        col: The column value. Nulls are empty, booleans are true or
+            false and arrays and objects are JSON text.
+    '''
+    if isinstance(value, str):
+        return value
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float)):
+        return str(value)
+    return json.dumps(value)
+
+
+def read_json_rows(ifp: TextIO, path: str) -> Iterator[list]:
+    '''Read JSON Lines records as CSV rows.
+
+    The keys of the first record are the header row. A key that is
+    missing from a later record is an empty value and the keys that
+    are not in the first record are ignored with a warning.
+
+    Args:
+        ifp: The text stream.
+        path: The file path for messages.
+
+    Yields:
+        row: The header row and then the value rows.
+    '''
+    keys: List[str] = []
+    keyset = set()
+    ignored = False
+    for num, line in enumerate(ifp, start=1):
+        if not line.strip():
+            continue
+        try:
+            rec = json.loads(line)
+        except ValueError as exc:
+            err(f'invalid JSON in "{path}" line {num}: {exc}')
+        if not isinstance(rec, dict):
+            err(f'JSON record is not an object in "{path}" line {num}')
+        if not keys:
+            keys = list(rec)
+            keyset = set(keys)
+            yield keys
+        elif not ignored and not rec.keys() <= keyset:
+            ignored = True
+            warn(f'ignoring keys that are not in the first record of "{path}" '
+                 f'starting at line {num}')
+        yield [json_value(rec.get(key)) for key in keys]
+
+
+def read_rows(path: str) -> Iterator[list]:
+    '''Read the input file one row at a time.
+
+    The file is streamed so memory use does not depend on the file
+    size. It is called once for each pass.
+
+    Args:
+        path - The file path.
+
+    Yields:
+        row: The next CSV row as a list of column values.
+    '''
+    with open_input(path) as ifp:
+        if is_jsonl(path):
+            yield from read_json_rows(ifp, path)
+        else:
+            reader = csvmod.reader(ifp)
+            for row in reader:
+                assert isinstance(row, list)
+                yield row
+
+
+def read_header(path: str) -> list:
+    '''Read the header row of the CSV file.
+
+    Args:
+        path - The file path.
+
+    Returns:
+        hdr: The header row.
+    '''
+    for row in read_rows(path):
+        return row
+    err(f'CSV file is empty: "{path}"')
+    return []
+
+
+def copy_escape(col: str) -> str:
+    '''Escape a column value for the COPY text format.
+
+    Args:
+        col: The column value.
+
+    Returns:
+        col: The escaped value.
+    '''
+    if '\\' in col:
+        col = col.replace('\\', '\\\\')
+    return col.translate(COPY_ESCAPES)
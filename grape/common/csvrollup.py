@@ -0,0 +1,351 @@
+'''
+Streaming time bucket rollups for the CSV to SQL conversion.
+
+The rows are aggregated into time buckets while they are streamed and
+a rollup table is written for each bucket size. A rollup table has a
+row for each bucket and each combination of the values of the string
+columns (the dimensions) with the aggregates of the numeric columns.
+'''
+import argparse
+import datetime
+import re
+from typing import Callable, Dict, List, Optional, Tuple, TextIO
+
+from grape.common.csvio import CHUNK_ROWS, copy_escape, read_rows
+from grape.common.csvtypes import to_datetime
+from grape.common.log import info, err
+
+
+# The rollup bucket sizes and aggregate functions. The buckets are
+# aligned to midnight of a Monday like the TimescaleDB time_bucket
+# function so that weekly buckets start on Mondays.
+ROLLUP_BUCKET_RE = re.compile(r'[0-9]+[smhdw]')
+ROLLUP_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+ROLLUP_FUNCTIONS = ['avg', 'sum', 'min', 'max', 'first', 'last']
+ROLLUP_ORIGIN = datetime.datetime(2000, 1, 3)
+
+
+def check_rollup_args(args: argparse.Namespace):
+    '''Check the rollup arguments.
+
+    Args:
+        args: The command line arguments from add_csv_args.
+    '''
+    for bucket in args.rollup:
+        if not ROLLUP_BUCKET_RE.fullmatch(bucket) or not int(bucket[:-1]):
+            err(f'invalid rollup bucket size: "{bucket}", expected NUMBER[smhdw]')
+    for spec in args.rollup_agg:
+        fcts = spec.split('=', 1)[-1].split(',')
+        if '=' not in spec or any(fct not in ROLLUP_FUNCTIONS for fct in fcts):
+            err(f'invalid rollup aggregate specification: "{spec}", expected '
+                f'COLUMN=FUNC[,FUNC], FUNC is one of: {", ".join(ROLLUP_FUNCTIONS)}')
+    if args.no_raw and not args.rollup:
+        err('--no-raw requires --rollup')
+    if args.no_raw and args.partition:
+        err('--no-raw and --partition cannot be used together')
+
+
+class Rollup:
+    '''
+    Aggregate rows into time buckets while they are streamed.
+
+    The memory use depends on the number of groups, not on the
+    number of rows. The aggregates of different files can be merged
+    so that the files can be aggregated in parallel.
+    '''
+    def __init__(self, args: argparse.Namespace, crecs: list):
+        '''Define the rollup.
+
+        Args:
+            args: The command line arguments.
+            crecs: The column records with the types populated.
+        '''
+        titles = [crec['title'] for crec in crecs]
+        tcol = args.rollup_time or args.partition
+        if not tcol:
+            tcol = next((crec['title'] for crec in crecs if crec['kind'] == 'date'), '')
+            if not tcol:
+                err('there is no date column for the rollup, use --rollup-time')
+        if tcol not in titles:
+            err(f'rollup time column does not exist: {tcol}')
+        if crecs[titles.index(tcol)]['kind'] != 'date':
+            err(f'rollup time column {tcol} is not a date column')
+
+        fmap = {}
+        for spec in args.rollup_agg:
+            title, fcts = spec.split('=', 1)
+            if title not in titles or crecs[titles.index(title)]['kind'] not in ('int', 'float'):
+                err(f'rollup aggregate column is not a numeric column: {title}')
+            fmap[title] = fcts.split(',')
+
+        self.m_args = args
+        self.m_crecs = crecs
+        self.m_time = titles.index(tcol)
+        self.m_dims = [crec['index'] for crec in crecs
+                       if crec['kind'] in ('str', '?') and crec['index'] != self.m_time]
+        self.m_aggs = [(crec['index'], fmap.get(crec['title'], ['avg']))
+                       for crec in crecs if crec['kind'] in ('int', 'float')]
+        self.m_buckets = [(bucket, get_bucket_size(bucket)) for bucket in args.rollup]
+        self.m_groups: List[Dict[tuple, list]] = [{} for _ in self.m_buckets]
+
+    def add(self, row: list):
+        '''Add a converted row to the aggregates.
+
+        Rows without a valid time are skipped and values that are not
+        numbers are not aggregated.
+
+        Args:
+            row: The converted row.
+        '''
+        if self.m_time >= len(row):
+            return
+        value = to_datetime(row[self.m_time])
+        if value is None:
+            return  # it cannot be bucketed
+        if value.tzinfo:
+            value = value.astimezone(datetime.timezone.utc)  # the offsets may differ
+        stamp = value.replace(tzinfo=None)
+        dims = tuple(row[j] if j < len(row) else '' for j in self.m_dims)
+        nums = []
+        for j, _ in self.m_aggs:
+            try:
+                nums.append(self.parse(j, row[j]))
+            except (IndexError, ValueError):
+                nums.append(None)  # not a number, it is skipped
+        for (_, size), groups in zip(self.m_buckets, self.m_groups):
+            start = ROLLUP_ORIGIN + ((stamp - ROLLUP_ORIGIN) // size) * size
+            key = (start,) + dims
+            group = groups.get(key)
+            if group is None:
+                group = [0] + [[0, 0, None, None, None, None, None, None] for _ in nums]
+                groups[key] = group
+            group[0] += 1
+            for acc, num in zip(group[1:], nums):
+                if num is not None:
+                    self.accumulate(acc, [1, num, num, num, stamp, num, stamp, num])
+
+    def parse(self, j: int, col: str):
+        '''Parse a numeric column value.
+
+        Args:
+            j: The column index.
+            col: The column value.
+
+        Returns:
+            value: The int or float value.
+
+        Raises:
+            ValueError: The value is not a number.
+        '''
+        if self.m_crecs[j]['kind'] == 'int':
+            return int(col)
+        return float(col)
+
+    @staticmethod
+    def accumulate(acc: list, other: list):
+        '''Merge an accumulator into another one.
+
+        An accumulator is the count, sum, min, max, first time,
+        first value, last time and last value.
+
+        Args:
+            acc: The accumulator that is updated.
+            other: The accumulator that is merged into it.
+        '''
+        if not other[0]:
+            return
+        if not acc[0]:
+            acc[:] = other
+            return
+        acc[0] += other[0]
+        acc[1] += other[1]
+        acc[2] = min(acc[2], other[2])
+        acc[3] = max(acc[3], other[3])
+        if other[4] < acc[4]:
+            acc[4:6] = other[4:6]
+        if other[6] >= acc[6]:
+            acc[6:8] = other[6:8]
+
+    def merge(self, other: 'Rollup'):
+        '''Merge the aggregates of another file.
+
+        Args:
+            other: The rollup of the other file, it must have the
+                same definition.
+        '''
+        for groups, ogroups in zip(self.m_groups, other.m_groups):
+            for key, ogroup in ogroups.items():
+                group = groups.get(key)
+                if group is None:
+                    groups[key] = ogroup
+                    continue
+                group[0] += ogroup[0]
+                for acc, oacc in zip(group[1:], ogroup[1:]):
+                    self.accumulate(acc, oacc)
+
+    def columns(self) -> List[Tuple[str, str]]:
+        '''Get the columns of the rollup tables.
+
+        Returns:
+            cols: The title and the SQL type of each column.
+        '''
+        args = self.m_args
+        crecs = self.m_crecs
+        cols = [(crecs[self.m_time]['title'], args.sql_date_type)]
+        cols += [(crecs[j]['title'], crecs[j]['type']) for j in self.m_dims]
+        for j, fcts in self.m_aggs:
+            for fct in fcts:
+                ctype = crecs[j]['type']
+                if fct == 'avg':
+                    ctype = args.sql_float_type
+                elif fct == 'sum' and crecs[j]['kind'] == 'int':
+                    ctype = 'BIGINT'
+                cols.append((f'{crecs[j]["title"]}_{fct}', ctype))
+        cols.append(('count', 'BIGINT'))
+        return cols
+
+    def values(self, key: tuple, group: list) -> List[Optional[str]]:
+        '''Get the column values of a rollup table row.
+
+        Args:
+            key: The bucket start and the dimension values.
+            group: The row count and the accumulators.
+
+        Returns:
+            vals: The column values, None for NULL.
+        '''
+        vals: List[Optional[str]] = [key[0].isoformat(sep=' ')] + list(key[1:])
+        for (_, fcts), acc in zip(self.m_aggs, group[1:]):
+            vals += [self.aggregate(fct, acc) for fct in fcts]
+        vals.append(str(group[0]))
+        return vals
+
+    def write(self, ofp: TextIO):
+        '''Write the rollup tables.
+
+        In append mode the rows are added to the existing tables so
+        a bucket that spans two loads has a row for each load.
+
+        Args:
+            ofp: The output file pointer.
+        '''
+        cols = self.columns()
+        for (bucket, _), groups in zip(self.m_buckets, self.m_groups):
+            self.write_table(ofp, f'{self.m_args.table}_{bucket}', cols, groups)
+
+    def write_table(self,
+                    ofp: TextIO,
+                    tname: str,
+                    cols: List[Tuple[str, str]],
+                    groups: Dict[tuple, list]):
+        '''Write the rollup table of one bucket size.
+
+        Args:
+            ofp: The output file pointer.
+            tname: The rollup table name.
+            cols: The columns from the columns call.
+            groups: The groups of the bucket size.
+        '''
+        args = self.m_args
+        info(f'writing rollup table {tname} with {len(groups)} rows')
+        maxc = max(len(title) for title, _ in cols)
+        if args.append:
+            stmts = [f'CREATE TABLE IF NOT EXISTS {tname} (\n']
+        else:
+            stmts = [f'DROP TABLE IF EXISTS {tname};\n', f'CREATE TABLE {tname} (\n']
+        stmts.append(',\n'.join(f'  {title:<{maxc}} {ctype}' for title, ctype in cols))
+        stmts.append(');\n')
+        titles = ', '.join(title for title, _ in cols)
+        copy = args.format == 'copy'
+        for i, key in enumerate(sorted(groups)):
+            if not i % CHUNK_ROWS:
+                if i:
+                    stmts.append('\\.\n' if copy else ';\n')
+                stmts.append(f'COPY {tname} ({titles}) FROM STDIN;\n' if copy else
+                             f'INSERT INTO {tname} ({titles})\nVALUES\n')
+                ofp.write(''.join(stmts))
+                stmts = []
+            vals = self.values(key, groups[key])
+            if copy:
+                stmts.append('\t'.join(r'\N' if val is None else copy_escape(val)
+                                       for val in vals) + '\n')
+            else:
+                pre = ',\n' if i % CHUNK_ROWS else ''
+                stmts.append(pre + '  (' + ', '.join(
+                    'NULL' if val is None else "'" + val.replace("'", "''") + "'"
+                    for val in vals) + ')')
+        if groups:
+            stmts.append('\\.\n' if copy else ';\n')
+        if args.time_index != 'none':
+            tcol = cols[0][0]
+            stmts.append(f'CREATE INDEX IF NOT EXISTS {tname}_{tcol}_idx ON {tname} '
+                         f'USING {args.time_index} ({tcol});\n')
+        ofp.write(''.join(stmts))
+
+    @staticmethod
+    def aggregate(fct: str, acc: list) -> Optional[str]:
+        '''Get the value of an aggregate function from an accumulator.
+
+        Args:
+            fct: The aggregate function, one of ROLLUP_FUNCTIONS.
+            acc: The accumulator.
+
+        Returns:
+            value: The aggregate value or None if there were no
+                values.
+        '''
+        if not acc[0]:
+            return None
+        value = {
+            'avg': lambda: acc[1] / acc[0],
+            'sum': lambda: acc[1],
+            'min': lambda: acc[2],
+            'max': lambda: acc[3],
+            'first': lambda: acc[5],
+            'last': lambda: acc[7],
+        }[fct]()
+        return str(value)
+
+
+def get_bucket_size(bucket: str) -> datetime.timedelta:
+    '''Get the duration of a rollup bucket.
+
+    Args:
+        bucket: The bucket size, NUMBER[smhdw].
+
+    Returns:
+        size: The bucket duration.
+    '''
+    return datetime.timedelta(seconds=int(bucket[:-1]) * ROLLUP_UNITS[bucket[-1]])
+
+
+def rollup_rows(args: argparse.Namespace,
+                path: str,
+                rollup: Rollup,
+                progress: Optional[Callable[[int], None]] = None) -> int:
+    '''Add the rows of a CSV file to a rollup without writing them.
+
+    It is used when the raw rows are not kept (args.no_raw).
+
+    Args:
+        args: The command line arguments.
+        path: The CSV file path.
+        rollup: The rollup that the rows are added to.
+        progress: Optional function that is called with the number
+            of rows added after each chunk.
+
+    Returns:
+        total: The number of rows added.
+    '''
+    cmap = args.cmap
+    total = 0
+    rows = read_rows(path)
+    next(rows, None)  # skip the header
+    for row in rows:
+        rollup.add([cmap.get(col, col) for col in row])
+        total += 1
+        if progress and not total % CHUNK_ROWS:
+            progress(total)
+    if progress:
+        progress(total)
+    return total
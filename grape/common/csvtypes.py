@@ -0,0 +1,480 @@
+'''
+Column type inference for the CSV to SQL conversion.
+
+Each column value is classified as an int, a float, a date or a
+string and the kinds of all of the values of a column are merged into
+the narrowest kind that stores all of them. The kinds are mapped to
+SQL types by the command line options.
+
+The types are inferred from all of the rows, from a sample of them or
+read from a schema file. If they do not come from all of the rows, a
+value that does not fit is handled by widening its column.
+'''
+import argparse
+import datetime
+import functools
+import itertools
+import json
+import random
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from dateutil.parser import parse as parse_date
+
+from grape.common.csvio import CHUNK_ROWS, map_files, read_header, read_rows
+from grape.common.log import info, err
+
+
+# The patterns that recognize numbers. They only accept values that
+# postgres accepts as numeric literals.
+INT_PAT = r'\s*[-+]?[0-9]+\s*'
+FLOAT_PAT = r'\s*[-+]?(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+)(?:[eE][-+]?[0-9]+)?\s*'
+INT_RE = re.compile(INT_PAT)
+FLOAT_RE = re.compile(FLOAT_PAT)
+
+# The patterns that recognize a whole chunk of column values joined
+# by NUL characters in a single match.
+INTS_RE = re.compile(f'{INT_PAT}(?:\0{INT_PAT})*')
+FLOATS_RE = re.compile(f'{FLOAT_PAT}(?:\0{FLOAT_PAT})*')
+
+# The date formats that are remembered for the date shapes that are
+# seen. A date shape is the date value with the digits masked.
+DATE_FORMATS = [
+    '%Y-%m-%d %H:%M:%S',
+    '%Y/%m/%d',
+    '%Y/%m/%d %H:%M:%S',
+    '%m/%d/%Y',
+    '%m/%d/%Y %H:%M:%S',
+    '%m/%d/%y',
+    '%d/%m/%Y',
+    '%d-%b-%Y',
+    '%d %b %Y',
+    '%b %d %Y',
+    '%b %d, %Y',
+    '%a %b %d %H:%M:%S %Y',
+]
+DATE_SHAPE = str.maketrans('0123456789', '9999999999')
+DATE_MEMO : Dict[str, str] = {}
+
+
+def define_column_recs(hdr: list) -> Tuple[int, list]:
+    '''Define the columns.
+
+    At this point the type is not known.
+
+    Args:
+        hdr: The first line of the CSV. It is assumed to contain the headers.
+
+    Returns:
+        maxc: The maximum column title size.
+        list: The list of type records.
+    '''
+    maxc = 0
+    crecs = []
+    for i, col in enumerate(hdr):
+        crecs.append({
+            'index': i,
+            'title': col,
+            'type': '?',
+            'quote': False,
+        })
+        maxc = max(maxc, len(col))
+    return maxc, crecs
+
+
+def get_type_map(args: argparse.Namespace) -> Dict[str, Tuple[str, bool]]:
+    '''Map the column kinds to the SQL types.
+
+    Args:
+        args: The command line arguments.
+
+    Returns:
+        tmap: The SQL type and the quote flag for each kind.
+    '''
+    return {
+        'date': (args.sql_date_type, True),
+        'float': (args.sql_float_type, False),
+        'int': (args.sql_int_type, False),
+        'str': (args.sql_str_type, True),
+    }
+
+
+def is_int(col: str) -> bool:
+    '''Is this column value an integer?
+
+    Args:
+        col: The column value.
+
+    Returns:
+        flag: True if it is an int or false otherwise.
+    '''
+    return INT_RE.fullmatch(col) is not None
+
+
+def is_float(col: str) -> bool:
+    '''Is this column value a float?
+
+    Args:
+        col: The column value.
+
+    Returns:
+        flag: True if it is a float or false otherwise.
+    '''
+    return FLOAT_RE.fullmatch(col) is not None
+
+
+def to_datetime(col: str) -> Optional[datetime.datetime]:
+    '''Convert a column value to a datetime.
+
+    The general date parser is slow so ISO dates are recognized
+    directly and the format of every other date that is seen is
+    remembered by its shape (the value with the digits masked) so
+    that values with the same shape are converted with strptime.
+    The general parser is only used for new shapes and for values
+    that do not match the remembered format.
+
+    Args:
+        col: The column value.
+
+    Returns:
+        value: The datetime or None if it is not a date.
+    '''
+    try:
+        return datetime.datetime.fromisoformat(col)
+    except ValueError:
+        pass
+
+    shape = col.translate(DATE_SHAPE)
+    fmt = DATE_MEMO.get(shape)
+    if fmt:
+        try:
+            return datetime.datetime.strptime(col, fmt)
+        except ValueError:
+            pass
+
+    try:
+        value = parse_date(col)
+    except (ValueError, OverflowError):
+        return None
+
+    if shape not in DATE_MEMO:
+        DATE_MEMO[shape] = ''
+        for fmt in DATE_FORMATS:
+            try:
+                datetime.datetime.strptime(col, fmt)
+                DATE_MEMO[shape] = fmt
+                break
+            except ValueError:
+                pass
+    return value
+
+
+@functools.lru_cache(maxsize=65536)
+def is_date(col: str) -> bool:
+    '''Is this column value a date?
+
+    Args:
+        col: The column value.
+
+    Returns:
+        flag: True if it is a date or false otherwise.
+    '''
+    return to_datetime(col) is not None
+
+
+def compute_col_kind(col: str) -> str:
+    '''Figure out the kind of a column value.
+
+    This is tricky because "1" can be an integer, a float or a string
+    so the narrowest kind is reported.
+
+    Args:
+        col: The column value after conversion.
+
+    Returns:
+        kind: One of 'int', 'float', 'date' or 'str'.
+    '''
+    if is_int(col):
+        return 'int'
+    if is_float(col):
+        return 'float'
+    if is_date(col):
+        return 'date'
+    return 'str'
+
+
+def merge_col_kinds(prev: str, kind: str) -> str:
+    '''Merge the kind of a column value into the column kind.
+
+    The kinds form a lattice: an int column that sees a float becomes
+    a float column and any other mix becomes a string column, for
+    example:
+       3
+       1.7
+       2020-01-01
+
+    Args:
+        prev: The current column kind, '?' if it is not known yet.
+        kind: The kind of the column value or of another column,
+            '?' if it is not known.
+
+    Returns:
+        kind: The merged column kind.
+    '''
+    if kind == '?':
+        return prev
+    if prev in ('?', kind):
+        return kind
+    if {prev, kind} == {'int', 'float'}:
+        return 'float'
+    return 'str'
+
+
+def compute_chunk_kind(values: Iterable[str], prev: str) -> str:
+    '''Figure out the kind of a chunk of column values.
+
+    The common case of a chunk of numbers is recognized by matching
+    all of the values at once, the values are only classified one at
+    a time if that fails.
+
+    Args:
+        values: The unique converted values in the chunk.
+        prev: The current column kind.
+
+    Returns:
+        kind: The merged column kind.
+    '''
+    if prev in ('?', 'int', 'float'):
+        text = '\0'.join(values)
+        if INTS_RE.fullmatch(text):
+            return merge_col_kinds(prev, 'int')
+        if FLOATS_RE.fullmatch(text):
+            return merge_col_kinds(prev, 'float')
+
+    kind = prev
+    for col in values:
+        kind = merge_col_kinds(kind, compute_col_kind(col))
+        if kind == 'str':
+            break  # it cannot be refined further
+    return kind
+
+
+def sample_rows(path: str, num: int) -> list:
+    '''Sample the rows of the CSV file.
+
+    The sample is the first num/2 rows (the head) and a reservoir
+    sample of num/2 of the remaining rows. The reservoir sample uses
+    a fixed seed so that the results are repeatable.
+
+    Args:
+        path: The CSV file path. First line is a header line.
+        num: The sample size.
+
+    Returns:
+        rows: The sampled rows.
+    '''
+    rows = read_rows(path)
+    next(rows, None)  # skip the header
+    nhead = (num + 1) // 2
+    head = list(itertools.islice(rows, nhead))
+    nres = num - nhead
+    reservoir : List[list] = []
+    rnd = random.Random(0)
+    for i, row in enumerate(rows):
+        if i < nres:
+            reservoir.append(row)
+        else:
+            k = rnd.randint(0, i)
+            if k < nres:
+                reservoir[k] = row
+    info(f'sampled {len(head)} head rows and {len(reservoir)} reservoir rows')
+    return head + reservoir
+
+
+def set_column_kind(args: argparse.Namespace, crec: dict, kind: str):
+    '''Set the kind and the SQL type of a column record.
+
+    Args:
+        args: The command line arguments.
+        crec: The column record.
+        kind: The column kind, '?' if it is not known.
+    '''
+    ctype, quote = get_type_map(args)['str' if kind == '?' else kind]
+    crec['kind'] = kind
+    crec['type'] = ctype
+    crec['quote'] = quote
+
+
+def set_column_types(args: argparse.Namespace, path: str, crecs: list):
+    '''Figure out the column types and set them in the column records.
+
+    This is the first pass. The rows are streamed in chunks of
+    CHUNK_ROWS rows and each column of a chunk is classified as a
+    whole. Only the unique values are classified and a column is
+    no longer analyzed once it is known to be a string. The pass
+    stops early if all of the columns are strings.
+
+    If a sample size is specified, only the sampled rows are
+    classified.
+
+    Args:
+        args: The command line arguments.
+        path: The CSV file path. First line is a header line.
+        crecs: The column types from the define_column_recs call.
+    '''
+    info(f'analyzing column types in "{path}"')
+    cmap = args.cmap
+    kinds = ['?'] * len(crecs)
+    if args.sample:
+        rows : Iterator[list] = iter(sample_rows(path, args.sample))
+    else:
+        rows = read_rows(path)
+        next(rows, None)  # skip the header
+    num = 0
+    while True:
+        chunk = list(itertools.islice(rows, CHUNK_ROWS))
+        if not chunk:
+            break
+        num += len(chunk)
+        for j, prev in enumerate(kinds):
+            if prev == 'str':
+                continue
+            values = {cmap.get(row[j], row[j]) for row in chunk if j < len(row)}
+            kinds[j] = compute_chunk_kind(values, prev)
+        if all(kind == 'str' for kind in kinds):
+            info('all columns are strings, stopping early')
+            break
+    info(f'analyzed {num} rows')
+
+    for crec, kind in zip(crecs, kinds):
+        set_column_kind(args, crec, kind)
+
+
+def read_schema(args: argparse.Namespace, crecs: list):
+    '''Read the column types from a schema file.
+
+    Args:
+        args: The command line arguments.
+        crecs: The column records from the define_column_recs call.
+    '''
+    info(f'reading schema from "{args.schema}"')
+    with open(args.schema, encoding='utf-8') as ifp:
+        schema = json.load(ifp)
+    titles = [rec['title'] for rec in schema['columns']]
+    if titles != [crec['title'] for crec in crecs]:
+        err(f'schema columns do not match the CSV header: "{args.schema}"')
+    for crec, rec in zip(crecs, schema['columns']):
+        set_column_kind(args, crec, rec['kind'])
+
+
+def infer_file(args: argparse.Namespace, path: str) -> List[str]:
+    '''Infer the column kinds of one CSV file.
+
+    It is called by the worker processes.
+
+    Args:
+        args: The command line arguments.
+        path: The CSV file path.
+
+    Returns:
+        kinds: The column kinds.
+    '''
+    _, crecs = define_column_recs(read_header(path))
+    set_column_types(args, path, crecs)
+    return [crec['kind'] for crec in crecs]
+
+
+def get_column_recs(args: argparse.Namespace, paths: List[str]) -> Tuple[int, list]:
+    '''Get the column records with the types populated.
+
+    All of the CSV files must have the same header. The column kinds
+    of each file are inferred in parallel and merged so that the
+    types fit all of the files.
+
+    Args:
+        args: The command line arguments.
+        paths: The CSV file paths.
+
+    Returns:
+        maxc: The maximum column title size.
+        crecs: The column records.
+    '''
+    hdr = read_header(paths[0])
+    for path in paths[1:]:
+        if read_header(path) != hdr:
+            err(f'CSV header of "{path}" does not match "{paths[0]}"')
+    maxc, crecs = define_column_recs(hdr)
+    if args.schema:
+        read_schema(args, crecs)
+        return maxc, crecs
+
+    if len(paths) > 1:
+        info(f'analyzing {len(paths)} files with {min(args.jobs, len(paths))} jobs')
+    kinds = ['?'] * len(crecs)
+    for fkinds in map_files(infer_file, paths, args.jobs, args):
+        kinds = [merge_col_kinds(kind, fkind) for kind, fkind in zip(kinds, fkinds)]
+    for crec, kind in zip(crecs, kinds):
+        set_column_kind(args, crec, kind)
+    return maxc, crecs
+
+
+def write_schema(args: argparse.Namespace, crecs: list):
+    '''Write the column types to a schema file.
+
+    Args:
+        args: The command line arguments.
+        crecs: The column records with the types populated.
+    '''
+    info(f'writing schema to "{args.schema_out}"')
+    schema = {
+        'table': args.table,
+        'columns': [{'title': crec['title'],
+                     'kind': crec['kind'],
+                     'type': crec['type']}
+                    for crec in crecs],
+    }
+    with open(args.schema_out, 'w', encoding='utf-8') as ofp:
+        json.dump(schema, ofp, indent=2)
+        ofp.write('\n')
+
+
+def col_fits(kind: str, col: str) -> bool:
+    '''Does the column value fit the column kind?
+
+    Args:
+        kind: The column kind.
+        col: The column value after conversion.
+
+    Returns:
+        flag: True if the value can be stored in the column.
+    '''
+    if kind in ('?', 'str'):
+        return True
+    if kind == 'int':
+        return is_int(col)
+    if kind == 'float':
+        return is_float(col)
+    return is_date(col)
+
+
+def widen_column(args: argparse.Namespace, crec: dict, col: str, tnames: List[str]) -> str:
+    '''Widen the column type so that the value fits.
+
+    Args:
+        args: The command line arguments.
+        crec: The column record.
+        col: The column value after conversion that does not fit.
+        tnames: The tables that have the column, for example the
+            staging table and the table that it is merged into.
+
+    Returns:
+        stmt: The SQL statements that change the column type.
+    '''
+    prev = crec['type']
+    set_column_kind(args, crec, merge_col_kinds(crec['kind'], compute_col_kind(col)))
+    title = crec['title']
+    ctype = crec['type']
+    info(f'widening column {title} from {prev} to {ctype} for "{col}"')
+    return ''.join(f'ALTER TABLE {tname} ALTER COLUMN {title} '
+                   f'TYPE {ctype} USING {title}::{ctype};\n'
+                   for tname in tnames)
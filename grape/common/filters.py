@@ -0,0 +1,196 @@
+'''
+Dashboard selection filters.
+
+The filters select a subset of the dashboards by folder, tag, uid or
+title pattern. They are pushed down into the grafana search API when
+a server is crawled so that only the selected dashboards are
+downloaded and they are applied directly to the archive data when an
+archive is loaded or exported.
+'''
+import argparse
+import re
+from typing import Any, Dict, List
+from urllib.parse import urlencode
+
+from grape.common.log import info, err
+
+
+# The grafana search API page size limit.
+SEARCH_LIMIT = 5000
+
+# The name of the implicit folder with id 0.
+GENERAL = 'General'
+
+
+def get_filters(opts: argparse.Namespace) -> Dict[str, Any]:
+    '''Get the dashboard filters from the command line options.
+
+    Args:
+        opts: The command line options from add_common_args with
+            '--filter' enabled.
+
+    Returns:
+        filters: The filters.
+    '''
+    filters : Dict[str, Any] = {
+        'folders': list(getattr(opts, 'folder', None) or []),
+        'tags': list(getattr(opts, 'tag', None) or []),
+        'uids': list(getattr(opts, 'uid', None) or []),
+        'title': None,
+    }
+    pattern = getattr(opts, 'title_regex', None)
+    if pattern:
+        try:
+            filters['title'] = re.compile(pattern)
+        except re.error as exc:
+            err(f'invalid --title-regex "{pattern}": {exc}')
+    return filters
+
+
+def is_filtered(filters: Dict[str, Any]) -> bool:
+    '''Are any filters defined?
+
+    Args:
+        filters: The filters.
+
+    Returns:
+        flag: True if at least one filter is defined.
+    '''
+    return bool(filters and (filters['folders'] or filters['tags'] or
+                             filters['uids'] or filters['title']))
+
+
+def match_folder(filters: Dict[str, Any], fid: int, title: str, uid: str = '') -> bool:
+    '''Does the folder match the folder filter?
+
+    A folder matches if its title, uid or id is in the folder filter
+    or if there is no folder filter.
+
+    Args:
+        filters: The filters.
+        fid: The folder id, 0 is the General folder.
+        title: The folder title.
+        uid: The folder uid.
+
+    Returns:
+        flag: True if it matches.
+    '''
+    if not filters['folders']:
+        return True
+    keys = {title, str(fid)}
+    if uid:
+        keys.add(uid)
+    return bool(keys.intersection(filters['folders']))
+
+
+def select_folders(filters: Dict[str, Any], folders: list) -> list:
+    '''Select the folders that match the folder filter.
+
+    Args:
+        filters: The filters.
+        folders: The folder records from api/folders.
+
+    Returns:
+        folders: The matching folder records.
+    '''
+    return [rec for rec in folders
+            if match_folder(filters, rec['id'], rec['title'], rec.get('uid', ''))]
+
+
+def title_query(filters: Dict[str, Any]) -> str:
+    '''Get the literal title substring to push down into a search.
+
+    The search API only supports substring matches so the title
+    pattern can only be pushed down if it does not contain any
+    regular expression syntax.
+
+    Args:
+        filters: The filters.
+
+    Returns:
+        query: The literal substring or an empty string.
+    '''
+    pattern = filters['title'].pattern if filters['title'] else ''
+    if pattern and re.escape(pattern) == pattern:
+        return pattern
+    return ''
+
+
+def search_service(filters: Dict[str, Any], fids: List[int], page: int = 1) -> str:
+    '''Create the dashboard search service request for the filters.
+
+    The search results are paged, a page has at most SEARCH_LIMIT
+    results.
+
+    Args:
+        filters: The filters.
+        fids: The selected folder ids, empty for all folders.
+        page: The page number, the first page is 1.
+
+    Returns:
+        service: The grafana REST service with the query parameters.
+    '''
+    params : List[tuple] = [('type', 'dash-db'), ('limit', SEARCH_LIMIT), ('page', page)]
+    params += [('folderIds', fid) for fid in fids]
+    params += [('tag', tag) for tag in filters['tags']]
+    params += [('dashboardUIDs', uid) for uid in filters['uids']]
+    query = title_query(filters)
+    if query:
+        params.append(('query', query))
+    return 'api/search?' + urlencode(params)
+
+
+def match_search(filters: Dict[str, Any], rec: dict) -> bool:
+    '''Does a search result match the filters that could not be pushed
+    down into the search?
+
+    Args:
+        filters: The filters.
+        rec: The search result record.
+
+    Returns:
+        flag: True if it matches.
+    '''
+    if filters['title'] and not filters['title'].search(rec['title']):
+        return False
+    return True
+
+
+def filter_services(filters: Dict[str, Any], zgr: dict) -> dict:
+    '''Apply the filters to the grafana data from an archive.
+
+    Only the selected dashboards and the folders that contain them
+    are kept. The datasources are always kept because the dashboards
+    may depend on them.
+
+    Args:
+        filters: The filters.
+        zgr: The grafana data from an archive.
+
+    Returns:
+        zgr: The filtered grafana data.
+    '''
+    if not is_filtered(filters):
+        return zgr
+    titles = {rec['id']: rec['title'] for rec in zgr['folders']}
+    uids = {rec['id']: rec.get('uid', '') for rec in zgr['folders']}
+    dashboards = []
+    for rec in zgr['dashboards']:
+        dash = rec['dashboard']
+        fid = rec['folderId']
+        if not match_folder(filters, fid, titles.get(fid, GENERAL), uids.get(fid, '')):
+            continue
+        if filters['uids'] and dash.get('uid') not in filters['uids']:
+            continue
+        if filters['tags'] and not set(filters['tags']).issubset(dash.get('tags', [])):
+            continue
+        if filters['title'] and not filters['title'].search(dash['title']):
+            continue
+        dashboards.append(rec)
+    fids = {rec['folderId'] for rec in dashboards}
+    folders = [rec for rec in zgr['folders'] if rec['id'] in fids]
+    info(f'selected {len(dashboards)} of {len(zgr["dashboards"])} dashboards')
+    result = dict(zgr)
+    result['folders'] = folders
+    result['dashboards'] = dashboards
+    return result
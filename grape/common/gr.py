@@ -2,11 +2,114 @@
 Common grafana utilities.
 '''
 import json
-from functools import reduce
-from typing import List
+from functools import partial, reduce
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 import docker  # type: ignore
 import requests
-from grape.common.log import info, err
+from grape.common.filters import GENERAL, is_filtered, match_folder, match_search
+from grape.common.filters import SEARCH_LIMIT, search_service, select_folders
+from grape.common.journal import Journal
+from grape.common.log import info, warn, err, debug
+
+
+# The grafana authorization is either a (username, password) tuple or
+# an API/service account token string.
+Auth = Union[Tuple[str, str], str]
+
+# The authenticated sessions, one per server and credentials.
+# They are cached so that the credentials are only exchanged once
+# per run.
+SESSIONS : Dict[Tuple[str, str], requests.Session] = {}
+
+
+def get_auth(conf: dict) -> Auth:
+    '''Get the grafana authorization from the configuration data.
+
+    Args:
+        conf: The configuration data.
+
+    Returns:
+        auth: The token, if one is defined, otherwise the
+            (username, password) tuple.
+    '''
+    token = conf['gr'].get('token', '')
+    if token:
+        return token
+    return (conf['gr']['username'], conf['gr']['password'])
+
+
+def get_session(burl: str, auth: Auth) -> requests.Session:
+    '''Get an authenticated session for a grafana server.
+
+    Basic authentication makes grafana hash the password on every
+    request which is expensive on the server for bulk operations so
+    the credentials are exchanged once and the session is reused.
+
+    If the authorization is a token, it is sent as a bearer token.
+    Otherwise the username and password are exchanged for a login
+    session cookie. If the login fails, for example because the login
+    form is disabled, the session falls back to basic authentication.
+
+    Args:
+        burl: The base URL for the grafana server.
+        auth: The token or the (username, password) tuple.
+
+    Returns:
+        session: The authenticated session.
+    '''
+    key = (burl, str(auth))
+    if key in SESSIONS:
+        return SESSIONS[key]
+
+    session = requests.Session()
+    session.headers.update({'Content-Type': 'application/json',
+                            'Accept': 'application/json'})
+    if isinstance(auth, str):
+        info(f'using token authentication for {burl}')
+        session.headers['Authorization'] = f'Bearer {auth}'
+    else:
+        url = f'{burl}/login'
+        try:
+            response = session.post(url, json={'user': auth[0], 'password': auth[1]})
+        except requests.ConnectionError as exc:
+            err(str(exc))
+        if response.status_code == 200 and session.cookies:
+            info(f'using session authentication for {burl}')
+        else:
+            debug(f'login failed with status {response.status_code} from {url}')
+            info(f'using basic authentication for {burl}')
+            session.cookies.clear()
+            session.auth = auth
+    SESSIONS[key] = session
+    return session
+
+
+def send(burl: str, auth: Auth, method: str, url: str, **kwargs: Any) -> requests.Response:
+    '''Send a request to a grafana server using an authenticated session.
+
+    If the request is not authorized, the session is discarded and
+    the credentials are exchanged again once. This handles expired
+    sessions and servers that were re-created during the run.
+
+    Args:
+        burl: The base URL for the grafana server.
+        auth: The token or the (username, password) tuple.
+        method: The HTTP method, for example 'get' or 'post'.
+        url: The full URL.
+        kwargs: Additional request arguments like json.
+
+    Returns:
+        response: The response.
+
+    Raises:
+        requests.ConnectionError: If the server cannot be reached.
+    '''
+    response = get_session(burl, auth).request(method, url, **kwargs)
+    if response.status_code == 401:
+        debug(f'request not authorized, authenticating again: {url}')
+        SESSIONS.pop((burl, str(auth)), None)
+        response = get_session(burl, auth).request(method, url, **kwargs)
+    return response
 
 
 def getpgip(conf: dict) -> str:
@@ -35,7 +138,7 @@ def getpgip(conf: dict) -> str:
     return url
 
 
-def load_datasources(conf: dict, recs: list):
+def load_datasources(conf: dict, recs: list, journal: Optional[Journal] = None):
     '''Load the datasources up to the grafana server.
 
     This sets (loads) the datasources in the grafana server by sending
@@ -44,9 +147,9 @@ def load_datasources(conf: dict, recs: list):
     Args:
         conf: The configuration data.
         recs: The grafana setup data for datasources.
+        journal: The optional checkpoint journal.
     '''
-    headers = {'Content-Type': 'application/json',
-               'Accept': 'application/json'}
+    journal = journal or Journal('')
     pmap = {}
     if 'import' in conf:
         # Load the import mappings.
@@ -69,28 +172,67 @@ def load_datasources(conf: dict, recs: list):
         }
 
     # Update grafana.
-    auth = (conf['gr']['username'], conf['gr']['password'])
     gurl = conf['gr']['url']
+    auth = get_auth(conf)
     for rec in recs:
         name = rec['name']
+        if journal.has('datasource', name):
+            info(f'skipping datasource "{name}", already uploaded')
+            continue
         if name in pmap:
             for key, val in pmap[name].items():
                 rec[key] = val
         url = gurl + '/api/datasources'
         info(f'uploading datasource "{name}" - {url}')
         try:
-            response = requests.post(url,
-                                     json=rec,
-                                     auth=auth,
-                                     headers=headers)
+            response = send(gurl, auth, 'post', url, json=rec)
         except requests.ConnectionError as exc:
             err(str(exc))
         info(f'response status: {response.status_code} from {url}')
         if response.status_code not in (200, 409):
             err(f'upload failed with status {response.status_code} to {url}')
+        journal.add('datasource', name)
+
 
+def update_datasource(conf: dict, name: str):
+    '''Point an existing datasource at the project database.
 
-def load_folders(conf: dict, recs: list):
+    This is used when the grafana state was restored directly from
+    storage because the datasource URL refers to the database of the
+    project that was saved, not the one that is running.
+
+    Args:
+        conf: The configuration data.
+        name: The datasource name.
+    '''
+    gurl = conf['gr']['url']
+    auth = get_auth(conf)
+    url = f'{gurl}/api/datasources/name/{name}'
+    try:
+        response = send(gurl, auth, 'get', url)
+    except requests.ConnectionError as exc:
+        err(str(exc))
+    if response.status_code == 404:
+        info(f'datasource does not exist: "{name}"')
+        return
+    if response.status_code != 200:
+        err(f'request to {url} failed with status {response.status_code}')
+
+    rec = response.json()
+    rec['url'] = getpgip(conf)
+    rec['password'] = conf['pg']['password']
+    url = f'{gurl}/api/datasources/{rec["id"]}'
+    info(f'updating datasource "{name}" - {url}')
+    try:
+        response = send(gurl, auth, 'put', url, json=rec)
+    except requests.ConnectionError as exc:
+        err(str(exc))
+    info(f'response status: {response.status_code} from {url}')
+    if response.status_code != 200:
+        err(f'update failed with status {response.status_code} to {url}')
+
+
+def load_folders(conf: dict, recs: list, journal: Optional[Journal] = None):
     '''Load the folders up to the grafana server.
 
     This sets (loads) the folders on the grafana server by sending the
@@ -99,25 +241,26 @@ def load_folders(conf: dict, recs: list):
     Args:
         conf: The configuration data.
         recs: The grafana setup data for folders.
+        journal: The optional checkpoint journal.
     '''
-    headers = {'Content-Type': 'application/json',
-               'Accept': 'application/json'}
-    auth = (conf['gr']['username'], conf['gr']['password'])
+    journal = journal or Journal('')
     gurl = conf['gr']['url']
+    auth = get_auth(conf)
     for rec in recs:
         name = rec['title']
+        if journal.has('folder', name):
+            info(f'skipping folder "{name}", already uploaded')
+            continue
         url = gurl + '/api/folders'
         info(f'uploading folder "{name}" - {url}')
         try:
-            response = requests.post(url,
-                                     json=rec,
-                                     auth=auth,
-                                     headers=headers)
+            response = send(gurl, auth, 'post', url, json=rec)
         except requests.ConnectionError as exc:
             err(str(exc))
         info(f'response status: {response.status_code} from {url}')
         if response.status_code not in (200, 412, 500):
             err(f'upload failed with status {response.status_code} to {url}')
+        journal.add('folder', name)
 
 
 def load_fmap(conf: dict, recs: list) -> dict:
@@ -139,15 +282,10 @@ def load_fmap(conf: dict, recs: list) -> dict:
         fmapn[title] = {'old': fid, 'new': -1}
 
     # Get the new folders.
-    headers = {'Content-Type': 'application/json',
-               'Accept': 'application/json'}
-    auth = (conf['gr']['username'], conf['gr']['password'])
     url = conf['gr']['url'] + '/api/folders?limit=100'
     info(f'downloading folders from {url}')
     try:
-        response = requests.get(url,
-                                auth=auth,
-                                headers=headers)
+        response = send(conf['gr']['url'], get_auth(conf), 'get', url)
     except requests.ConnectionError as exc:
         err(str(exc))
     if response.status_code != 200:
@@ -170,7 +308,7 @@ def load_fmap(conf: dict, recs: list) -> dict:
     return fmap
 
 
-def load_dashboards(conf: dict, recs: list, fmap: dict):
+def load_dashboards(conf: dict, recs: list, fmap: dict, journal: Optional[Journal] = None):
     '''Load the dashboards up to the grafana server.
 
     This sets (loads) the dashboards on the grafana server by sending
@@ -180,13 +318,17 @@ def load_dashboards(conf: dict, recs: list, fmap: dict):
         conf: The configuration data.
         recs: The grafana setup data for dashboards.
         fmap: The folder/title id map.
+        journal: The optional checkpoint journal.
     '''
-    headers = {'Content-Type': 'application/json',
-               'Accept': 'application/json'}
-    auth = (conf['gr']['username'], conf['gr']['password'])
+    journal = journal or Journal('')
     gurl = conf['gr']['url']
+    auth = get_auth(conf)
     for rec in recs:
         name = rec['dashboard']['title']
+        key = rec['dashboard'].get('uid') or f'{rec["folderId"]}/{name}'
+        if journal.has('dashboard', key):
+            info(f'skipping dashboard "{name}", already uploaded')
+            continue
         fmapid = rec['folderId']
         fid = fmap[fmapid] if fmapid in fmap else 0
         url = gurl + '/api/dashboards/db'
@@ -196,48 +338,45 @@ def load_dashboards(conf: dict, recs: list, fmap: dict):
         jrec['dashboard']['uid'] = None
         jrec['folderId'] = fid
         try:
-            response = requests.post(url,
-                                     json=jrec,
-                                     auth=auth,
-                                     headers=headers)
+            response = send(gurl, auth, 'post', url, json=jrec)
         except requests.ConnectionError as exc:
             err(str(exc))
         info(f'response status: {response.status_code} from {url}')
         if response.status_code not in (200, 400, 412):
             err(f'upload failed with status {response.status_code} to {url}')
+        journal.add('dashboard', key)
 
 
-def load_all(conf: dict, zgr: dict):
+def load_all(conf: dict, zgr: dict, journal: Optional[Journal] = None):
     '''Load the zip conf data up to the grafana server.
 
     Args:
         conf: The configuration data.
         zgr: Zip file that contains the grafana setup data.
+        journal: The optional checkpoint journal that allows an
+            interrupted load to be resumed.
     '''
-    load_datasources(conf, zgr['datasources'])
-    load_folders(conf, zgr['folders'])
-    load_fmap(conf, zgr['folders'])
+    load_datasources(conf, zgr['datasources'], journal)
+    load_folders(conf, zgr['folders'], journal)
     fmap = load_fmap(conf, zgr['folders'])
-    load_dashboards(conf, zgr['dashboards'], fmap)
+    load_dashboards(conf, zgr['dashboards'], fmap, journal)
 
 
-def read_service(burl: str, auth: tuple, service: str) -> dict:
+def read_service(burl: str, auth: Auth, service: str) -> dict:
     '''Read data for a single grafana service.
 
     Args:
         burl: The base URL for the service.
-        auth: The auth tuple.
+        auth: The token or the auth tuple.
         service: The grafana REST service.
 
     Returns:
         response: The JSON from the URL request.
     '''
-    headers = {'Content-Type': 'application/json',
-               'Accept': 'application/json'}
     url = f'{burl}/{service}'
     info(f'reading {url}')
     try:
-        response = requests.get(url, auth=auth, headers=headers)
+        response = send(burl, auth, 'get', url)
     except requests.ConnectionError as exc:
         err(str(exc))
     if response.status_code != 200:
@@ -247,27 +386,69 @@ def read_service(burl: str, auth: tuple, service: str) -> dict:
     return result
 
 
-def read_all_services(burl: str, auth: tuple) -> dict:
-    '''Read the complete grafana state from an external server and
-    save it.
+def read_selected_dashboards(read: Callable[[str], Any],
+                             filters: Dict[str, Any],
+                             folders: list,
+                             journal: Journal) -> list:
+    '''Read the dashboards selected by the filters.
 
-    The services are the datasourceds, folders and dashboards.
+    The filters are pushed down into the search requests so that
+    only the selected dashboards are downloaded. The cost is one
+    search request per page of SEARCH_LIMIT results plus one request
+    per selected dashboard.
 
     Args:
-        burl: The base URL.
-        auth: The auth tuple.
+        read: The function that reads a grafana REST service.
+        filters: The dashboard filters.
+        folders: The folder records from api/folders.
+        journal: The checkpoint journal.
 
     Returns:
-        state: The datasources, folders and dashboards.
+        dashboards: The selected dashboards.
     '''
-    info('reading grafana')
+    fids : List[int] = []
+    if filters['folders']:
+        fids = [rec['id'] for rec in select_folders(filters, folders)]
+        if match_folder(filters, 0, GENERAL):
+            fids.append(0)
+        if not fids:
+            warn(f'no folders match: {filters["folders"]}')
+            return []
+
+    recs = []
+    page = 1
+    while True:
+        service = search_service(filters, fids, page)
+        result = journal.cached('search', service, partial(read, service))
+        recs += result
+        if len(result) < SEARCH_LIMIT:
+            break
+        page += 1
+    dashboards = []
+    for rec in recs:
+        if not match_search(filters, rec):
+            continue
+        uid = rec['uid']
+        service = f'api/dashboards/uid/{uid}'
+        dash = journal.cached('dashboard', uid, partial(read, service))
+        dash['folderId'] = rec.get('folderId', 0)
+        dashboards.append(dash)
+    info(f'selected {len(dashboards)} dashboards')
+    return dashboards
 
-    # Read the datasources.
-    datasources = read_service(burl, auth, 'api/datasources')
 
-    # Read the folders.
-    folders = read_service(burl, auth, 'api/folders?limit=100')
-    info(f'read {len(folders)} folders')
+def read_folder_dashboards(burl: str, auth: Auth, folders: list, journal: Journal) -> list:
+    '''Read all of the dashboards folder by folder.
+
+    Args:
+        burl: The base URL.
+        auth: The token or the auth tuple.
+        folders: The folder records from api/folders.
+        journal: The checkpoint journal.
+
+    Returns:
+        dashboards: The dashboards.
+    '''
     fids : List[int] = reduce(lambda x, y: x+[y] if not y in x else x,
                               [fid['id'] for fid in folders],
                               [])
@@ -278,12 +459,60 @@ def read_all_services(burl: str, auth: tuple) -> dict:
     # Read the dashboards.
     dashboards = []
     for fid in fids:
-        recs = read_service(burl, auth, f'api/search?folderIds={fid}')
+        service = f'api/search?folderIds={fid}'
+        recs = journal.cached('search', fid, partial(read_service, burl, auth, service))
         for rec in recs:
             uid = rec['uid']
-            dash = read_service(burl, auth, f'api/dashboards/uid/{uid}')
+            service = f'api/dashboards/uid/{uid}'
+            dash = journal.cached('dashboard', uid, partial(read_service, burl, auth, service))
             dash['folderId'] = fid
             dashboards.append(dash)
+    return dashboards
+
+
+def read_all_services(burl: str, auth: Auth,
+                      journal: Optional[Journal] = None,
+                      filters: Optional[Dict[str, Any]] = None) -> dict:
+    '''Read the complete grafana state from an external server and
+    save it.
+
+    The services are the datasourceds, folders and dashboards.
+
+    If a journal is specified, each response is recorded in it and
+    responses that were recorded by a previous, interrupted, run are
+    not requested again.
+
+    If filters are specified, only the selected dashboards and the
+    folders that contain them are read.
+
+    Args:
+        burl: The base URL.
+        auth: The token or the auth tuple.
+        journal: The optional checkpoint journal.
+        filters: The optional dashboard filters.
+
+    Returns:
+        state: The datasources, folders and dashboards.
+    '''
+    info('reading grafana')
+    journal = journal or Journal('')
+
+    # Read the datasources.
+    datasources = journal.cached('service', 'datasources',
+                                 lambda: read_service(burl, auth, 'api/datasources'))
+
+    # Read the folders.
+    folders = journal.cached('service', 'folders',
+                             lambda: read_service(burl, auth, 'api/folders?limit=100'))
+    info(f'read {len(folders)} folders')
+    if filters and is_filtered(filters):
+        # Only read the selected dashboards and their folders.
+        dashboards = read_selected_dashboards(lambda s: read_service(burl, auth, s),
+                                              filters, folders, journal)
+        selected = {rec['folderId'] for rec in dashboards}
+        folders = [rec for rec in folders if rec['id'] in selected]
+    else:
+        dashboards = read_folder_dashboards(burl, auth, folders, journal)
 
     result = {
         'datasources': datasources,
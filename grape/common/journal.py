@@ -0,0 +1,192 @@
+'''
+Checkpoint journal for resumable import and export operations.
+
+The journal is an append-only file of JSON lines that lives next to
+the archive. Each line records one completed object (a datasource,
+a folder, a search or a dashboard) so that an interrupted operation
+can be resumed without repeating the requests that already succeeded.
+
+The first line is a header that identifies the operation and the
+grafana server so that a stale journal from a different operation
+is never used by mistake.
+'''
+import json
+import os
+from typing import Any, Callable, Dict, Tuple
+
+from grape.common.log import info, warn
+
+
+class Journal:
+    '''
+    An append-only checkpoint journal.
+
+    A journal with an empty path is disabled. It never records
+    anything and never reports completed work which allows callers
+    to use it unconditionally.
+
+    Usage:
+        journal = Journal(conf['file'] + '.journal', 'import', url, resume)
+        dash = journal.cached('dashboard', uid, lambda: read(uid))
+        ...
+        journal.close()  # success, remove the journal
+    '''
+    def __init__(self, path: str, operation: str = '', url: str = '', resume: bool = False):
+        '''Open the journal.
+
+        If resume is set and the journal exists with a matching
+        header, the completed entries are loaded. Otherwise a new
+        journal is started.
+
+        Args:
+            path: The journal file path, an empty path disables it.
+            operation: The operation name, 'import' or 'export'.
+            url: The grafana server URL.
+            resume: If true, resume from an existing journal.
+        '''
+        self.m_path = path
+        self.m_done : Dict[Tuple[str, str], Any] = {}
+        self.m_ofp = None
+        if not path:
+            return
+
+        header = {'operation': operation, 'url': url}
+        if resume and os.path.exists(path):
+            if self.read(header):
+                info(f'resuming from {path} with {len(self.m_done)} completed entries')
+            else:
+                warn(f'journal does not match this {operation} of {url}, starting over: {path}')
+                self.m_done = {}
+                os.unlink(path)
+        elif os.path.exists(path):
+            info(f'removing old journal, use --resume to use it: {path}')
+            os.unlink(path)
+
+        exists = os.path.exists(path)
+        self.m_ofp = open(path, 'a', encoding='utf-8')  # pylint: disable=consider-using-with
+        if not exists:
+            self.write(header)
+        elif not self.terminated():
+            # Terminate the truncated entry so that it does not
+            # corrupt the next one.
+            self.m_ofp.write('\n')
+
+    def terminated(self) -> bool:
+        '''Is the last journal entry terminated by a newline?
+
+        Returns:
+            flag: True if the journal ends with a newline.
+        '''
+        with open(self.m_path, 'rb') as ifp:
+            ifp.seek(0, os.SEEK_END)
+            if ifp.tell() == 0:
+                return True
+            ifp.seek(-1, os.SEEK_END)
+            return ifp.read(1) == b'\n'
+
+    def read(self, header: dict) -> bool:
+        '''Read the completed entries from an existing journal.
+
+        A partially written last line, which is what an interrupted
+        append looks like, is ignored.
+
+        Args:
+            header: The expected header.
+
+        Returns:
+            flag: True if the header matched.
+        '''
+        with open(self.m_path, 'r', encoding='utf-8') as ifp:
+            for i, line in enumerate(ifp):
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    warn(f'ignoring truncated journal entry at line {i+1}: {self.m_path}')
+                    continue
+                if i == 0:
+                    if rec != header:
+                        return False
+                    continue
+                self.m_done[(rec['kind'], rec['key'])] = rec.get('data')
+        return True
+
+    def write(self, rec: dict):
+        '''Append a record to the journal.
+
+        The record is flushed immediately so that it survives the
+        process being killed.
+
+        Args:
+            rec: The record.
+        '''
+        assert self.m_ofp
+        self.m_ofp.write(json.dumps(rec) + '\n')
+        self.m_ofp.flush()
+
+    def has(self, kind: str, key: Any) -> bool:
+        '''Is this object already complete?
+
+        Args:
+            kind: The object kind, for example 'dashboard'.
+            key: The object key, for example the uid.
+
+        Returns:
+            flag: True if it was recorded as complete.
+        '''
+        return (kind, str(key)) in self.m_done
+
+    def get(self, kind: str, key: Any) -> Any:
+        '''Get the data recorded for a completed object.
+
+        Args:
+            kind: The object kind, for example 'dashboard'.
+            key: The object key, for example the uid.
+
+        Returns:
+            data: The recorded data.
+        '''
+        return self.m_done[(kind, str(key))]
+
+    def add(self, kind: str, key: Any, data: Any = None):
+        '''Record a completed object.
+
+        Args:
+            kind: The object kind, for example 'dashboard'.
+            key: The object key, for example the uid.
+            data: Optional data to return when resuming.
+        '''
+        key = str(key)
+        self.m_done[(kind, key)] = data
+        if self.m_ofp:
+            self.write({'kind': kind, 'key': key, 'data': data})
+
+    def cached(self, kind: str, key: Any, fct: Callable[[], Any]) -> Any:
+        '''Return the recorded data or call the function and record it.
+
+        Args:
+            kind: The object kind, for example 'dashboard'.
+            key: The object key, for example the uid.
+            fct: The function that does the work.
+
+        Returns:
+            data: The data.
+        '''
+        if self.has(kind, key):
+            return self.get(kind, key)
+        data = fct()
+        self.add(kind, key, data)
+        return data
+
+    def close(self, remove: bool = True):
+        '''Close the journal.
+
+        Args:
+            remove: If true, remove the journal file because the
+                operation completed.
+        '''
+        if self.m_ofp:
+            self.m_ofp.close()
+            self.m_ofp = None
+            if remove and os.path.exists(self.m_path):
+                info(f'removing journal: {self.m_path}')
+                os.unlink(self.m_path)
@@ -1,13 +1,54 @@
 '''
 Postgres database utilities.
 '''
+import io
+import json
 import os
+import re
 import subprocess
 import time
+from typing import Any, Callable, Dict, List, TextIO, Tuple
 from grape.common.log import info, err, debug, warn
 
 
-def load(conf: dict, sql: str):
+# The session settings of the bulk restore mode.
+BULK_SETTINGS = {
+    'synchronous_commit': 'off',
+    'maintenance_work_mem': '1GB',
+}
+
+# The statements that cannot run in a transaction block.
+NON_TRANSACTIONAL_RE = re.compile(r'(?:CREATE|DROP) (?:DATABASE|TABLESPACE)\b|ALTER SYSTEM\b')
+
+# The start of a COPY data block.
+COPY_RE = re.compile(r'COPY .* FROM stdin;$')
+
+# The pg_dump object comment, for example:
+#   -- Name: t1; Type: TABLE; Schema: public; Owner: postgres
+#   -- Data for Name: t1; Type: TABLE DATA; Schema: public; Owner: postgres
+DUMP_TYPE_RE = re.compile(r'-- (?:Data for )?Name: .*; Type: ([A-Z ]+);')
+
+# The pg_dump object types of the data and post-data sections.
+DATA_TYPES = {'TABLE DATA', 'SEQUENCE SET', 'BLOBS', 'BLOB DATA', 'LARGE OBJECT'}
+POST_DATA_TYPES = {'INDEX', 'INDEX ATTACH', 'CONSTRAINT', 'FK CONSTRAINT', 'CHECK CONSTRAINT',
+                   'TRIGGER', 'EVENT TRIGGER', 'RULE', 'POLICY', 'ROW SECURITY',
+                   'MATERIALIZED VIEW DATA', 'PUBLICATION', 'PUBLICATION TABLE', 'SUBSCRIPTION'}
+
+# The quoted database name of a \\connect meta-command.
+CONNECT_RE = re.compile(r'(?:-reuse-previous=on )?"dbname=\'((?:[^\']|\'\')*)\'"')
+
+# The phase markers in the psql output.
+PHASE_PREFIX = 'grape-phase:'
+PHASE_SELECT = f"SELECT '{PHASE_PREFIX}"
+PHASE_RE = re.compile(PHASE_PREFIX + r'([a-z -]+):([0-9.]+)')
+
+# The explain_all markers in the psql output, the output of each query
+# follows the query marker and a failed query has an error line.
+EXPLAIN_MARKER = 'grape-explain'
+EXPLAIN_ERROR = 'grape-explain-error:'
+
+
+def load(conf: dict, sql: str, bulk: bool = False, jobs: int = 0):
     '''Load database data.
 
     This is done using psql in the container by copying
@@ -21,40 +62,307 @@ def load(conf: dict, sql: str):
     Args:
         conf: The configuration data.
         sql: The SQL commands used to update the database.
+        bulk: Use the bulk restore mode, see load_bulk.
+        jobs: The number of parallel vacuum jobs in the bulk
+            restore mode, the default is the number of cores.
     '''
-    dbname = conf['pg']['dbname']
-    name = conf['pg']['name']
-    user = conf['pg']['username']
-    mnt = conf['pg']['mnt']
-    tfn = f'mnt{os.getpid()}.sql'
-    tfpx = f'{mnt}/{tfn}'  # external (host) path
-    tfpi = f'/mnt/{tfn}'  # internal (container) path
-
     # Fix minor nit. The role always already exists.
     sql = sql.replace('CREATE ROLE postgres;', '-- CREATE ROLE postgres;')
+    if bulk:
+        load_bulk(conf, sql, jobs or os.cpu_count() or 1)
+        return
+
+    tfn = f'mnt{os.getpid()}.sql'
+    write_mnt(conf, tfn, sql)
+
+    # Write to the database.
+    cmd = ['docker', 'exec', conf['pg']['name'],
+           'psql', '-d', conf['pg']['dbname'], '-U', conf['pg']['username'], '-f', f'/mnt/{tfn}']
+    out = run_retry(cmd)
+    debug(out)
+
+
+def write_mnt(conf: dict, tfn: str, sql: str):
+    '''Write SQL to the mnt directory that is mounted to the
+    database container.
 
-    # Now write the SQL.
+    Args:
+        conf: The configuration data.
+        tfn: The file name, it is /mnt/tfn in the container.
+        sql: The SQL.
+    '''
+    tfpx = os.path.join(conf['pg']['mnt'], tfn)  # external (host) path
     with open(tfpx, 'w', encoding='utf-8') as ofp:
         ofp.write(sql)
     if not os.path.exists(tfpx):
         err(f'file does not exist: {tfpx}')
 
-    # Write to the database.
-    cmd = f'docker exec {name} psql -d {dbname} -U {user} -f {tfpi}'
-    tmax = 10
+
+def run_retry(cmd: List[str], tmax: int = 10) -> str:
+    '''Run a command in the database container.
+
+    The command is retried because the database may still be
+    initializing after the container was created.
+
+    Args:
+        cmd: The command.
+        tmax: The maximum number of tries.
+
+    Returns:
+        out: The command output.
+    '''
     tcnt = 0
-    while tcnt <= tmax:
+    while True:
         try:
-            info(cmd)
-            out = subprocess.check_output(cmd, stderr=subprocess.STDOUT, shell=True)
-            break
+            info(' '.join(cmd))
+            out = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+            return out.decode('utf-8')
         except subprocess.CalledProcessError as exc:
             tcnt += 1
             warn(f'try {tcnt} of {tmax}\n' + exc.output.decode('utf-8'))
             if tcnt == tmax:
                 err(str(exc))
             time.sleep(5)
-    debug(out.decode('utf-8'))
+
+
+def split_dump(sql: str, dbname: str) -> List[dict]:
+    '''Split a pg_dumpall script into the segments that are
+    restored by the bulk restore mode.
+
+    The script is split at the \\connect meta-commands so that each
+    segment runs in one database. The statements that cannot run in
+    a transaction block, for example CREATE DATABASE, are split into
+    their own segments. The pg_dump restricted mode (\\restrict) is
+    carried over the segment boundaries.
+
+    A marker is inserted at each pg_dump pre-data, data and post-data
+    section boundary so that the time of each phase can be measured.
+
+    Args:
+        sql: The pg_dumpall script.
+        dbname: The database of the statements before the first
+            \\connect.
+
+    Returns:
+        segments: A record for each segment with the dbname, the SQL
+            and the single transaction flag.
+    '''
+    segments: List[dict] = []
+    lines: List[str] = []
+    restrict = ''  # the restricted mode key
+    phase = 'pre-data'
+    single = True
+
+    def flush():
+        if has_statements(lines):
+            segments.append({'dbname': dbname,
+                             'sql': get_segment_sql(lines, single, restrict),
+                             'single': single})
+        lines.clear()
+        if restrict:
+            lines.append(f'\\restrict {restrict}\n')
+
+    def start(flag: bool):
+        nonlocal single
+        flush()
+        single = flag
+        if single:
+            lines.append(phase_marker(phase))
+
+    lines.append(phase_marker(phase))
+    copy = False
+    for line in sql.splitlines(keepends=True):
+        if copy:
+            copy = line.rstrip('\n') != '\\.'
+            lines.append(line)
+            continue
+        if line.startswith('\\connect '):
+            phase = 'pre-data'
+            start(True)
+            dbname = get_connect_dbname(line)
+            continue
+        if line.startswith('\\restrict '):
+            restrict = line.split(None, 1)[1].strip()
+        elif line.startswith('\\unrestrict '):
+            restrict = ''
+        elif NON_TRANSACTIONAL_RE.match(line):
+            start(False)
+            lines.append(line)
+            start(True)
+            continue
+        elif COPY_RE.match(line):
+            copy = True
+        match = DUMP_TYPE_RE.match(line)
+        if match:
+            new = get_phase(match.group(1))
+            if new != phase:
+                phase = new
+                lines.append(phase_marker(phase))
+        lines.append(line)
+    flush()
+    return segments
+
+
+def has_statements(lines: List[str]) -> bool:
+    '''Check whether a segment has statements to restore.
+
+    Args:
+        lines: The lines of the segment.
+
+    Returns:
+        found: False if the lines are only comments, blank lines,
+            restricted mode meta-commands and phase markers.
+    '''
+    ignore = ('--', '\\restrict ', '\\unrestrict ', PHASE_SELECT)
+    return any(line.strip() and not line.startswith(ignore) for line in lines)
+
+
+def get_segment_sql(lines: List[str], single: bool, restrict: str) -> str:
+    '''Get the SQL of a segment.
+
+    Args:
+        lines: The lines of the segment.
+        single: The segment runs in a single transaction, it ends
+            with a phase marker.
+        restrict: The restricted mode key or an empty string.
+
+    Returns:
+        sql: The SQL with the restricted mode ended.
+    '''
+    sql = ''.join(lines)
+    if single:
+        sql += phase_marker('end')
+    if restrict:
+        sql += f'\\unrestrict {restrict}\n'
+    return sql
+
+
+def get_connect_dbname(line: str) -> str:
+    '''Get the database name of a pg_dumpall \\connect meta-command.
+
+    Args:
+        line: The meta-command, for example \\connect example or
+            \\connect -reuse-previous=on "dbname='my db'".
+
+    Returns:
+        dbname: The database name.
+    '''
+    arg = line.split(None, 1)[1].strip()
+    match = CONNECT_RE.fullmatch(arg)
+    if match:
+        return match.group(1).replace("''", "'")
+    if arg.startswith('"'):
+        return arg[1:-1].replace('""', '"')
+    return arg
+
+
+def get_phase(otype: str) -> str:
+    '''Get the pg_dump restore phase of an object type.
+
+    Args:
+        otype: The object type from the pg_dump comment.
+
+    Returns:
+        phase: pre-data, data or post-data.
+    '''
+    if otype in DATA_TYPES:
+        return 'data'
+    if otype in POST_DATA_TYPES:
+        return 'post-data'
+    return 'pre-data'
+
+
+def phase_marker(phase: str) -> str:
+    '''Get the SQL that marks the start of a restore phase.
+
+    It prints the phase and the current time.
+
+    Args:
+        phase: The phase.
+
+    Returns:
+        sql: The marker statement.
+    '''
+    return f"{PHASE_SELECT}{phase}:' || extract(epoch FROM clock_timestamp());\n"
+
+
+def get_phase_times(out: str, times: Dict[str, float]):
+    '''Accumulate the phase times from the phase markers in the psql
+    output.
+
+    Args:
+        out: The psql output.
+        times: The seconds by phase, they are updated.
+    '''
+    last = None
+    for match in PHASE_RE.finditer(out):
+        phase, stamp = match.group(1), float(match.group(2))
+        if last:
+            times[last[0]] = times.get(last[0], 0.) + stamp - last[1]
+        last = (phase, stamp)
+
+
+def load_bulk(conf: dict, sql: str, jobs: int):
+    '''Restore a pg_dumpall script with the bulk restore settings.
+
+    Each segment of the script runs in a single transaction with
+    ON_ERROR_STOP so a failed segment is rolled back and can be
+    retried. The session runs with synchronous_commit off and more
+    maintenance_work_mem for the index builds which pg_dump already
+    defers until after the data is loaded. The restore finishes with
+    a parallel VACUUM ANALYZE so that the planner statistics and the
+    visibility maps are current. The time of each phase is reported.
+
+    Args:
+        conf: The configuration data.
+        sql: The pg_dumpall script.
+        jobs: The number of parallel vacuum jobs.
+    '''
+    name = conf['pg']['name']
+    user = conf['pg']['username']
+    pgoptions = ' '.join(f'-c {key}={val}' for key, val in BULK_SETTINGS.items())
+    start = time.time()
+    times: Dict[str, float] = {}
+    segments = split_dump(sql, conf['pg']['dbname'])
+    for i, seg in enumerate(segments):
+        load_segment(conf, f'mnt{os.getpid()}-{i}.sql', seg, pgoptions, times)
+
+    tvac = time.time()
+    cmd = ['docker', 'exec', '-e', f'PGOPTIONS={pgoptions}', name,
+           'vacuumdb', '-U', user, '--all', '--analyze', f'--jobs={jobs}']
+    debug(run_retry(cmd))
+    times['vacuum analyze'] = time.time() - tvac
+
+    info(f'restored {len(segments)} segments in {time.time() - start:.1f}s')
+    for phase in ['pre-data', 'data', 'post-data', 'vacuum analyze']:
+        info(f'   {phase:<14} {times.get(phase, 0.):8.1f}s')
+
+
+def load_segment(conf: dict, tfn: str, seg: dict, pgoptions: str, times: Dict[str, float]):
+    '''Restore a segment of a pg_dumpall script.
+
+    Args:
+        conf: The configuration data.
+        tfn: The name of the file in the mnt directory that the
+            segment is written to, it is removed afterwards.
+        seg: The segment from split_dump.
+        pgoptions: The PGOPTIONS of the bulk restore session.
+        times: The seconds by phase, they are updated.
+    '''
+    write_mnt(conf, tfn, seg['sql'])
+    cmd = ['docker', 'exec', '-e', f'PGOPTIONS={pgoptions}', conf['pg']['name'],
+           'psql', '-v', 'ON_ERROR_STOP=1', '-d', seg['dbname'], '-U', conf['pg']['username'],
+           '-f', f'/mnt/{tfn}']
+    if seg['single']:
+        cmd.insert(cmd.index('psql') + 1, '-1')
+    tseg = time.time()
+    out = run_retry(cmd)
+    debug(out)
+    if seg['single']:
+        get_phase_times(out, times)
+    else:
+        times['pre-data'] = times.get('pre-data', 0.) + time.time() - tseg
+    os.unlink(os.path.join(conf['pg']['mnt'], tfn))
 
 
 def save(conf: dict) -> str:
@@ -82,3 +390,160 @@ def save(conf: dict) -> str:
     sql = str(out.decode('utf-8'))
     info(f'read {len(sql)} bytes of sql for the database')
     return sql
+
+
+def query(conf: dict, sql: str, dbname: str = '') -> List[List[str]]:
+    '''Run a query in the database container and return the rows.
+
+    It uses psql in unaligned tuples only mode so the output
+    is easy to parse. The values are tab separated.
+
+    Args:
+        conf: The configuration data.
+        sql: The SQL query.
+        dbname: The database, the default is the project database.
+
+    Returns:
+        rows: The rows, each row is a list of column values.
+    '''
+    cmd = ['docker', 'exec', conf['pg']['name'],
+           'psql', '-At', '-F', '\t', '-v', 'ON_ERROR_STOP=1',
+           '-d', dbname or conf['pg']['dbname'], '-U', conf['pg']['username'],
+           '-c', sql]
+    debug(' '.join(cmd[:-2]) + f' -c "{sql}"')
+    try:
+        out = subprocess.check_output(cmd, stderr=subprocess.PIPE)
+    except subprocess.CalledProcessError as exc:
+        err(f'query failed: {sql}\n' + exc.stderr.decode('utf-8'))
+    return [line.split('\t') for line in out.decode('utf-8').splitlines()]
+
+
+def pipe(conf: dict, name: str, write: Callable[[TextIO], Any], dbname: str = ''):
+    '''Pipe SQL into psql in the database container.
+
+    The SQL is run in a single transaction.
+
+    Args:
+        conf: The configuration data.
+        name: The name of what is piped for the error message.
+        write: The function that writes the SQL to the pipe.
+        dbname: The database, the default is the project database.
+    '''
+    cmd = ['docker', 'exec', '-i', conf['pg']['name'],
+           'psql', '-q', '-1', '-v', 'ON_ERROR_STOP=1',
+           '-d', dbname or conf['pg']['dbname'], '-U', conf['pg']['username']]
+    debug(' '.join(cmd))
+    with subprocess.Popen(cmd,
+                          stdin=subprocess.PIPE,
+                          stdout=subprocess.DEVNULL,
+                          encoding='utf-8') as proc:
+        assert isinstance(proc.stdin, io.TextIOWrapper)  # text mode, see encoding
+        try:
+            write(proc.stdin)
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass  # psql failed, the status is reported below
+        status = proc.wait()
+    if status:
+        err(f'psql failed for "{name}" with status {status}')
+
+
+def explain(conf: dict, sql: str,  # pylint: disable=too-many-arguments,too-many-positional-arguments
+            options: str = 'ANALYZE, BUFFERS', setup: str = '', timeout: float = 0,
+            dbname: str = '') -> Tuple[list, str]:
+    '''Explain a query in the database container.
+
+    The query is explained in a transaction that is rolled back so
+    that EXPLAIN ANALYZE and the setup SQL do not change anything.
+    A failed query is reported in the result instead of being fatal
+    so that the caller can continue with the next one.
+
+    Args:
+        conf: The configuration data.
+        sql: The SQL query.
+        options: The EXPLAIN options, FORMAT JSON is always added.
+        setup: SQL that is run in the transaction before the query
+            is explained, for example to create an index.
+        timeout: The statement timeout in seconds, 0 is no timeout.
+        dbname: The database, the default is the project database.
+
+    Returns:
+        plan: The JSON plan or an empty list if the query failed.
+        error: The psql error message or an empty string.
+    '''
+    return explain_all(conf, [sql], options, setup, timeout, dbname)[0]
+
+
+def explain_all(conf: dict, sqls: List[str],  # pylint: disable=too-many-arguments,too-many-positional-arguments
+                options: str = 'ANALYZE, BUFFERS', setup: str = '', timeout: float = 0,
+                dbname: str = '') -> List[Tuple[list, str]]:
+    '''Explain queries in one transaction in the database container.
+
+    This is the same as explain for each query except that the setup
+    SQL is only run once. Each query is explained in a savepoint that
+    is rolled back if it fails so that a failed query does not abort
+    the transaction for the queries that follow it. A failed setup
+    fails all of the queries.
+
+    Args:
+        conf: The configuration data.
+        sqls: The SQL queries.
+        options: The EXPLAIN options, FORMAT JSON is always added.
+        setup: SQL that is run in the transaction before the queries
+            are explained.
+        timeout: The statement timeout in seconds, 0 is no timeout.
+        dbname: The database, the default is the project database.
+
+    Returns:
+        results: The JSON plan and the error message of each query.
+    '''
+    cmd = ['docker', 'exec', '-i', conf['pg']['name'],
+           'psql', '-q', '-At', '-d', dbname or conf['pg']['dbname'],
+           '-U', conf['pg']['username']]
+    debug(' '.join(cmd))
+    script = ('\\set ON_ERROR_STOP on\n'
+              'BEGIN;\n'
+              f"SET LOCAL statement_timeout = '{int(timeout * 1000)}';\n"
+              f'{setup}\n'
+              '\\set ON_ERROR_STOP off\n')
+    for sql in sqls:
+        script += (f'SAVEPOINT grape_explain;\n\\echo {EXPLAIN_MARKER}\n'
+                   f'EXPLAIN ({options}, FORMAT JSON)\n{sql.strip().rstrip(";")};\n'
+                   f'\\if :ERROR\n\\echo {EXPLAIN_ERROR} :LAST_ERROR_MESSAGE\n'
+                   'ROLLBACK TO SAVEPOINT grape_explain;\n'
+                   '\\else\nRELEASE SAVEPOINT grape_explain;\n\\endif\n')
+    script += 'ROLLBACK;\n'
+    proc = subprocess.run(cmd, input=script, capture_output=True, encoding='utf-8', check=False)
+    if proc.returncode:
+        error = proc.stderr.strip() or f'psql failed with status {proc.returncode}'
+        return [([], error)] * len(sqls)
+    return parse_explain_output(proc.stdout, len(sqls))
+
+
+def parse_explain_output(out: str, num: int) -> List[Tuple[list, str]]:
+    '''Parse the psql output of explain_all.
+
+    The output of each query follows a marker line, it is either the
+    JSON plan or an error line. The setup output comes before the
+    first marker.
+
+    Args:
+        out: The psql output.
+        num: The number of queries.
+
+    Returns:
+        results: The JSON plan and the error message of each query.
+    '''
+    sections = out.split(EXPLAIN_MARKER + '\n')[1:]
+    if len(sections) != num:
+        return [([], f'unexpected psql output: {out.strip()}')] * num
+    results: List[Tuple[list, str]] = []
+    for section in sections:
+        if section.startswith(EXPLAIN_ERROR):
+            results.append(([], section[len(EXPLAIN_ERROR):].strip()))
+            continue
+        try:
+            results.append((json.loads(section), ''))
+        except json.JSONDecodeError as exc:
+            results.append(([], f'invalid plan in the psql output: {exc}'))
+    return results
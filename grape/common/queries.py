@@ -0,0 +1,523 @@
+'''
+Grafana dashboard SQL query utilities.
+
+Extract the SQL of the postgres panel targets from dashboards and
+expand the grafana macros ($__timeFilter, $__timeGroup, ...) and the
+template variables the way grafana does before it sends the query to
+the database so that the queries can be run directly in psql.
+'''
+import datetime
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import dateutil.parser
+from dateutil.relativedelta import relativedelta
+
+from grape.common.log import warn, err
+
+
+# The grafana postgres datasource types.
+PG_TYPES = ['postgres', 'grafana-postgresql-datasource']
+
+# The datasource of panels whose targets have their own datasources.
+MIXED = '-- Mixed --'
+
+# The relative time units, they are the grafana units.
+TIME_UNITS = {
+    's': relativedelta(seconds=1),
+    'm': relativedelta(minutes=1),
+    'h': relativedelta(hours=1),
+    'd': relativedelta(days=1),
+    'w': relativedelta(weeks=1),
+    'M': relativedelta(months=1),
+    'y': relativedelta(years=1),
+}
+RELATIVE_TIME_RE = re.compile(r'now(?:([-+])([0-9]+)([smhdwMy]))?(?:/([smhdwMy]))?')
+
+# The interval sizes for $__interval and $__timeGroup.
+INTERVAL_RE = re.compile(r'([0-9]+)(ms|s|m|h|d|w)')
+INTERVAL_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+# The number of data points used to compute $__interval. Grafana
+# uses the panel width in pixels, this is a typical value.
+MAX_DATA_POINTS = 1000
+
+# The template variable references: $var, ${var}, ${var:format} and
+# [[var]] or [[var:format]].
+VARIABLE_RE = re.compile(r'\$(\w+)|\[\[(\w+)(?::(\w+))?\]\]|\$\{(\w+)(?::(\w+))?\}')
+
+# The start of a macro call.
+MACRO_RE = re.compile(r'\$__(\w+)\(')
+
+
+def get_pg_datasources(datasources: list) -> Tuple[Dict[str, dict], Optional[dict]]:
+    '''Get the postgres datasources.
+
+    Args:
+        datasources: The datasource records from api/datasources.
+
+    Returns:
+        dsmap: The postgres datasources by name and by uid.
+        default: The default datasource or None.
+    '''
+    dsmap = {}
+    default = None
+    for rec in datasources:
+        if rec.get('isDefault'):
+            default = rec
+        if rec.get('type') in PG_TYPES:
+            dsmap[rec['name']] = rec
+            if rec.get('uid'):
+                dsmap[rec['uid']] = rec
+    return dsmap, default
+
+
+def get_datasource(dsmap: Dict[str, dict], default: Optional[dict], ref: Any) -> Optional[dict]:
+    '''Get the postgres datasource of a panel or a target.
+
+    Args:
+        dsmap: The postgres datasources by name and by uid.
+        default: The default datasource.
+        ref: The datasource reference, a name, a {type, uid} dict or
+            None for the default datasource.
+
+    Returns:
+        datasource: The postgres datasource or None if the reference
+            is not a postgres datasource.
+    '''
+    if ref is None or ref == 'default':
+        return default if default and default.get('type') in PG_TYPES else None
+    if isinstance(ref, dict):
+        if ref.get('type') and ref['type'] not in PG_TYPES:
+            return None
+        ref = ref.get('uid') or ref.get('name')
+    return dsmap.get(str(ref))
+
+
+def get_dbname(datasource: dict) -> str:
+    '''Get the database of a postgres datasource.
+
+    Newer grafana versions keep it in the jsonData.
+
+    Args:
+        datasource: The postgres datasource.
+
+    Returns:
+        dbname: The database name or an empty string if the
+            datasource does not name one.
+    '''
+    return datasource.get('jsonData', {}).get('database') or datasource.get('database') or ''
+
+
+def iter_panels(panels: list) -> Iterable[dict]:
+    '''Iterate over the panels including the panels in rows.
+
+    Args:
+        panels: The dashboard panels.
+
+    Returns:
+        panels: The panels that have targets.
+    '''
+    for panel in panels:
+        if panel.get('targets'):
+            yield panel
+        yield from iter_panels(panel.get('panels', []))
+
+
+def get_panels(dash: dict) -> Iterable[dict]:
+    '''Iterate over the panels of a dashboard that have targets.
+
+    Args:
+        dash: The dashboard.
+
+    Returns:
+        panels: The panels that have targets.
+    '''
+    panels = list(dash.get('panels', []))
+    for row in dash.get('rows', []):
+        # Old schema dashboards.
+        panels += row.get('panels', [])
+    return iter_panels(panels)
+
+
+def get_targets(datasources: list, dashboards: list) -> List[dict]:
+    '''Get the SQL targets of the postgres panels of the dashboards.
+
+    Hidden targets and targets without SQL are ignored.
+
+    Args:
+        datasources: The datasource records from api/datasources.
+        dashboards: The dashboard records from api/dashboards/uid.
+
+    Returns:
+        targets: A record for each target with the dashboard, the
+            panel, the target, the refId, the datasource and the raw
+            SQL.
+    '''
+    dsmap, default = get_pg_datasources(datasources)
+    targets = []
+    for rec in dashboards:
+        dash = rec['dashboard']
+        for panel in get_panels(dash):
+            pds = panel.get('datasource')
+            for target in panel['targets']:
+                sql = target.get('rawSql', '')
+                if target.get('hide') or not sql.strip():
+                    continue
+                ref = pds
+                if pds is None or MIXED in (pds, pds.get('uid') if isinstance(pds, dict) else ''):
+                    ref = target.get('datasource')
+                datasource = get_datasource(dsmap, default, ref)
+                if not datasource:
+                    continue
+                targets.append({
+                    'dashboard': dash,
+                    'panel': panel,
+                    'target': target,
+                    'refId': target.get('refId', ''),
+                    'datasource': datasource,
+                    'sql': sql,
+                })
+    return targets
+
+
+def parse_time(value: str, end: bool = False) -> datetime.datetime:
+    '''Parse a grafana time.
+
+    The time can be relative, for example now-6h or now/d, an epoch
+    time in milliseconds or an absolute time.
+
+    Args:
+        value: The time.
+        end: Round relative times to the end of the unit instead of
+            the start, grafana does that for the end of a range.
+
+    Returns:
+        time: The UTC time.
+    '''
+    now = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+    value = str(value).strip()
+    match = RELATIVE_TIME_RE.fullmatch(value)
+    if match:
+        sign, num, unit, rounding = match.groups()
+        result = now
+        if num:
+            delta = TIME_UNITS[unit] * int(num)
+            result = result + delta if sign == '+' else result - delta
+        if rounding:
+            result = round_time(result, rounding)
+            if end:
+                result = result + TIME_UNITS[rounding] - datetime.timedelta(milliseconds=1)
+        return result
+    if value.isdigit():
+        return datetime.datetime.fromtimestamp(int(value) / 1000, datetime.timezone.utc)
+    try:
+        result = dateutil.parser.parse(value)
+    except (ValueError, OverflowError):
+        err(f'invalid time: "{value}"')
+    if not result.tzinfo:
+        result = result.replace(tzinfo=datetime.timezone.utc)
+    return result.astimezone(datetime.timezone.utc)
+
+
+def round_time(value: datetime.datetime, unit: str) -> datetime.datetime:
+    '''Round a time down to the start of a unit.
+
+    Args:
+        value: The time.
+        unit: The grafana time unit.
+
+    Returns:
+        time: The start of the unit.
+    '''
+    fields = ['y', 'M', 'd', 'h', 'm', 's']
+    if unit == 'w':
+        value -= datetime.timedelta(days=value.weekday())
+        unit = 'd'
+    keep = fields.index(unit) + 1
+    parts = [value.year, value.month, value.day, value.hour, value.minute, value.second]
+    year, month, day, hour, minute, second = parts[:keep] + [1, 1, 1, 0, 0, 0][keep:]
+    return datetime.datetime(year, month, day, hour, minute, second, tzinfo=value.tzinfo)
+
+
+def parse_interval(value: str) -> float:
+    '''Parse a grafana interval.
+
+    Args:
+        value: The interval, for example 5m or '1h'.
+
+    Returns:
+        secs: The number of seconds.
+    '''
+    text = str(value).strip().strip('\'"').lstrip('>')
+    match = INTERVAL_RE.fullmatch(text)
+    if not match:
+        err(f'invalid interval: "{value}"')
+    assert match
+    return int(match.group(1)) * INTERVAL_UNITS[match.group(2)]
+
+
+def format_interval(secs: float) -> str:
+    '''Format an interval in the largest unit that divides it.
+
+    Args:
+        secs: The number of seconds.
+
+    Returns:
+        interval: The interval, for example 5m.
+    '''
+    for unit in ['w', 'd', 'h', 'm', 's']:
+        size = INTERVAL_UNITS[unit]
+        if secs >= size and secs % size == 0:
+            return f'{int(secs // size)}{unit}'
+    return f'{int(secs * 1000)}ms'
+
+
+def get_interval(lower: datetime.datetime, upper: datetime.datetime, minimum: str = '') -> float:
+    '''Get the $__interval of a time range.
+
+    Args:
+        lower: The start of the time range.
+        upper: The end of the time range.
+        minimum: The optional minimum interval of the panel.
+
+    Returns:
+        secs: The interval in seconds.
+    '''
+    secs: float = max(1, round((upper - lower).total_seconds() / MAX_DATA_POINTS))
+    if minimum:
+        secs = max(secs, parse_interval(minimum))
+    return secs
+
+
+def get_variables(dash: dict, overrides: Dict[str, str]) -> Dict[str, Tuple[List[str], bool]]:
+    '''Get the current values of the template variables of a dashboard.
+
+    Args:
+        dash: The dashboard.
+        overrides: The values from the command line by name. Multiple
+            values are comma separated.
+
+    Returns:
+        variables: The values and the multi-value flag by name.
+    '''
+    variables = {}
+    for var in dash.get('templating', {}).get('list', []):
+        name = var.get('name', '')
+        multi = bool(var.get('multi') or var.get('includeAll'))
+        if name in overrides:
+            variables[name] = (overrides[name].split(','), multi)
+            continue
+        value = var.get('current', {}).get('value', var.get('query', ''))
+        values = value if isinstance(value, list) else [value]
+        if '$__all' in values:
+            if var.get('allValue'):
+                variables[name] = ([var['allValue']], False)
+                continue
+            values = [opt['value'] for opt in var.get('options', [])
+                      if opt.get('value') != '$__all']
+            if not values:
+                warn(f'no options for "All" of variable "{name}" in "{dash.get("title", "")}", '
+                     'use --var to set it')
+        variables[name] = ([str(value) for value in values], multi)
+    for name, value in overrides.items():
+        if name not in variables:
+            variables[name] = (value.split(','), ',' in value)
+    return variables
+
+
+def format_variable(values: List[str], multi: bool, fmt: str) -> str:
+    '''Format a template variable value like the grafana SQL datasources.
+
+    Args:
+        values: The values.
+        multi: The variable is multi-value or has an "All" option.
+        fmt: The format, for example csv or sqlstring, or an empty
+            string for the default format.
+
+    Returns:
+        text: The value text.
+    '''
+    def quote(value: str, char: str = "'") -> str:
+        return char + value.replace(char, char + char) + char
+
+    if fmt in ('csv', 'raw'):
+        return ','.join(values)
+    if fmt == 'pipe':
+        return '|'.join(values)
+    if fmt == 'doublequote':
+        return ','.join(quote(value, '"') for value in values)
+    if fmt in ('sqlstring', 'singlequote') or (not fmt and (multi or len(values) > 1)):
+        return ','.join(quote(value) for value in values)
+    return ','.join(values)
+
+
+def expand_variables(sql: str,
+                     variables: Dict[str, Tuple[List[str], bool]],
+                     builtins: Dict[str, str]) -> str:
+    '''Expand the template variable references.
+
+    Unknown variables are left as is.
+
+    Args:
+        sql: The SQL.
+        variables: The values and the multi-value flag by name.
+        builtins: The values of the builtin variables like __from.
+
+    Returns:
+        sql: The expanded SQL.
+    '''
+    def replace(match: re.Match) -> str:
+        name = match.group(1) or match.group(2) or match.group(4)
+        fmt = match.group(3) or match.group(5) or ''
+        if name in builtins:
+            return builtins[name]
+        if name in variables:
+            return format_variable(variables[name][0], variables[name][1], fmt)
+        return match.group(0)
+    return VARIABLE_RE.sub(replace, sql)
+
+
+def split_args(sql: str, start: int) -> Tuple[List[str], int]:
+    '''Split the arguments of a macro call.
+
+    Args:
+        sql: The SQL.
+        start: The offset after the opening parenthesis.
+
+    Returns:
+        args: The stripped arguments.
+        end: The offset after the closing parenthesis.
+    '''
+    args = []
+    depth = 0
+    quote = ''
+    arg = start
+    for i in range(start, len(sql)):
+        char = sql[i]
+        if quote:
+            if char == quote:
+                quote = ''
+        elif char in '\'"':
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            if not depth:
+                args.append(sql[arg:i].strip())
+                return [a for a in args if a], i + 1
+            depth -= 1
+        elif char == ',' and not depth:
+            args.append(sql[arg:i].strip())
+            arg = i + 1
+    err(f'unterminated macro in: {sql}')
+    return [], len(sql)
+
+
+def expand_macro(name: str, args: List[str], lower: datetime.datetime,
+                 upper: datetime.datetime, interval: float) -> Optional[str]:
+    '''Expand a grafana postgres macro.
+
+    Args:
+        name: The macro name without the $__ prefix.
+        args: The macro arguments.
+        lower: The start of the time range.
+        upper: The end of the time range.
+        interval: The $__interval in seconds.
+
+    Returns:
+        sql: The expansion or None if the macro is not known.
+    '''
+    def stamp(value: datetime.datetime) -> str:
+        return "'" + value.strftime('%Y-%m-%dT%H:%M:%SZ') + "'"
+
+    def group_secs() -> float:
+        if len(args) < 2 or args[1].strip('\'"') in ('auto', '$__interval'):
+            return interval
+        return parse_interval(args[1])
+
+    def secs(value: float) -> str:
+        return str(int(value)) if value == int(value) else str(value)
+
+    col = args[0] if args else ''
+    expansions = {
+        'time': lambda: f'{col} AS "time"',
+        'timeEpoch': lambda: f'extract(epoch from {col}) AS "time"',
+        'timeFilter': lambda: f'{col} BETWEEN {stamp(lower)} AND {stamp(upper)}',
+        'timeFrom': lambda: stamp(lower),
+        'timeTo': lambda: stamp(upper),
+        'timeGroup': lambda: (f'floor(extract(epoch from {col})/{secs(group_secs())})'
+                              f'*{secs(group_secs())}'),
+        'timeGroupAlias': lambda: (f'floor(extract(epoch from {col})/{secs(group_secs())})'
+                                   f'*{secs(group_secs())} AS "time"'),
+        'unixEpochFilter': lambda: (f'{col} >= {int(lower.timestamp())} AND '
+                                    f'{col} <= {int(upper.timestamp())}'),
+        'unixEpochNanoFilter': lambda: (f'{col} >= {int(lower.timestamp()) * 10**9} AND '
+                                        f'{col} <= {int(upper.timestamp()) * 10**9}'),
+        'unixEpochFrom': lambda: str(int(lower.timestamp())),
+        'unixEpochTo': lambda: str(int(upper.timestamp())),
+        'unixEpochGroup': lambda: f'floor({col}/{secs(group_secs())})*{secs(group_secs())}',
+        'unixEpochGroupAlias': lambda: (f'floor({col}/{secs(group_secs())})'
+                                        f'*{secs(group_secs())} AS "time"'),
+    }
+    if name not in expansions:
+        return None
+    return expansions[name]()
+
+
+def expand(sql: str, variables: Dict[str, Tuple[List[str], bool]],
+           lower: datetime.datetime, upper: datetime.datetime, interval: float) -> str:
+    '''Expand the template variables and the macros of a query.
+
+    Args:
+        sql: The raw SQL of the target.
+        variables: The template variable values from get_variables.
+        lower: The start of the time range.
+        upper: The end of the time range.
+        interval: The $__interval in seconds.
+
+    Returns:
+        sql: The SQL that grafana would send to the database.
+    '''
+    builtins = {
+        '__interval': format_interval(interval),
+        '__interval_ms': str(int(interval * 1000)),
+        '__from': str(int(lower.timestamp() * 1000)),
+        '__to': str(int(upper.timestamp() * 1000)),
+    }
+    sql = expand_variables(sql, variables, builtins)
+    result = ''
+    pos = 0
+    for match in MACRO_RE.finditer(sql):
+        if match.start() < pos:
+            continue  # nested in a macro that was already expanded
+        args, end = split_args(sql, match.end())
+        expansion = expand_macro(match.group(1), args, lower, upper, interval)
+        if expansion is None:
+            warn(f'unknown macro: $__{match.group(1)}')
+            continue
+        result += sql[pos:match.start()] + expansion
+        pos = end
+    return result + sql[pos:]
+
+
+def normalize(sql: str) -> str:
+    '''Normalize a query so that it can be matched with the
+    pg_stat_statements query text.
+
+    The comments are removed, the string and numeric literals and
+    the $N parameters are replaced by ?, the whitespace is
+    collapsed and the query is converted to lowercase.
+
+    Args:
+        sql: The SQL, either an expanded panel query or a
+            pg_stat_statements query.
+
+    Returns:
+        sql: The normalized SQL.
+    '''
+    sql = re.sub(r'--[^\n]*|/\*.*?\*/', ' ', sql, flags=re.DOTALL)
+    sql = re.sub(r"'(?:[^']|'')*'|\$[0-9]+|(?<![\w$.])-?[0-9]+(?:\.[0-9]+)?(?:e[-+]?[0-9]+)?",
+                 '?', sql, flags=re.IGNORECASE)
+    sql = re.sub(r'\s*([(),;=<>+*/-])\s*', r'\1', sql)
+    return re.sub(r'\s+', ' ', sql).strip().rstrip(';').lower()
@@ -0,0 +1,277 @@
+'''
+Snapshot utilities for local grape projects.
+
+A snapshot captures the storage of a local service directly rather
+than reading it through the service. This makes save and load times
+independent of the number of dashboards.
+
+The grafana snapshot is a consistent copy of the grafana SQLite
+database (grafana.db) that is made using the SQLite online backup API
+so it is safe to take while the grafana container is running.
+
+The postgres snapshot is a tar stream of the postgres data directory
+(pgdata). The database container is stopped while the data directory
+is captured so that the files are consistent. If the filesystem
+supports reflinks (copy-on-write clones, for example on btrfs or XFS),
+the data directory is cloned and the container is restarted before
+the clone is streamed into the archive which keeps the down time to a
+few seconds. Hardlinks are not used because postgres modifies its
+files in place so a hardlinked copy would change under the tar.
+'''
+import os
+import shutil
+import sqlite3
+import subprocess
+import tarfile
+import tempfile
+from contextlib import closing
+from zipfile import ZipFile, ZIP_DEFLATED
+
+import docker  # type: ignore
+
+from grape.common.log import info, err, warn
+
+
+# The archive member names.
+GRDB = 'gr.db'
+PGTAR = 'pg.tar'
+
+
+def grdb_path(conf: dict) -> str:
+    '''Get the host path of the grafana database.
+
+    Args:
+        conf: The configuration data.
+
+    Returns:
+        path: The path to grafana.db in the grafana mount.
+    '''
+    return os.path.join(conf['gr']['mnt'], 'grdata', 'grafana.db')
+
+
+def backup_grdb(src: str, dst: str):
+    '''Make a consistent copy of a grafana database.
+
+    The SQLite online backup API copies the database while holding a
+    read lock so the copy is consistent even if grafana is writing to
+    it.
+
+    Args:
+        src: The source database path.
+        dst: The destination database path.
+    '''
+    if not os.path.exists(src):
+        err(f'grafana database does not exist: {src}')
+    info(f'backing up {src} to {dst}')
+    with closing(sqlite3.connect(src, timeout=30)) as scon:
+        with closing(sqlite3.connect(dst)) as dcon:
+            scon.backup(dcon)
+
+
+def save_grdb(conf: dict, zfp: ZipFile):
+    '''Save a snapshot of the grafana database in the archive.
+
+    Args:
+        conf: The configuration data.
+        zfp: The archive open for writing.
+    '''
+    check_persistent(conf, 'gr')
+    with tempfile.TemporaryDirectory() as tdir:
+        tmp = os.path.join(tdir, 'grafana.db')
+        backup_grdb(grdb_path(conf), tmp)
+        info(f'writing {GRDB} ({os.path.getsize(tmp)} bytes)')
+        zfp.write(tmp, GRDB, compress_type=ZIP_DEFLATED)
+
+
+def load_grdb(conf: dict, ofn: str):
+    '''Restore the grafana database from the archive.
+
+    This must be done before the grafana container is started.
+
+    Args:
+        conf: The configuration data.
+        ofn: The archive file name.
+    '''
+    path = grdb_path(conf)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    info(f'restoring {path} from {ofn}')
+    with ZipFile(ofn, 'r') as zfp:
+        with zfp.open(GRDB) as ifp, open(path, 'wb') as ofp:
+            shutil.copyfileobj(ifp, ofp)
+
+
+def pgdata_path(conf: dict) -> str:
+    '''Get the host path of the postgres data directory.
+
+    Args:
+        conf: The configuration data.
+
+    Returns:
+        path: The path to pgdata in the postgres mount.
+    '''
+    return os.path.join(conf['pg']['mnt'], 'pgdata')
+
+
+def check_persistent(conf: dict, key: str):
+    '''Make sure that the storage of a project container is on the
+    host so that it can be copied.
+
+    The storage of an ephemeral container is on tmpfs inside the
+    container and stopping the container would destroy it.
+
+    Args:
+        conf: The configuration data.
+        key: pg or gr.
+    '''
+    client = docker.from_env()
+    cname = conf[key]['cname']
+    for container in client.containers.list(filters={'name': cname}):
+        if container.attrs['HostConfig'].get('Tmpfs'):
+            err(f'container is ephemeral, its storage cannot be copied: "{cname}"')
+
+
+def stop_container(conf: dict, key: str) -> bool:
+    '''Stop a project container.
+
+    The containers are started with remove set so stopping
+    a container also removes it. It can be restarted by the
+    create operation.
+
+    Args:
+        conf: The configuration data.
+        key: pg or gr.
+
+    Returns:
+        flag: True if the container was running.
+    '''
+    client = docker.from_env()
+    cname = conf[key]['cname']
+    containers = client.containers.list(filters={'name': cname})
+    for container in containers:
+        info(f'stopping container: "{cname}"')
+        container.stop()
+        try:
+            container.wait(condition='removed')
+        except docker.errors.NotFound:
+            pass  # it is already gone
+    return bool(containers)
+
+
+def reflink_copy(src: str, dst: str) -> bool:
+    '''Clone a directory using copy-on-write reflinks.
+
+    Args:
+        src: The source directory.
+        dst: The destination directory, it must not exist.
+
+    Returns:
+        flag: True if the filesystem supports reflinks and the
+            clone was made.
+    '''
+    cmd = ['cp', '-a', '--reflink=always', src, dst]
+    info(' '.join(cmd))
+    try:
+        subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError) as exc:
+        info(f'reflinks are not available: {exc}')
+        shutil.rmtree(dst, ignore_errors=True)
+        return False
+    return True
+
+
+def clone_dir(src: str, dst: str):
+    '''Copy a directory using copy-on-write reflinks if possible.
+
+    If the filesystem does not support reflinks, a regular copy is
+    made.
+
+    Args:
+        src: The source directory.
+        dst: The destination directory, it must not exist.
+    '''
+    cmd = ['cp', '-a', '--reflink=auto', src, dst]
+    info(' '.join(cmd))
+    try:
+        subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+    except subprocess.CalledProcessError as exc:
+        err(f'copy failed: {exc}\n' + exc.output.decode('utf-8'))
+
+
+def write_tar(src: str, zfp: ZipFile, member: str, arcname: str):
+    '''Stream a directory as a tar file into the archive.
+
+    The tar is streamed directly into the archive member so that
+    the data directory is never staged in memory or in a temporary
+    file.
+
+    Args:
+        src: The directory.
+        zfp: The archive open for writing.
+        member: The archive member name.
+        arcname: The name of the directory in the tar.
+    '''
+    info(f'writing {member} from {src}')
+    with zfp.open(member, 'w', force_zip64=True) as ofp:
+        with tarfile.open(fileobj=ofp, mode='w|') as tfp:
+            tfp.add(src, arcname=arcname)
+
+
+def save_pgdata(conf: dict, zfp: ZipFile, wait: float):
+    '''Save a snapshot of the postgres data directory in the archive.
+
+    The database container is stopped and restarted.
+
+    Args:
+        conf: The configuration data.
+        zfp: The archive open for writing.
+        wait: The container create wait time.
+    '''
+    # Avoid a circular import.
+    from grape.create import create_containers  # pylint: disable=import-outside-toplevel
+    check_persistent(conf, 'pg')
+    src = pgdata_path(conf)
+    if not os.path.exists(src):
+        err(f'postgres data directory does not exist: {src}')
+    running = stop_container(conf, 'pg')
+    clone = src + '.snapshot'
+    shutil.rmtree(clone, ignore_errors=True)
+    if reflink_copy(src, clone):
+        if running:
+            create_containers(conf, wait, ['pg'])
+        try:
+            write_tar(clone, zfp, PGTAR, 'pgdata')
+        finally:
+            shutil.rmtree(clone, ignore_errors=True)
+    else:
+        warn('the database is stopped while the snapshot is written')
+        try:
+            write_tar(src, zfp, PGTAR, 'pgdata')
+        finally:
+            if running:
+                create_containers(conf, wait, ['pg'])
+
+
+def load_pgdata(conf: dict, ofn: str):
+    '''Restore the postgres data directory from the archive.
+
+    This must be done before the postgres container is started.
+
+    Args:
+        conf: The configuration data.
+        ofn: The archive file name.
+    '''
+    path = pgdata_path(conf)
+    if os.path.exists(path):
+        err(f'postgres data directory already exists: {path}')
+    os.makedirs(conf['pg']['mnt'], exist_ok=True)
+    info(f'restoring {path} from {ofn}')
+    # The tar filter rejects unsafe paths but, unlike the data
+    # filter, it keeps the directory permissions that postgres
+    # requires (0700).
+    with ZipFile(ofn, 'r') as zfp:
+        with zfp.open(PGTAR) as ifp:
+            with tarfile.open(fileobj=ifp, mode='r|') as tfp:
+                if hasattr(tarfile, 'tar_filter'):
+                    tfp.extractall(conf['pg']['mnt'], filter='tar')
+                else:
+                    tfp.extractall(conf['pg']['mnt'])
@@ -15,6 +15,9 @@ def get_xconf(ifn: str) -> dict:
     servers. It allows local work to be exported to an external
     production server.
 
+    If a token (an API key or a service account token) is specified,
+    the user is not prompted for the username and password.
+
     Args:
         ifn: The YAML file name.
     Returns
@@ -25,12 +28,17 @@ def get_xconf(ifn: str) -> dict:
         if 'url' not in iconf or not iconf['url']:
             url = input('url: ')
             iconf['url'] = url
-        if 'username' not in iconf or not iconf['username']:
-            username = input('username: ')
-            iconf['username'] = username
-        if 'password' not in iconf or not iconf['password']:
-            password = getpass.getpass('password: ')
-            iconf['password'] = password
+        if 'token' in iconf and iconf['token']:
+            iconf.setdefault('username', '')
+            iconf.setdefault('password', '')
+        else:
+            iconf['token'] = ''
+            if 'username' not in iconf or not iconf['username']:
+                username = input('username: ')
+                iconf['username'] = username
+            if 'password' not in iconf or not iconf['password']:
+                password = getpass.getpass('password: ')
+                iconf['password'] = password
         if 'databases' in iconf:
             for i, rec in enumerate(iconf['databases']):
                 if 'password' not in rec:
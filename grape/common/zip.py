@@ -23,8 +23,16 @@ def load(conf: dict) -> dict:
 
     The pq.sql contains the database setup.
 
-    The conf dictionary that is returned as three top level
-    keys: 'conf', 'gr' and 'pg'. One for each file read.
+    The gr.json and pg.sql files are optional because they are
+    replaced by snapshots when the save operation uses them.
+    Snapshots are not read here because they can be very large,
+    they are extracted directly by the load operation.
+
+    The conf dictionary that is returned as four top level
+    keys: 'conf', 'gr' and 'pg'. One for each file read, and
+    'files' which is the list of files in the archive. If gr.json
+    is not present 'gr' is empty and if pg.sql is not present
+    'pg' is empty.
 
     Args:
         opts: The command line arguments.
@@ -37,24 +45,30 @@ def load(conf: dict) -> dict:
         err(f'archive file does not exist: {ofn}')
 
     info(f'loading from {ofn}')
+    zgr = {}
+    sql = ''
     with ZipFile(ofn, 'r') as zfp:
+        files = zfp.namelist()
         zfn = 'conf.json'
         with zfp.open(zfn) as ifp:
             info(f'loading {zfn} from {ofn}')
             zconf = json.loads(ifp.read().decode('utf-8'))
 
         zfn = 'gr.json'
-        with zfp.open(zfn) as ifp:
-            info(f'loading {zfn} from {ofn}')
-            zgr = json.loads(ifp.read().decode('utf-8'))
+        if zfn in files:
+            with zfp.open(zfn) as ifp:
+                info(f'loading {zfn} from {ofn}')
+                zgr = json.loads(ifp.read().decode('utf-8'))
 
         zfn = 'pg.sql'
-        with zfp.open(zfn) as ifp:
-            info(f'loading {zfn} from {ofn}')
-            sql = ifp.read().decode('utf-8')
+        if zfn in files:
+            with zfp.open(zfn) as ifp:
+                info(f'loading {zfn} from {ofn}')
+                sql = ifp.read().decode('utf-8')
     result = {
         'conf': zconf,
         'gr': zgr,
         'pg': sql,
+        'files': files,
     }
     return result
@@ -22,21 +22,78 @@ container two subdirectories: gr for grafana dashboard data and pg for
 postgresql data. There is a `start.sh` script in each of them for their
 respective containers. There are also other directories that are
 specific to the storage systems for grafana and postgresql.
+
+The --pg-stats option starts postgresql with the pg_stat_statements
+extension preloaded and with I/O timing enabled so that the
+`grape dbstats` command can report the query statistics.
+
+The --profile option tunes postgresql for the host: small, large or
+auto which sizes the settings from the host memory and cores. The
+/dev/shm size of the container is raised to the shared buffers size.
+
+The --ephemeral option puts the postgresql data directory, and
+optionally the grafana data directory, on tmpfs with fsync,
+synchronous_commit and full_page_writes off for throwaway
+prototypes and CI. The state is lost when the containers stop.
+
+The postgresql settings are recorded in the project directory so that
+the container is restarted with them and they are saved in the
+conf.json of the archives so that `grape load` reproduces them. They
+only take effect when the postgresql container is created.
 '''
 import argparse
 import os
 import sys
 import time
+from typing import Dict, List, Optional
 
 import docker  # type: ignore
 
 from grape.common.args import DEFAULT_NAME, CLI, add_common_args, args_get_text
-from grape.common.log import initv, info, err
-from grape.common.conf import get_conf
+from grape.common.log import initv, info, warn, err
+from grape.common.conf import get_conf, set_ephemeral, set_pg_settings, save_pg_settings
 from grape.common.gr import load_datasources
 from grape import __version__
 
 
+# The postgres settings that enable the query statistics.
+PG_STATS_SETTINGS = {
+    'shared_preload_libraries': 'pg_stat_statements',
+    'track_io_timing': 'on',
+}
+
+# The containers that are ephemeral for each --ephemeral value.
+EPHEMERAL_KEYS = {'pg': ['pg'], 'all': ['pg', 'gr']}
+
+# The postgres tuning profiles, auto is sized from the host.
+PG_PROFILES = {
+    'small': {
+        'shared_buffers': '256MB',
+        'effective_cache_size': '1GB',
+        'work_mem': '8MB',
+        'maintenance_work_mem': '128MB',
+        'max_parallel_workers_per_gather': '1',
+        'wal_buffers': '8MB',
+        'min_wal_size': '80MB',
+        'max_wal_size': '1GB',
+        'checkpoint_completion_target': '0.9',
+    },
+    'large': {
+        'shared_buffers': '8GB',
+        'effective_cache_size': '24GB',
+        'work_mem': '64MB',
+        'maintenance_work_mem': '2GB',
+        'max_worker_processes': '8',
+        'max_parallel_workers': '8',
+        'max_parallel_workers_per_gather': '4',
+        'wal_buffers': '16MB',
+        'min_wal_size': '1GB',
+        'max_wal_size': '8GB',
+        'checkpoint_completion_target': '0.9',
+    },
+}
+
+
 def getopts() -> argparse.Namespace:
     '''Process the module specific command line options.
 
@@ -63,6 +120,25 @@ EXAMPLES:
         $ browser http://localhost:4700
         $ docker exec -it {3}pgx01 psql -d postgres -U postgres
 
+    # ------------------------------------------------
+    # Example 3: Create a local modeling environment
+    #            with postgres tuned for the host.
+    # ------------------------------------------------
+        $ {2} {0} -v -n {3} -g 4700 --profile auto
+
+    # ------------------------------------------------
+    # Example 4: Create a local modeling environment
+    #            that collects query statistics.
+    # ------------------------------------------------
+        $ {2} {0} -v -n {3} -g 4700 --pg-stats
+        $ {2} dbstats -n {3} -g 4700
+
+    # ------------------------------------------------
+    # Example 5: Create a throwaway environment for CI
+    #            with all of the data in memory.
+    # ------------------------------------------------
+        $ {2} {0} -v -n {3} -g 4700 --ephemeral all
+
 VERSION:
    {1}
 '''.format(base, __version__, CLI, DEFAULT_NAME).strip()
@@ -71,11 +147,110 @@ VERSION:
                                      description=desc[:-2],
                                      usage=usage,
                                      epilog=epilog.rstrip() + '\n ')
-    add_common_args(parser, '-g', '-n', '-p', '-w')
+    add_common_args(parser, '--ephemeral', '-g', '-n', '-p', '-w')
+    parser.add_argument('--pg-stats',
+                        action='store_true',
+                        help='''\
+Start postgresql with the pg_stat_statements
+extension preloaded and track_io_timing
+enabled. The statistics are reported by the
+dbstats command.
+ ''')
+
+    parser.add_argument('--profile',
+                        action='store',
+                        choices=list(PG_PROFILES) + ['auto'],
+                        help='''\
+The postgresql tuning profile:
+   small - a laptop or a CI runner.
+   large - a workstation with 32GB of
+           memory or more.
+   auto  - sized from the memory and the
+           cores of the host.
+
+It sets the memory, parallelism and WAL
+settings. The default is the postgres
+image defaults.
+ ''')
+
     opts = parser.parse_args()
     return opts
 
 
+def get_auto_profile() -> Dict[str, str]:
+    '''Size the postgres settings from the memory and the cores of
+    the host.
+
+    The shared buffers get a quarter of the memory and the queries
+    may use half of the cores in parallel.
+
+    Returns:
+        settings: The settings by name.
+    '''
+    mem = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)  # MB
+    cores = os.cpu_count() or 1
+    shared_buffers = min(mem // 4, 16 * 1024)
+    workers = min(cores // 2, 8)
+    work_mem = max((mem - shared_buffers) // (100 * 3 * max(workers, 1)), 4)  # 100 connections
+    return {
+        'shared_buffers': f'{shared_buffers}MB',
+        'effective_cache_size': f'{mem * 3 // 4}MB',
+        'work_mem': f'{work_mem}MB',
+        'maintenance_work_mem': f'{min(mem // 16, 2048)}MB',
+        'max_worker_processes': str(max(cores, 8)),
+        'max_parallel_workers': str(cores),
+        'max_parallel_workers_per_gather': str(workers),
+        'wal_buffers': '16MB',
+        'min_wal_size': '1GB' if mem >= 16 * 1024 else '80MB',
+        'max_wal_size': '4GB' if mem >= 16 * 1024 else '1GB',
+        'checkpoint_completion_target': '0.9',
+    }
+
+
+def get_profile(name: str) -> Dict[str, str]:
+    '''Get the settings of a postgres tuning profile.
+
+    Args:
+        name: The profile name.
+
+    Returns:
+        settings: The settings by name.
+    '''
+    if name == 'auto':
+        return get_auto_profile()
+    return PG_PROFILES[name]
+
+
+def get_start_options(kwargs: dict) -> str:
+    '''Get the docker run options for the environment, the ports and
+    the storage of a container.
+
+    Args:
+        kwargs: The client.containers.run arguments.
+
+    Returns:
+        opts: The options with a leading space or an empty string.
+    '''
+    cmd = ''
+    if kwargs['environment']:
+        for env in kwargs['environment']:
+            cmd += f' -e "{env}"'
+    if kwargs['ports']:
+        for key1, val1 in kwargs['ports'].items():
+            cport = key1
+            hport = val1
+            cmd += f' -p {hport}:{cport}'
+    if kwargs['volumes']:
+        for key1, val1 in kwargs['volumes'].items():
+            cmd += f' -v {key1}:' + val1['bind']
+    if kwargs.get('tmpfs'):
+        for key1, val1 in kwargs['tmpfs'].items():
+            cmd += f' --tmpfs {key1}:{val1}'
+    if kwargs.get('shm_size'):
+        cmd += f' --shm-size {kwargs["shm_size"]}'
+    return cmd
+
+
 def create_start(conf: dict, key: str):
     '''Create the start script.
 
@@ -100,18 +275,10 @@ def create_start(conf: dict, key: str):
         cmd += ' --rm'
     if name:
         cmd += f' --name {name} -h {name}'
-    if kwargs['environment']:
-        for env in kwargs['environment']:
-            cmd += f' -e "{env}"'
-    if kwargs['ports']:
-        for key1, val1 in kwargs['ports'].items():
-            cport = key1
-            hport = val1
-            cmd += f' -p {hport}:{cport}'
-    if kwargs['volumes']:
-        for key1, val1 in kwargs['volumes'].items():
-            cmd += f' -v {key1}:' + val1['bind']
+    cmd += get_start_options(kwargs)
     cmd += ' ' + kwargs['image']
+    if kwargs.get('command'):
+        cmd += ' ' + ' '.join(kwargs['command'])
 
     # Create the script.
     info(f'start script: {fname}')
@@ -129,7 +296,9 @@ echo "started - it may take up to 30 seconds to initialize"
     os.chmod(fname, 0o775)
 
 
-def create_container_init(conf: dict, waitval: float):  # pylint: disable=too-many-locals
+def create_container_init(conf: dict,  # pylint: disable=too-many-locals
+                          waitval: float,
+                          keys: Optional[List[str]] = None):
     '''Initialize the containers.
 
     Wait for the containers to initialized by looking
@@ -141,6 +310,8 @@ def create_container_init(conf: dict, waitval: float):  # pylint: disable=too-ma
     Args:
         conf: The configuration data.
         waitval: The container create wait time in seconds.
+        keys: The containers to wait for ('gr', 'pg'), the default
+            is both.
     '''
     # This is a heuristic that does a short wait to give docker
     # sufficient time to start to define the new containers before we
@@ -163,6 +334,8 @@ def create_container_init(conf: dict, waitval: float):  # pylint: disable=too-ma
                                  'http server listen']},
         {'key': 'pg', 'values': ['database system is ready to accept connections']},
     ]
+    if keys is not None:
+        recs = [rec for rec in recs if rec['key'] in keys]
 
     # Define the sleep interval.
     # Try to report status about every 2 seconds or so based on elaped time.
@@ -221,28 +394,35 @@ def create_container_init(conf: dict, waitval: float):  # pylint: disable=too-ma
                 err(f'container failed to initialize: "{name}"\nData: {logs}')
 
 
-def create_containers(conf: dict, wait: float):
+def create_containers(conf: dict, wait: float, keys: Optional[List[str]] = None):
     '''Create the docker containers.
 
     Args:
         conf: The configuration data.
         wait: The container create wait time.
+        keys: The containers to create ('gr', 'pg'), the default is
+            both. Restarting only the database container must not wait
+            for the grafana startup messages, they may no longer be in
+            the tail of its log.
     '''
-    create_start(conf, 'pg')  # postgresql
-    create_start(conf, 'gr')  # grafana
+    keys = keys or ['gr', 'pg']
+    for key in keys:
+        create_start(conf, key)
     client = docker.from_env()
-    num = 0
-    for key in ['gr', 'pg']:
+    for key in keys:
         kconf = conf[key]
         cname = kconf['cname']
+        kwargs = kconf['client.containers.run']
         containers = client.containers.list(filters={'name': cname})
         if containers:
             info(f'container already exists: "{cname}"')
+            command = kwargs.get('command')
+            if command and containers[0].attrs['Config']['Cmd'] != command:
+                warn(f'container already exists, the settings were not applied: "{cname}"')
             continue
 
         # Create the volume mounted subdirectories with the proper
         # permissions.
-        kwargs = kconf['client.containers.run']
         for key1 in kwargs['volumes']:
             try:
                 os.makedirs(key1)
@@ -252,15 +432,19 @@ def create_containers(conf: dict, wait: float):
 
         ports = kconf['ports']
         info(f'creating container "{cname}": {ports}')
+        if kconf['ephemeral']:
+            warn(f'container "{cname}" is ephemeral, its data is in memory '
+                 'and it will be lost when the container stops')
         try:
             cobj = client.containers.run(**kwargs)
         except docker.errors.DockerException as exc:
             logs = cobj.logs().decode('utf-8')
             err(f'container failed to run: "{cname}" - {exc}:\n{logs}\n')
-        num += 1
+        if key == 'pg':
+            save_pg_settings(conf)
 
     if wait:
-        create_container_init(conf, wait)
+        create_container_init(conf, wait, keys)
 
 
 def create(conf: dict, wait: float):
@@ -284,5 +468,11 @@ def main():
     initv(opts.verbose)
     info(f'creating {opts.base} based containers')
     conf = get_conf(opts.base, '', opts.grxport, opts.pgxport)
+    if opts.ephemeral:
+        set_ephemeral(conf, EPHEMERAL_KEYS[opts.ephemeral])
+    if opts.profile:
+        set_pg_settings(conf, get_profile(opts.profile))
+    if opts.pg_stats:
+        set_pg_settings(conf, PG_STATS_SETTINGS)
     create(conf, opts.wait)
     info('done')
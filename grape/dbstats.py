@@ -0,0 +1,324 @@
+'''
+The dbstats operation reports the query and storage statistics of the
+database of a local grape project.
+
+It reports:
+   1. the top queries by total execution time and by mean execution
+      time from the pg_stat_statements extension.
+   2. the cache hit ratio and the I/O times of the database.
+   3. the table sizes, the index sizes, the sequential scan counts
+      and the rows read by sequential scans for each table.
+   4. the index sizes and the number of index scans, unused
+      indexes are flagged.
+
+The query statistics require the pg_stat_statements extension to be
+preloaded which is done by creating the project with
+`grape create --pg-stats`. The extension is created in the database
+if it does not exist. The other statistics are always reported.
+
+If --map is specified, the statements are mapped back to the
+dashboards and panels that issue them. The panel queries are read
+from the local grafana server or from a saved archive (-f) and are
+matched to the statements after the literals are normalized.
+
+The statistics are cumulative since the last reset, use --reset to
+reset them after the report.
+'''
+import argparse
+import operator
+import os
+import sys
+from typing import Dict, List
+
+from grape.common.args import DEFAULT_NAME, CLI, add_common_args, args_get_text
+from grape.common.log import initv, info, warn
+from grape.common.conf import get_conf
+from grape.common.filters import get_filters
+from grape.common.pg import query
+from grape.common.queries import normalize
+from grape.profile_queries import add_query_args, get_queries, read_services
+from grape import __version__
+
+
+# The statements that collect the statistics, they are excluded from
+# the report.
+EXCLUDE = ['pg_stat_', 'pg_statio_', 'pg_catalog.', 'pg_database', 'pg_settings']
+
+# The maximum width of the query text.
+QUERY_WIDTH = 100
+
+
+def getopts() -> argparse.Namespace:
+    '''Process the command line options.
+
+    Returns:
+       opts: The argument namespace.
+    '''
+    argparse._ = args_get_text  # type: ignore
+    base = os.path.basename(sys.argv[0])
+    usage = '\n {0} [OPTIONS]'.format(base)
+    desc = 'DESCRIPTION:{0}'.format('\n  '.join(__doc__.split('\n')))
+    epilog = '''
+EXAMPLES:
+    # ------------------------------------------------
+    # Example 1: Help.
+    # ------------------------------------------------
+        $ {2} {0} -h
+
+    # ------------------------------------------------
+    # Example 2: Create a project that collects the
+    #            query statistics and report them.
+    # ------------------------------------------------
+        $ {2} create -v -n {3} -g 4600 --pg-stats
+        $ {2} load -v -n {3} -g 4600 -f {3}.zip
+        $ {2} loadtest -v -n {3} -g 4600 -d ops
+        $ {2} {0} -n {3} -g 4600
+
+    # ------------------------------------------------
+    # Example 3: Report the top 5 queries with the
+    #            dashboards and panels that issue them
+    #            and reset the statistics.
+    # ------------------------------------------------
+        $ {2} {0} -n {3} -g 4600 --top 5 --map --reset
+
+VERSION:
+   {1}
+'''.format(base, __version__, CLI, DEFAULT_NAME).strip()
+    afc = argparse.RawTextHelpFormatter
+    parser = argparse.ArgumentParser(formatter_class=afc,
+                                     description=desc[:-2],
+                                     usage=usage,
+                                     epilog=epilog.rstrip() + '\n ')
+    add_common_args(parser, '--filter', '-f', '-g', '-n', '-p')
+    add_query_args(parser)
+    parser.add_argument('--map',
+                        action='store_true',
+                        help='''\
+Map the statements to the dashboards and
+panels that issue them.
+ ''')
+
+    parser.add_argument('--reset',
+                        action='store_true',
+                        help='''\
+Reset the statistics after the report.
+ ''')
+
+    parser.add_argument('--top',
+                        action='store',
+                        type=int,
+                        default=10,
+                        metavar=('N'),
+                        help='''\
+The number of queries to report for each
+ranking.
+
+The default is %(default)s.
+ ''')
+
+    opts = parser.parse_args()
+    return opts
+
+
+def has_pg_stat_statements(conf: dict) -> bool:
+    '''Check whether the pg_stat_statements extension is available
+    and create it if it does not exist.
+
+    Args:
+        conf: The configuration data.
+
+    Returns:
+        available: True if the statement statistics can be read.
+    '''
+    rows = query(conf, 'SHOW shared_preload_libraries')
+    libraries = [lib.strip() for lib in rows[0][0].split(',')] if rows else []
+    if 'pg_stat_statements' not in libraries:
+        return False
+    query(conf, 'CREATE EXTENSION IF NOT EXISTS pg_stat_statements')
+    return True
+
+
+def get_statements(conf: dict) -> List[dict]:
+    '''Get the statement statistics of the project database.
+
+    Args:
+        conf: The configuration data.
+
+    Returns:
+        statements: A record for each statement with the calls, the
+            total and mean execution time (ms), the rows, the shared
+            buffer hits and reads and the query text.
+    '''
+    sql = r'''
+SELECT s.calls, s.total_exec_time, s.mean_exec_time, s.rows,
+       s.shared_blks_hit, s.shared_blks_read,
+       regexp_replace(s.query, '\s+', ' ', 'g')
+FROM pg_stat_statements s JOIN pg_database d ON d.oid = s.dbid
+WHERE d.datname = current_database()
+'''
+    statements = []
+    for row in query(conf, sql):
+        text = '\t'.join(row[6:])
+        if any(name in text for name in EXCLUDE):
+            continue
+        statements.append({
+            'calls': int(row[0]),
+            'total': float(row[1]),
+            'mean': float(row[2]),
+            'rows': int(row[3]),
+            'hit': int(row[4]),
+            'read': int(row[5]),
+            'query': text,
+            'panels': [],
+        })
+    return statements
+
+
+def map_statements(statements: List[dict], queries: List[dict]):
+    '''Map the statements to the panels that issue them.
+
+    Args:
+        statements: The statement records, the panels are updated.
+        queries: The panel query records from get_queries.
+    '''
+    panels: Dict[str, List[str]] = {}
+    for rec in queries:
+        panels.setdefault(normalize(rec['expanded']), []).append(rec['name'])
+    for rec in statements:
+        rec['panels'] = sorted(set(panels.get(normalize(rec['query']), [])))
+
+
+def ratio(hit: int, read: int) -> str:
+    '''Format a cache hit ratio.
+
+    Args:
+        hit: The number of blocks found in the cache.
+        read: The number of blocks read from disk.
+
+    Returns:
+        ratio: The hit ratio as a percentage or - if there were no
+            block accesses.
+    '''
+    if hit + read == 0:
+        return '-'
+    return f'{100. * hit / (hit + read):.2f}%'
+
+
+def report_statements(statements: List[dict], top: int, mapped: bool):
+    '''Print the top statements by total and mean execution time.
+
+    Args:
+        statements: The statement records.
+        top: The number of statements for each ranking.
+        mapped: The statements were mapped to panels.
+    '''
+    for key in ['total', 'mean']:
+        print(f'\ntop {top} queries by {key} execution time')
+        print(f'{"rank":>4}  {"calls":>8}  {"total (ms)":>12}  {"mean (ms)":>10}  '
+              f'{"rows":>10}  {"hit ratio":>9}  query')
+        ranked = sorted(statements, key=operator.itemgetter(key), reverse=True)[:top]
+        for i, rec in enumerate(ranked, start=1):
+            text = rec['query']
+            if len(text) > QUERY_WIDTH:
+                text = text[:QUERY_WIDTH - 3] + '...'
+            print(f'{i:>4}  {rec["calls"]:>8}  {rec["total"]:>12.1f}  {rec["mean"]:>10.1f}  '
+                  f'{rec["rows"]:>10}  {ratio(rec["hit"], rec["read"]):>9}  {text}')
+            if mapped:
+                for name in rec['panels'] or ['not issued by a panel']:
+                    print(f'{"":>4}  {"":>8}  {"":>12}  {"":>10}  {"":>10}  {"":>9}  panel: {name}')
+
+
+def report_database(conf: dict):
+    '''Print the cache hit ratio and the I/O times of the database.
+
+    The I/O times are only collected if track_io_timing is on.
+
+    Args:
+        conf: The configuration data.
+    '''
+    sql = '''
+SELECT blks_hit, blks_read, blk_read_time, blk_write_time,
+       current_setting('track_io_timing'), pg_size_pretty(pg_database_size(datname))
+FROM pg_stat_database WHERE datname = current_database()
+'''
+    row = query(conf, sql)[0]
+    print(f'\ndatabase {conf["pg"]["dbname"]}: {row[5]}')
+    print(f'   cache hit ratio: {ratio(int(row[0]), int(row[1]))} '
+          f'({row[0]} hits, {row[1]} reads)')
+    if row[4] == 'on':
+        print(f'   block read time: {float(row[2]):.1f} ms, '
+              f'block write time: {float(row[3]):.1f} ms')
+
+
+def report_tables(conf: dict):
+    '''Print the table sizes and scan counts ordered by size.
+
+    Args:
+        conf: The configuration data.
+    '''
+    sql = '''
+SELECT t.schemaname || '.' || t.relname,
+       pg_size_pretty(pg_total_relation_size(t.relid)),
+       pg_size_pretty(pg_relation_size(t.relid)),
+       pg_size_pretty(pg_indexes_size(t.relid)),
+       t.n_live_tup, t.seq_scan, t.seq_tup_read, COALESCE(t.idx_scan, 0),
+       io.heap_blks_hit, io.heap_blks_read
+FROM pg_stat_user_tables t JOIN pg_statio_user_tables io USING (relid)
+ORDER BY pg_total_relation_size(t.relid) DESC
+'''
+    print('\ntables')
+    print(f'{"total":>10}  {"table":>10}  {"indexes":>10}  {"rows":>10}  {"seq scans":>9}  '
+          f'{"seq rows read":>13}  {"idx scans":>9}  {"hit ratio":>9}  table')
+    for row in query(conf, sql):
+        print(f'{row[1]:>10}  {row[2]:>10}  {row[3]:>10}  {row[4]:>10}  {row[5]:>9}  '
+              f'{row[6]:>13}  {row[7]:>9}  {ratio(int(row[8]), int(row[9])):>9}  {row[0]}')
+
+
+def report_indexes(conf: dict):
+    '''Print the index sizes and scan counts ordered by size.
+
+    Args:
+        conf: The configuration data.
+    '''
+    sql = '''
+SELECT schemaname || '.' || relname, indexrelname,
+       pg_size_pretty(pg_relation_size(indexrelid)), idx_scan
+FROM pg_stat_user_indexes
+ORDER BY pg_relation_size(indexrelid) DESC
+'''
+    print('\nindexes')
+    print(f'{"size":>10}  {"idx scans":>9}  index')
+    for row in query(conf, sql):
+        unused = '  (unused)' if row[3] == '0' else ''
+        print(f'{row[2]:>10}  {row[3]:>9}  {row[1]} on {row[0]}{unused}')
+
+
+def main():
+    '''Database statistics command main.
+
+    This is the command line entry point for the dbstats command.
+    '''
+    opts = getopts()
+    initv(opts.verbose)
+    info(f'reporting the database statistics of {opts.base}')
+    conf = get_conf(opts.base, opts.fname, opts.grxport, opts.pgxport)
+    if has_pg_stat_statements(conf):
+        statements = get_statements(conf)
+        info(f'found {len(statements)} statements')
+        if opts.map:
+            queries = get_queries(opts, read_services(conf, get_filters(opts)))
+            info(f'found {len(queries)} postgres panel queries')
+            map_statements(statements, queries)
+        report_statements(statements, opts.top, opts.map)
+    else:
+        warn('pg_stat_statements is not preloaded, create the project with --pg-stats '
+             'to collect the query statistics')
+    report_database(conf)
+    report_tables(conf)
+    report_indexes(conf)
+    if opts.reset:
+        info('resetting the statistics')
+        query(conf, 'SELECT pg_stat_reset()')
+        if has_pg_stat_statements(conf):
+            query(conf, 'SELECT pg_stat_statements_reset()')
+    info('done')
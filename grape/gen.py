@@ -0,0 +1,529 @@
+'''
+The gen operation generates a synthetic time series table in the
+database of a local grape project.
+
+The data is generated inside postgres using generate_series so no
+rows are sent to the database. The table has a time column, a label
+column for each series dimension and a value column for each value
+distribution. The number of rows is the number of time steps times
+the number of series (the product of the dimension cardinalities).
+
+The time range is split into chunks that are generated in parallel
+by separate psql sessions so filling a table with 100 million rows
+for dashboard performance testing takes minutes.
+
+The generator is described by a YAML spec file, by command line
+options or by both, the command line options override the spec file.
+This is an example spec file:
+
+    table: metrics
+    start: 2024-01-01
+    end: 2024-02-01
+    interval: 1m
+    series:
+      host: 100
+      metric: [cpu, mem, disk]
+    values:
+      value:
+        dist: normal
+        mean: 50
+        stddev: 10
+'''
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import os
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+import dateutil.parser
+import yaml
+
+from grape.common.args import DEFAULT_NAME, CLI, add_common_args, args_get_text
+from grape.common.log import initv, info, err
+from grape.common.conf import get_conf
+from grape.common.pg import pipe
+from grape.common.queries import parse_interval
+from grape import __version__
+
+
+# The value distributions and their parameters with the defaults.
+DISTRIBUTIONS: Dict[str, Dict[str, Any]] = {
+    'uniform': {'min': 0, 'max': 100},
+    'normal': {'mean': 50, 'stddev': 10},
+    'sine': {'mean': 50, 'amplitude': 25, 'period': '1d', 'noise': 5},
+}
+
+# The number of chunks per job. More chunks than jobs balance the
+# load when some chunks are slower than others.
+CHUNKS_PER_JOB = 4
+
+
+def getopts() -> argparse.Namespace:
+    '''Process the command line options.
+
+    Returns:
+       opts: The argument namespace.
+    '''
+    argparse._ = args_get_text  # type: ignore
+    base = os.path.basename(sys.argv[0])
+    usage = '\n {0} [OPTIONS]'.format(base)
+    desc = 'DESCRIPTION:{0}'.format('\n  '.join(__doc__.split('\n')))
+    epilog = '''
+EXAMPLES:
+    # ------------------------------------------------
+    # Example 1: Help.
+    # ------------------------------------------------
+        $ {2} {0} -h
+
+    # ------------------------------------------------
+    # Example 2: Generate one day of uniform values
+    #            for 10 metrics every minute.
+    # ------------------------------------------------
+        $ {2} {0} -v -n {3} -t metrics
+
+    # ------------------------------------------------
+    # Example 3: Generate about 100 million rows:
+    #            1000 hosts times 3 metrics every
+    #            minute for 23 days.
+    # ------------------------------------------------
+        $ {2} {0} -v -n {3} -t metrics --start 2024-01-01 --end 2024-01-24 \\
+              --series host=1000 --series metric=cpu,mem,disk \\
+              --value value=normal --time-index brin
+
+    # ------------------------------------------------
+    # Example 4: Generate the table described by a
+    #            spec file.
+    # ------------------------------------------------
+        $ {2} {0} -v -n {3} -S metrics.yaml
+
+    # ------------------------------------------------
+    # Example 5: Print the SQL without running it.
+    # ------------------------------------------------
+        $ {2} {0} -n {3} -S metrics.yaml --dry-run
+
+VERSION:
+   {1}
+'''.format(base, __version__, CLI, DEFAULT_NAME).strip()
+    afc = argparse.RawTextHelpFormatter
+    parser = argparse.ArgumentParser(formatter_class=afc,
+                                     description=desc[:-2],
+                                     usage=usage,
+                                     epilog=epilog.rstrip() + '\n ')
+    add_common_args(parser, '-g', '-n', '-p')
+    parser.add_argument('-D', '--dry-run',
+                        action='store_true',
+                        help='''\
+Print the SQL instead of running it.
+ ''')
+
+    parser.add_argument('--end',
+                        action='store',
+                        metavar=('TIME'),
+                        help='''\
+The end of the time range, it is not
+included.
+
+The default is midnight today.
+ ''')
+
+    parser.add_argument('--interval',
+                        action='store',
+                        metavar=('SIZE'),
+                        help='''\
+The time between rows of a series.
+
+The size is a number followed by a unit:
+ms (milliseconds), s (seconds),
+m (minutes), h (hours), d (days) or
+w (weeks), for example 10s.
+
+The default is 1m.
+ ''')
+
+    parser.add_argument('-j', '--jobs',
+                        action='store',
+                        type=int,
+                        default=0,
+                        metavar=('N'),
+                        help='''\
+The number of psql sessions that generate
+the rows in parallel.
+
+The default is the number of CPUs.
+ ''')
+
+    parser.add_argument('-S', '--spec',
+                        action='store',
+                        default='',
+                        metavar=('FILE'),
+                        help='''\
+The YAML spec file.
+ ''')
+
+    parser.add_argument('--series',
+                        action='append',
+                        metavar=('NAME=N|A,B,...'),
+                        help='''\
+A series dimension. It is a label column
+with N values (NAME1 .. NAMEN) or with
+the listed values. It can be specified
+multiple times.
+
+The default is metric=10.
+ ''')
+
+    parser.add_argument('--start',
+                        action='store',
+                        metavar=('TIME'),
+                        help='''\
+The start of the time range.
+
+The default is one day before the end.
+ ''')
+
+    parser.add_argument('-t', '--table',
+                        action='store',
+                        help='''\
+The table name.
+
+The default is gen.
+ ''')
+
+    parser.add_argument('--time-index',
+                        action='store',
+                        choices=['none', 'brin', 'btree'],
+                        default='none',
+                        help='''\
+Create an index on the time column after
+the rows are generated.
+
+The default is %(default)s.
+ ''')
+
+    parser.add_argument('--value',
+                        action='append',
+                        metavar=('NAME=DIST'),
+                        help='''\
+A value column and its distribution. It
+can be specified multiple times.
+
+The distributions are:
+   uniform - between min and max.
+   normal  - with mean and stddev.
+   sine    - a sine wave with mean,
+             amplitude and period plus
+             uniform noise.
+
+The default parameters are used, use a
+spec file to change them.
+
+The default is value=uniform.
+ ''')
+
+    opts = parser.parse_args()
+    return opts
+
+
+def parse_time(value) -> datetime.datetime:
+    '''Parse a time.
+
+    Args:
+        value: The time string or a date or a datetime from YAML.
+
+    Returns:
+        value: The datetime.
+    '''
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime.combine(value, datetime.time())
+    try:
+        return dateutil.parser.parse(str(value))
+    except (ValueError, OverflowError):
+        err(f'invalid time: "{value}"')
+    return datetime.datetime.min
+
+
+def get_spec(opts: argparse.Namespace) -> dict:
+    '''Get the generator spec.
+
+    The spec file is read and the command line options override it.
+
+    Args:
+        opts: The command line options.
+
+    Returns:
+        spec: The generator spec.
+    '''
+    spec: Dict[str, Any] = {}
+    if opts.spec:
+        if not os.path.exists(opts.spec):
+            err(f'spec file does not exist: "{opts.spec}"')
+        with open(opts.spec, 'r', encoding='utf-8') as ifp:
+            spec = yaml.safe_load(ifp) or {}
+        unknown = set(spec) - {'table', 'start', 'end', 'interval', 'series', 'values'}
+        if unknown:
+            err(f'unknown spec keys in "{opts.spec}": {", ".join(sorted(unknown))}')
+    for key in ['table', 'start', 'end', 'interval']:
+        if getattr(opts, key) is not None:
+            spec[key] = getattr(opts, key)
+    if opts.series:
+        spec['series'] = {}
+        for item in opts.series:
+            name, _, value = item.partition('=')
+            spec['series'][name] = int(value) if value.isdigit() else value.split(',')
+    if opts.value:
+        spec['values'] = {}
+        for item in opts.value:
+            name, _, dist = item.partition('=')
+            spec['values'][name] = {'dist': dist}
+
+    # Fill in the defaults.
+    spec.setdefault('table', 'gen')
+    spec.setdefault('interval', '1m')
+    spec.setdefault('series', {'metric': 10})
+    spec.setdefault('values', {'value': {'dist': 'uniform'}})
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    spec['end'] = parse_time(spec['end']) if spec.get('end') else today
+    spec['start'] = parse_time(spec['start']) if spec.get('start') \
+        else spec['end'] - datetime.timedelta(days=1)
+    spec['interval'] = parse_interval(spec['interval'])
+    check_spec(spec)
+    return spec
+
+
+def check_spec(spec: dict):
+    '''Check the generator spec and fill in the distribution
+    parameters of the values.
+
+    Args:
+        spec: The generator spec with the defaults, it is updated.
+    '''
+    if spec['start'] >= spec['end']:
+        err(f'the start time {spec["start"]} is not before the end time {spec["end"]}')
+    if spec['interval'] <= 0:
+        err('the interval must be greater than zero')
+    for name, values in spec['series'].items():
+        if isinstance(values, int):
+            if values < 1:
+                err(f'invalid series cardinality: {name}={values}')
+        elif not isinstance(values, list) or not values:
+            err(f'invalid series values: {name}={values}')
+    for name, rec in spec['values'].items():
+        dist = rec.get('dist', 'uniform')
+        if dist not in DISTRIBUTIONS:
+            err(f'invalid distribution for {name}: "{dist}", '
+                f'expected one of: {", ".join(DISTRIBUTIONS)}')
+        rec.update({key: rec.get(key, value) for key, value in DISTRIBUTIONS[dist].items()})
+        rec['dist'] = dist
+        rec.setdefault('type', 'DOUBLE PRECISION')
+        if dist == 'sine' and parse_interval(rec['period']) <= 0:
+            err(f'the sine period of {name} must be greater than zero')
+
+
+def quote(value) -> str:
+    '''Quote an SQL string literal.
+
+    Args:
+        value: The value.
+
+    Returns:
+        literal: The quoted value.
+    '''
+    text = str(value).replace("'", "''")
+    return f"'{text}'"
+
+
+def get_series_sql(name: str, values) -> str:
+    '''Get the SQL that generates the labels of a series dimension.
+
+    Args:
+        name: The label column name.
+        values: The number of labels or the list of labels.
+
+    Returns:
+        sql: The FROM item.
+    '''
+    if isinstance(values, int):
+        width = len(str(values))
+        return (f"(SELECT '{name}' || lpad(i::text, {width}, '0') AS {name} "
+                f'FROM generate_series(1, {values}) AS i) AS s_{name}')
+    rows = ', '.join(f'({quote(value)})' for value in values)
+    return f'(VALUES {rows}) AS s_{name}({name})'
+
+
+def get_value_sql(rec: dict) -> str:
+    '''Get the SQL expression that generates a value.
+
+    Args:
+        rec: The value spec.
+
+    Returns:
+        sql: The expression.
+    '''
+    dist = rec['dist']
+    if dist == 'normal':
+        # Box-Muller transform.
+        expr = (f'{rec["mean"]} + {rec["stddev"]} * sqrt(-2 * ln(1 - random())) '
+                '* cos(2 * pi() * random())')
+    elif dist == 'sine':
+        period = parse_interval(rec['period'])
+        expr = (f'{rec["mean"]} + {rec["amplitude"]} '
+                f'* sin(2 * pi() * extract(epoch FROM t) / {period}) '
+                f'+ {rec["noise"]} * (2 * random() - 1)')
+    else:
+        expr = f'{rec["min"]} + random() * ({rec["max"]} - {rec["min"]})'
+    return f'({expr})::{rec["type"]}'
+
+
+def get_steps(spec: dict) -> int:
+    '''Get the number of time steps.
+
+    Args:
+        spec: The generator spec.
+
+    Returns:
+        steps: The number of rows per series.
+    '''
+    secs = (spec['end'] - spec['start']).total_seconds()
+    return int(-(-secs // spec['interval']))
+
+
+def get_num_series(spec: dict) -> int:
+    '''Get the number of series.
+
+    Args:
+        spec: The generator spec.
+
+    Returns:
+        num: The product of the series dimension cardinalities.
+    '''
+    num = 1
+    for values in spec['series'].values():
+        num *= values if isinstance(values, int) else len(values)
+    return num
+
+
+def create_sql_table(spec: dict) -> str:
+    '''Create the SQL that creates the table.
+
+    Args:
+        spec: The generator spec.
+
+    Returns:
+        sql: The SQL.
+    '''
+    table = spec['table']
+    cols = ['  time TIMESTAMPTZ NOT NULL']
+    cols += [f'  {name} TEXT NOT NULL' for name in spec['series']]
+    cols += [f'  {name} {rec["type"]}' for name, rec in spec['values'].items()]
+    return (f'DROP TABLE IF EXISTS {table};\n'
+            f'CREATE TABLE {table} (\n' + ',\n'.join(cols) + ');\n')
+
+
+def create_sql_chunks(spec: dict, num: int) -> List[str]:
+    '''Create the SQL that generates the rows in chunks.
+
+    Each chunk is a range of time steps and its rows are generated
+    in time order. The chunks are inserted by concurrent sessions so
+    the table is only physically ordered by time, which suits BRIN
+    indexes, with --jobs 1.
+
+    Args:
+        spec: The generator spec.
+        num: The number of chunks.
+
+    Returns:
+        sqls: The SQL of each chunk.
+    '''
+    steps = get_steps(spec)
+    num = max(1, min(num, steps))
+    step = datetime.timedelta(seconds=spec['interval'])
+    cols = ', '.join(['time'] + list(spec['series']) + list(spec['values']))
+    exprs = ', '.join(['t'] + [f's_{name}.{name}' for name in spec['series']] +
+                      [get_value_sql(rec) for rec in spec['values'].values()])
+    joins = ''.join(f'\nCROSS JOIN {get_series_sql(name, values)}'
+                    for name, values in spec['series'].items())
+    sqls = []
+    for i in range(num):
+        first = steps * i // num
+        last = steps * (i + 1) // num - 1
+        lower = (spec['start'] + first * step).isoformat()
+        upper = (spec['start'] + last * step).isoformat()
+        sqls.append(f'INSERT INTO {spec["table"]} ({cols})\n'
+                    f'SELECT {exprs}\n'
+                    f"FROM generate_series('{lower}'::timestamptz, '{upper}'::timestamptz, "
+                    f"interval '{spec['interval']} seconds') AS t"
+                    f'{joins};\n')
+    return sqls
+
+
+def create_sql_finish(spec: dict, method: str) -> str:
+    '''Create the SQL that runs after the rows are generated.
+
+    Args:
+        spec: The generator spec.
+        method: The time index method: none, brin or btree.
+
+    Returns:
+        sql: The SQL.
+    '''
+    table = spec['table']
+    sql = ''
+    if method != 'none':
+        sql += f'CREATE INDEX {table}_time_idx ON {table} USING {method} (time);\n'
+    return sql + f'ANALYZE {table};\n'
+
+
+def run_chunks(conf: dict, spec: dict, sqls: List[str], jobs: int):
+    '''Run the chunks in parallel psql sessions.
+
+    Args:
+        conf: The configuration data.
+        spec: The generator spec.
+        sqls: The SQL of each chunk.
+        jobs: The number of psql sessions.
+    '''
+    def run(i: int, sql: str) -> Tuple[int, float]:
+        start = time.time()
+        pipe(conf, f'{spec["table"]} chunk {i + 1}', lambda ofp: ofp.write(sql))
+        return i, time.time() - start
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(run, i, sql) for i, sql in enumerate(sqls)]
+        for future in futures:
+            i, elapsed = future.result()
+            info(f'   chunk {i + 1} of {len(sqls)} done in {elapsed:0.1f} seconds')
+
+
+def main():
+    '''Gen command main.
+
+    This is the command line entry point for the gen command.
+    '''
+    opts = getopts()
+    initv(opts.verbose)
+    spec = get_spec(opts)
+    jobs = opts.jobs or os.cpu_count() or 1
+    rows = get_steps(spec) * get_num_series(spec)
+    info(f'generating {rows} rows in {spec["table"]} of {opts.base}: '
+         f'{get_steps(spec)} steps from {spec["start"]} to {spec["end"]} '
+         f'times {get_num_series(spec)} series')
+    sqls = create_sql_chunks(spec, jobs * CHUNKS_PER_JOB)
+    if opts.dry_run:
+        sys.stdout.write(create_sql_table(spec))
+        sys.stdout.write(''.join(sqls))
+        sys.stdout.write(create_sql_finish(spec, opts.time_index))
+        return
+
+    conf = get_conf(opts.base, '', opts.grxport, opts.pgxport)
+    start = time.time()
+    pipe(conf, spec['table'], lambda ofp: ofp.write(create_sql_table(spec)))
+    run_chunks(conf, spec, sqls, jobs)
+    info(f'finishing {spec["table"]}')
+    pipe(conf, spec['table'], lambda ofp: ofp.write(create_sql_finish(spec, opts.time_index)))
+    elapsed = max(time.time() - start, 1e-6)
+    print(f'{rows} rows in {elapsed:0.1f}s ({rows / elapsed:0.1f} rows/s)')
+    info('done')
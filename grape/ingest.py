@@ -0,0 +1,301 @@
+'''
+The ingest operation loads a CSV file directly into the database of a
+local grape project.
+
+It creates a table for the CSV data with column types that are
+inferred from the data, just like tools/csv2sql.py, and then streams
+the rows through the type conversion into the postgres container
+using COPY over a pipe to psql (docker exec -i). No intermediate SQL
+file is created and the rows are sent in chunks while the progress
+and the ingest rate are reported.
+
+Multiple CSV files with the same header, for example daily shards,
+are ingested into one table. The column types of all of the files
+are inferred in parallel and the files are loaded in parallel, one
+psql connection per worker process.
+
+Compressed CSV files and JSON Lines files are accepted, see
+tools/csv2sql.py.
+'''
+import argparse
+import datetime
+import os
+import sys
+import time
+from typing import List, Optional, Tuple
+
+from grape.common.args import DEFAULT_NAME, CLI, add_common_args, args_get_text
+from grape.common.log import initv, info
+from grape.common.conf import get_conf
+from grape.common.pg import pipe, query
+from grape.common import csv2sql, csvappend, csvio, csvrollup, csvtypes
+from grape import __version__
+
+
+# The minimum number of seconds between progress reports.
+PROGRESS_INTERVAL = 2.
+
+
+def getopts() -> argparse.Namespace:
+    '''Process the command line options.
+
+    Returns:
+       opts: The argument namespace.
+    '''
+    argparse._ = args_get_text  # type: ignore
+    base = os.path.basename(sys.argv[0])
+    usage = '\n {0} [OPTIONS] CSV [CSV ...]'.format(base)
+    desc = 'DESCRIPTION:{0}'.format('\n  '.join(__doc__.split('\n')))
+    epilog = '''
+EXAMPLES:
+    # ------------------------------------------------
+    # Example 1: Help.
+    # ------------------------------------------------
+        $ {2} {0} -h
+
+    # ------------------------------------------------
+    # Example 2: Ingest a CSV file into a table named
+    #            after the file (my_data).
+    # ------------------------------------------------
+        $ {2} {0} -v -n {3} my_data.csv
+
+    # ------------------------------------------------
+    # Example 3: Ingest a CSV file into an explicit
+    #            table and convert NA to 0.
+    # ------------------------------------------------
+        $ {2} {0} -v -n {3} -c NA=0 -t cool_data my-data.csv
+
+    # ------------------------------------------------
+    # Example 4: Ingest a large CSV file using types
+    #            inferred from a sample of the rows.
+    # ------------------------------------------------
+        $ {2} {0} -v -n {3} --sample 10000 big.csv
+
+    # ------------------------------------------------
+    # Example 5: Ingest all of the daily CSV files in
+    #            a directory into one table using 8
+    #            worker processes.
+    # ------------------------------------------------
+        $ {2} {0} -v -n {3} -j 8 -t daily data/daily
+
+    # ------------------------------------------------
+    # Example 6: Ingest metrics into a table that is
+    #            partitioned by month on the time
+    #            column with BRIN time indexes.
+    # ------------------------------------------------
+        $ {2} {0} -v -n {3} --partition time --time-index brin metrics.csv
+
+    # ------------------------------------------------
+    # Example 7: Ingest metrics with a 5 minute rollup
+    #            table (metrics_5m).
+    # ------------------------------------------------
+        $ {2} {0} -v -n {3} --rollup 5m --rollup-agg cpu=avg,max metrics.csv
+
+    # ------------------------------------------------
+    # Example 8: Add the new rows of a daily export to
+    #            the metrics table.
+    # ------------------------------------------------
+        $ {2} {0} -v -n {3} -t metrics --upsert host,time --high-water time export.csv
+
+VERSION:
+   {1}
+'''.format(base, __version__, CLI, DEFAULT_NAME).strip()
+    afc = argparse.RawTextHelpFormatter
+    parser = argparse.ArgumentParser(formatter_class=afc,
+                                     description=desc[:-2],
+                                     usage=usage,
+                                     epilog=epilog.rstrip() + '\n ')
+    add_common_args(parser, '-g', '-n', '-p')
+    csv2sql.add_csv_args(parser, output=False)
+    parser.add_argument('CSV',
+                        action='store',
+                        nargs='+',
+                        help='''\
+The CSV files to ingest.
+
+Each can be a file, a directory of CSV
+files or a glob pattern. All of the files
+must have the same header and they are
+ingested into the same table.
+
+The files can be compressed (gzip, bzip2,
+xz or zstd) and JSON Lines files (.jsonl
+or .ndjson) are also accepted.
+''')
+    opts = parser.parse_args()
+    opts.format = 'copy'
+    opts.batch = 0
+    opts.header_only = False
+    return opts
+
+
+class Progress:
+    '''
+    Report the ingest progress.
+
+    It is called with the number of rows written after each chunk.
+    '''
+    def __init__(self, path: str):
+        '''Start the progress report.
+
+        Args:
+            path: The CSV file path.
+        '''
+        self.m_path = path
+        self.m_start = time.time()
+        self.m_last = self.m_start
+        self.m_rows = 0
+
+    def __call__(self, rows: int):
+        '''Update the number of rows and report them periodically.
+
+        Args:
+            rows: The number of rows written so far.
+        '''
+        self.m_rows = rows
+        now = time.time()
+        if now - self.m_last >= PROGRESS_INTERVAL:
+            self.m_last = now
+            info(f'   {self.m_path}: {rows} rows, {self.rate():0.1f} rows/s')
+
+    def elapsed(self) -> float:
+        '''Get the elapsed time.
+
+        Returns:
+            elapsed: The seconds since the start, never zero.
+        '''
+        return max(time.time() - self.m_start, 1e-6)
+
+    def rate(self) -> float:
+        '''Get the ingest rate.
+
+        Returns:
+            rate: The rows per second.
+        '''
+        return self.m_rows / self.elapsed()
+
+
+def ingest_file(conf: dict,  # pylint: disable=too-many-arguments
+                args: argparse.Namespace,
+                crecs: list,
+                widen: bool,
+                path: str) -> Tuple[int, Optional[csvrollup.Rollup]]:
+    '''Ingest the rows of a CSV file into an existing table.
+
+    It is called by the worker processes.
+
+    Args:
+        conf: The configuration data.
+        args: The conversion arguments.
+        crecs: The column records with the types populated.
+        widen: Widen the column types if a value does not fit.
+        path: The CSV file path.
+
+    Returns:
+        rows: The number of rows ingested.
+        rollup: The rollup of the rows if rollups are enabled.
+    '''
+    info(f'ingesting "{path}"')
+    progress = Progress(path)
+    rollup = csvrollup.Rollup(args, crecs) if args.rollup else None
+    if args.no_raw:
+        # The rows are only aggregated.
+        assert rollup
+        csvrollup.rollup_rows(args, path, rollup, progress)
+    else:
+        pipe(conf, path, lambda ofp: csv2sql.create_sql_insert_values(
+            args, ofp, path, crecs, args.table, progress, widen, rollup))
+    info(f'ingested {progress.m_rows} rows from "{path}" in '
+         f'{progress.elapsed():0.1f} seconds ({progress.rate():0.1f} rows/s)')
+    return progress.m_rows, rollup
+
+
+def get_high_water_mark(conf: dict, args: argparse.Namespace, crecs: list) -> datetime.datetime:
+    '''Get the high water mark of the table.
+
+    Args:
+        conf: The configuration data.
+        args: The conversion arguments.
+        crecs: The column records with the types populated.
+
+    Returns:
+        mark: The maximum value of the high water mark column or
+            datetime.min if the table does not exist or it is empty.
+    '''
+    csvappend.get_append_columns(args, crecs)  # check the column
+    mark = datetime.datetime.min
+    rows = query(conf, f"SELECT to_regclass('{args.table}') IS NOT NULL")
+    if rows and rows[0][0] == 't':
+        rows = query(conf, f'SELECT max({args.high_water}) FROM {args.table}')
+        value = csvtypes.to_datetime(rows[0][0]) if rows and rows[0][0] else None
+        if value is not None:
+            mark = value.replace(tzinfo=None)
+    info(f'high water mark of {args.table}.{args.high_water}: {mark}')
+    return mark
+
+
+def ingest(conf: dict, args: argparse.Namespace, paths: List[str]) -> int:
+    '''Ingest CSV files into one table of the project database.
+
+    The table is created first and then the files are loaded by a
+    pool of worker processes, each of them streams one file at a
+    time through its own psql connection.
+
+    Args:
+        conf: The configuration data.
+        args: The conversion arguments.
+        paths: The CSV file paths.
+
+    Returns:
+        rows: The number of rows ingested.
+    '''
+    csv2sql.check_csv_args(args, paths)
+    maxc, crecs = csvtypes.get_column_recs(args, paths)
+    partitions = csv2sql.get_partitions(args, paths, crecs) if args.partition else []
+    rollup = csvrollup.Rollup(args, crecs) if args.rollup else None
+    if args.append and args.high_water:
+        args.high_water_mark = get_high_water_mark(conf, args, crecs)
+    info(f'ingesting {len(paths)} files into table {args.table} of {conf["pg"]["name"]}')
+    if not args.no_raw:
+        pipe(conf, args.table, lambda ofp: csv2sql.create_sql_table(
+            ofp, crecs, args.table, maxc, args.partition, partitions, args.append))
+    if args.append:
+        pipe(conf, args.table, lambda ofp: csvappend.create_sql_append(
+            args, ofp, crecs, args.table))
+
+    # The column types can only be widened while loading if the
+    # files are loaded one at a time by this process.
+    widen = args.jobs <= 1 or len(paths) == 1
+    rows = 0
+    results = csvio.map_files(ingest_file, paths, args.jobs, conf, args, crecs, widen)
+    for frows, frollup in results:
+        rows += frows
+        if rollup and frollup:
+            rollup.merge(frollup)
+    if args.time_index != 'none' and not args.no_raw:
+        info(f'creating the {args.time_index} indexes')
+        pipe(conf, args.table, lambda ofp: csv2sql.create_sql_indexes(
+            ofp, crecs, args.table, args.time_index))
+    if rollup:
+        info('writing the rollup tables')
+        pipe(conf, args.table, rollup.write)
+    if args.schema_out:
+        csvtypes.write_schema(args, crecs)
+    return rows
+
+
+def main():
+    '''Ingest command main.
+
+    This is the command line entry point for the ingest command.
+    '''
+    opts = getopts()
+    initv(opts.verbose)
+    info(f'ingest {" ".join(opts.CSV)} into {opts.base}')
+    paths = csvio.expand_paths(opts.CSV)
+    conf = get_conf(opts.base, '', opts.grxport, opts.pgxport)
+    start = time.time()
+    rows = ingest(conf, opts, paths)
+    elapsed = max(time.time() - start, 1e-6)
+    print(f'{rows} rows in {elapsed:0.1f}s ({rows / elapsed:0.1f} rows/s)')
+    info('done')
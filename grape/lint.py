@@ -0,0 +1,318 @@
+'''
+The lint operation checks the dashboards of a local grape project for
+performance anti-patterns.
+
+The dashboards are read from the local grafana server or from a saved
+archive (-f). Each finding is reported with its severity, its rule
+and the ids of the offending panels. The operation exits with a
+non-zero status if there are findings with the --fail-on severity so
+that it can block expensive dashboards in CI before they are
+exported.
+
+The rules are:
+   refresh          - the dashboard refreshes more often than
+                      --min-refresh (error).
+   panels           - the dashboard has more than --max-panels
+                      panels (warning).
+   no-time-filter   - a postgres query does not filter on the time
+                      range with $__timeFilter or a similar macro so
+                      it reads the complete table (error).
+   no-time-group    - a postgres time series query returns raw rows
+                      without $__timeGroup or GROUP BY aggregation
+                      (warning).
+   variable-refresh - a query template variable runs its query on
+                      every time range change (warning).
+'''
+import argparse
+import os
+import re
+import sys
+from typing import Callable, Dict, List, Tuple
+
+from grape.common.args import DEFAULT_NAME, CLI, add_common_args, args_get_text
+from grape.common.log import initv, info
+from grape.common.conf import get_conf
+from grape.common.filters import get_filters
+from grape.common.queries import INTERVAL_RE, get_targets, parse_interval
+from grape.profile_queries import read_services
+from grape import __version__
+
+
+# The severities from the least to the most severe.
+SEVERITIES = ['warning', 'error']
+
+# The macros that filter on the time range.
+TIME_FILTER_RE = re.compile(r'\$__(?:timeFilter|timeFrom|timeTo|unixEpochFilter|'
+                            r'unixEpochNanoFilter|unixEpochFrom|unixEpochTo)\b|'
+                            r'\$\{?__(?:from|to)\b')
+
+# The macros and clauses that aggregate rows.
+TIME_GROUP_RE = re.compile(r'\$__(?:timeGroup|timeGroupAlias|unixEpochGroup|unixEpochGroupAlias)\b|'
+                           r'\bGROUP\s+BY\b', re.IGNORECASE)
+
+# A query that reads a table.
+FROM_RE = re.compile(r'\bFROM\b', re.IGNORECASE)
+
+# The variable refresh setting that runs the query on every time
+# range change.
+REFRESH_ON_TIME_CHANGE = 2
+
+# A finding: the panel ids and the message.
+Finding = Tuple[List[int], str]
+
+
+def getopts() -> argparse.Namespace:
+    '''Process the command line options.
+
+    Returns:
+       opts: The argument namespace.
+    '''
+    argparse._ = args_get_text  # type: ignore
+    base = os.path.basename(sys.argv[0])
+    usage = '\n {0} [OPTIONS]'.format(base)
+    desc = 'DESCRIPTION:{0}'.format('\n  '.join(__doc__.split('\n')))
+    epilog = '''
+EXAMPLES:
+    # ------------------------------------------------
+    # Example 1: Help.
+    # ------------------------------------------------
+        $ {2} {0} -h
+
+    # ------------------------------------------------
+    # Example 2: Lint the dashboards in the local
+    #            grafana server.
+    # ------------------------------------------------
+        $ {2} {0} -n {3} -g 4600
+
+    # ------------------------------------------------
+    # Example 3: Lint the dashboards in an archive
+    #            before exporting it and fail on
+    #            warnings too.
+    # ------------------------------------------------
+        $ {2} {0} -n {3} -f {3}.zip --fail-on warning && \\
+          {2} export -v -f {3}.zip -x export.yaml
+
+    # ------------------------------------------------
+    # Example 4: Skip a rule.
+    # ------------------------------------------------
+        $ {2} {0} -n {3} -g 4600 --disable no-time-group
+
+VERSION:
+   {1}
+'''.format(base, __version__, CLI, DEFAULT_NAME).strip()
+    afc = argparse.RawTextHelpFormatter
+    parser = argparse.ArgumentParser(formatter_class=afc,
+                                     description=desc[:-2],
+                                     usage=usage,
+                                     epilog=epilog.rstrip() + '\n ')
+    add_common_args(parser, '--filter', '-f', '-g', '-n', '-p')
+    parser.add_argument('--disable',
+                        action='append',
+                        default=[],
+                        choices=list(RULES),
+                        metavar=('RULE'),
+                        help='''\
+Disable a rule. It can be specified
+multiple times.
+ ''')
+
+    parser.add_argument('--fail-on',
+                        action='store',
+                        choices=SEVERITIES,
+                        default='error',
+                        help='''\
+Exit with a non-zero status if there are
+findings with this severity or a more
+severe one.
+
+The default is %(default)s.
+ ''')
+
+    parser.add_argument('--max-panels',
+                        action='store',
+                        type=int,
+                        default=60,
+                        metavar=('N'),
+                        help='''\
+The maximum number of panels in a
+dashboard.
+
+The default is %(default)s.
+ ''')
+
+    parser.add_argument('--min-refresh',
+                        action='store',
+                        default='30s',
+                        metavar=('INTERVAL'),
+                        help='''\
+The minimum dashboard refresh interval,
+for example 1m.
+
+The default is %(default)s.
+ ''')
+
+    opts = parser.parse_args()
+    return opts
+
+
+def check_refresh(opts: argparse.Namespace, dash: dict, _: list) -> List[Finding]:
+    '''Check the dashboard refresh interval.
+
+    Args:
+        opts: The command line options.
+        dash: The dashboard.
+        _: The postgres targets of the dashboard.
+
+    Returns:
+        findings: The findings.
+    '''
+    refresh = dash.get('refresh') or ''
+    if not isinstance(refresh, str) or not INTERVAL_RE.fullmatch(refresh):
+        return []
+    if parse_interval(refresh) < parse_interval(opts.min_refresh):
+        return [([], f'refresh interval {refresh} is shorter than {opts.min_refresh}')]
+    return []
+
+
+def check_panels(opts: argparse.Namespace, dash: dict, _: list) -> List[Finding]:
+    '''Check the number of panels.
+
+    Args:
+        opts: The command line options.
+        dash: The dashboard.
+        _: The postgres targets of the dashboard.
+
+    Returns:
+        findings: The findings.
+    '''
+    def count(panels: list) -> int:
+        return sum((panel.get('type') != 'row') + count(panel.get('panels', []))
+                   for panel in panels)
+
+    num = count(dash.get('panels', []))
+    num += sum(count(row.get('panels', [])) for row in dash.get('rows', []))
+    if num > opts.max_panels:
+        return [([], f'{num} panels, the maximum is {opts.max_panels}')]
+    return []
+
+
+def check_time_filter(_: argparse.Namespace, __: dict, targets: list) -> List[Finding]:
+    '''Check that the postgres queries filter on the time range.
+
+    Args:
+        _: The command line options.
+        __: The dashboard.
+        targets: The postgres targets of the dashboard.
+
+    Returns:
+        findings: The findings.
+    '''
+    ids = [rec['panel'].get('id', 0) for rec in targets
+           if FROM_RE.search(rec['sql']) and not TIME_FILTER_RE.search(rec['sql'])]
+    if ids:
+        return [(ids, 'query reads the complete table, it does not use $__timeFilter')]
+    return []
+
+
+def check_time_group(_: argparse.Namespace, __: dict, targets: list) -> List[Finding]:
+    '''Check that the postgres time series queries aggregate the rows.
+
+    Args:
+        _: The command line options.
+        __: The dashboard.
+        targets: The postgres targets of the dashboard.
+
+    Returns:
+        findings: The findings.
+    '''
+    ids = [rec['panel'].get('id', 0) for rec in targets
+           if rec['target'].get('format', 'time_series') == 'time_series'
+           and FROM_RE.search(rec['sql']) and not TIME_GROUP_RE.search(rec['sql'])]
+    if ids:
+        return [(ids, 'time series query returns raw rows, it does not use $__timeGroup')]
+    return []
+
+
+def check_variable_refresh(_: argparse.Namespace, dash: dict, __: list) -> List[Finding]:
+    '''Check that the template variables do not run their queries on
+    every time range change.
+
+    Args:
+        _: The command line options.
+        dash: The dashboard.
+        __: The postgres targets of the dashboard.
+
+    Returns:
+        findings: The findings.
+    '''
+    findings: List[Finding] = []
+    for var in dash.get('templating', {}).get('list', []):
+        if var.get('type') == 'query' and var.get('refresh') == REFRESH_ON_TIME_CHANGE:
+            findings.append(([], f'variable "{var.get("name", "")}" runs its query on every '
+                                 'time range change'))
+    return findings
+
+
+# The rules by name with their severity.
+RULES: Dict[str, Tuple[str, Callable[[argparse.Namespace, dict, list], List[Finding]]]] = {
+    'refresh': ('error', check_refresh),
+    'panels': ('warning', check_panels),
+    'no-time-filter': ('error', check_time_filter),
+    'no-time-group': ('warning', check_time_group),
+    'variable-refresh': ('warning', check_variable_refresh),
+}
+
+
+def lint(opts: argparse.Namespace, zgr: dict) -> List[dict]:
+    '''Check the dashboards.
+
+    Args:
+        opts: The command line options.
+        zgr: The grafana datasources and dashboards.
+
+    Returns:
+        findings: A record for each finding with the severity, the
+            rule, the dashboard, the panel ids and the message.
+    '''
+    findings = []
+    for rec in zgr['dashboards']:
+        dash = rec['dashboard']
+        targets = get_targets(zgr['datasources'], [rec])
+        for rule, (severity, check) in RULES.items():
+            if rule in opts.disable:
+                continue
+            for ids, msg in check(opts, dash, targets):
+                findings.append({
+                    'severity': severity,
+                    'rule': rule,
+                    'dashboard': f'{dash.get("title", "")} ({dash.get("uid", "")})',
+                    'panels': sorted(set(ids)),
+                    'message': msg,
+                })
+    return findings
+
+
+def main():
+    '''Lint command main.
+
+    This is the command line entry point for the lint command.
+    '''
+    opts = getopts()
+    initv(opts.verbose)
+    parse_interval(opts.min_refresh)  # validate it before reading anything
+    info(f'linting the dashboards of {opts.base}')
+    conf = get_conf(opts.base, opts.fname, opts.grxport, opts.pgxport)
+    zgr = read_services(conf, get_filters(opts))
+    findings = lint(opts, zgr)
+    for rec in findings:
+        panels = f' panels {",".join(str(pid) for pid in rec["panels"])}' if rec['panels'] else ''
+        print(f'{rec["severity"]:<8} {rec["rule"]:<17} {rec["dashboard"]}{panels}: '
+              f'{rec["message"]}')
+    counts = {severity: sum(rec['severity'] == severity for rec in findings)
+              for severity in SEVERITIES}
+    print(f'{counts["error"]} errors, {counts["warning"]} warnings in '
+          f'{len(zgr["dashboards"])} dashboards')
+    threshold = SEVERITIES.index(opts.fail_on)
+    if any(SEVERITIES.index(rec['severity']) >= threshold for rec in findings):
+        sys.exit(1)
+    info('done')
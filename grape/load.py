@@ -5,14 +5,18 @@ from a saved state (zip file).
 import argparse
 import os
 import sys
+from typing import Any, Dict, Optional
 
 from grape.common.args import DEFAULT_NAME, CLI, add_common_args, args_get_text
-from grape.common.log import initv, info
-from grape.common.conf import get_conf
+from grape.common.log import initv, info, err
+from grape.common.conf import get_conf, set_ephemeral, set_pg_settings
+from grape.common.filters import get_filters, filter_services
 from grape.common.gr import load_all as gr_load
+from grape.common.gr import update_datasource
 from grape.common.pg import load as pg_load
+from grape.common.snapshot import GRDB, PGTAR, load_grdb, load_pgdata
 from grape.common.zip import load as zp_load
-from grape.create import create
+from grape.create import EPHEMERAL_KEYS, create
 from grape.delete import delete
 from grape import __version__
 
@@ -56,6 +60,24 @@ EXAMPLES:
         $ unzip -l example.zip
         $ {2} {0} -v -n {3} -g 4700 -f example.zip
 
+    # ------------------------------------------------
+    # Example 4: Only load the dashboards whose titles
+    #            start with "Ops".
+    # ------------------------------------------------
+        $ {2} {0} -v -n {3} -g 4700 -f example.zip --title-regex '^Ops'
+
+    # ------------------------------------------------
+    # Example 5: Load the archive into an in memory
+    #            database for CI.
+    # ------------------------------------------------
+        $ {2} {0} -v -n {3} -g 4700 -f example.zip --ephemeral
+
+    # ------------------------------------------------
+    # Example 6: Restore a large database quickly and
+    #            show the time of each phase.
+    # ------------------------------------------------
+        $ {2} {0} -v -n {3} -g 4700 -f example.zip --bulk
+
 VERSION:
    {1}
 '''.format(base, __version__, CLI, DEFAULT_NAME).strip()
@@ -64,12 +86,39 @@ VERSION:
                                      description=desc[:-2],
                                      usage=usage,
                                      epilog=epilog.rstrip() + '\n ')
-    add_common_args(parser, '-f', '-g', '-n', '-p', '-w')
+    add_common_args(parser, '--ephemeral', '--filter', '-f', '-g', '-n', '-p', '-w')
+    parser.add_argument('--bulk',
+                        action='store_true',
+                        help='''\
+Restore the database SQL in bulk mode. Each
+database is restored in a single transaction
+with ON_ERROR_STOP, synchronous_commit off
+and more maintenance_work_mem for the index
+builds and it finishes with a parallel
+VACUUM ANALYZE. The time of each phase is
+reported.
+ ''')
+
     opts = parser.parse_args()
     return opts
 
 
-def load(conf: dict, wait: float):
+def set_archive_settings(conf: dict, zconf: dict):
+    '''Reproduce the postgres server settings of an archive.
+
+    They replace the settings that are recorded in the project
+    directory. The archives without settings reset them to the
+    defaults.
+
+    Args:
+        conf: The configuration data, it is updated.
+        zconf: The configuration data from the archive.
+    '''
+    conf['pg']['settings'] = {}
+    set_pg_settings(conf, zconf.get('pg', {}).get('settings', {}))
+
+
+def load(conf: dict, wait: float, filters: Optional[Dict[str, Any]] = None, bulk: bool = False):
     '''Load the servers.
 
     Load the current grafana and postgres servers from
@@ -80,13 +129,28 @@ def load(conf: dict, wait: float):
     The alternative would be to delete the individual
     components of each service which is a challenge.
 
+    If the archive contains a grafana database snapshot, it is
+    restored before the grafana container is started and the
+    datasource is pointed at the project database.
+
+    If the archive contains a postgres data directory snapshot, it
+    is restored before the postgres container is started so no SQL
+    is replayed.
+
+    The postgres container is started with the server settings
+    recorded in the archive, for example the tuning profile.
+
     Args:
         conf: The configuration data.
         wait: The container create wait time.
+        filters: The optional dashboard filters.
+        bulk: Restore the database SQL in bulk mode.
     '''
     result = zp_load(conf)
     zconf = result['conf']
     zgr = result['gr']
+    if zgr and filters:
+        zgr = filter_services(filters, zgr)
     sql = result['pg']
 
     # Special case handling for import an zip file.
@@ -94,10 +158,24 @@ def load(conf: dict, wait: float):
         assert 'import' not in conf
         conf['import'] = zconf['import']
 
+    set_archive_settings(conf, zconf)
+    for key, member in [('gr', GRDB), ('pg', PGTAR)]:
+        if conf[key]['ephemeral'] and member in result['files']:
+            err(f'the archive contains a {key} snapshot, it cannot be restored '
+                f'in ephemeral mode: {conf["file"]}')
+
     delete(conf)
+    if GRDB in result['files']:
+        load_grdb(conf, conf['file'])
+    if PGTAR in result['files']:
+        load_pgdata(conf, conf['file'])
     create(conf, wait)
-    gr_load(conf, zgr)
-    pg_load(conf, sql)
+    if GRDB in result['files']:
+        update_datasource(conf, zconf['pg']['name'])
+    if zgr:
+        gr_load(conf, zgr)
+    if sql:
+        pg_load(conf, sql, bulk)
 
 
 def main():
@@ -109,5 +187,7 @@ def main():
     initv(opts.verbose)
     info(f'load {opts.fname} into {opts.base}')
     conf = get_conf(opts.base, opts.fname, opts.grxport, opts.pgxport)
-    load(conf, opts.wait)
+    if opts.ephemeral:
+        set_ephemeral(conf, EPHEMERAL_KEYS[opts.ephemeral])
+    load(conf, opts.wait, get_filters(opts), opts.bulk)
     info('done')
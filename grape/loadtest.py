@@ -0,0 +1,514 @@
+'''
+The loadtest operation measures how a dashboard of a local grape
+project behaves when many people open it at the same time.
+
+It reads the dashboard from the local grafana server and builds the
+/api/ds/query requests that the grafana frontend sends for each of
+its panels with the template variables interpolated for the time
+range. Then it replays them with N concurrent virtual users for a
+set duration. Each virtual user opens the dashboard repeatedly, it
+sends the panel requests in parallel like a browser does, waits for
+all of them and then opens the dashboard again.
+
+The latency percentiles (p50, p95, p99) of each panel and of the
+complete dashboard and the overall throughput are reported to the
+terminal and optionally to a JSON file.
+'''
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+import requests
+
+from grape.common.args import DEFAULT_NAME, CLI, add_common_args, args_get_text
+from grape.common.log import initv, info, warn, err
+from grape.common.conf import get_conf
+from grape.common.gr import get_auth, get_session
+from grape.common.queries import MAX_DATA_POINTS, MIXED, expand_variables, format_interval
+from grape.common.queries import get_interval, get_panels, get_variables
+from grape.profile_queries import add_query_args, get_overrides, get_time_range
+from grape.save import save_gr_read
+from grape import __version__
+
+
+# The percentiles that are reported.
+PERCENTILES = [50, 95, 99]
+
+# The target fields that can contain template variables.
+TEXT_FIELDS = ['rawSql', 'expr', 'query', 'target']
+
+# The name of the complete dashboard load in the statistics.
+DASHBOARD = 'dashboard load'
+
+
+def getopts() -> argparse.Namespace:
+    '''Process the command line options.
+
+    Returns:
+       opts: The argument namespace.
+    '''
+    argparse._ = args_get_text  # type: ignore
+    base = os.path.basename(sys.argv[0])
+    usage = '\n {0} [OPTIONS]'.format(base)
+    desc = 'DESCRIPTION:{0}'.format('\n  '.join(__doc__.split('\n')))
+    epilog = '''
+EXAMPLES:
+    # ------------------------------------------------
+    # Example 1: Help.
+    # ------------------------------------------------
+        $ {2} {0} -h
+
+    # ------------------------------------------------
+    # Example 2: Open a dashboard with 50 virtual
+    #            users for one minute.
+    # ------------------------------------------------
+        $ {2} {0} -v -n {3} -g 4600 -d 7zdybtDGk -u 50 -t 60
+
+    # ------------------------------------------------
+    # Example 3: Load test the last 7 days of a
+    #            dashboard and save the report.
+    # ------------------------------------------------
+        $ {2} {0} -v -n {3} -g 4600 -d 7zdybtDGk --from now-7d --to now \\
+              -o loadtest.json
+
+    # ------------------------------------------------
+    # Example 4: Print the panel requests without
+    #            sending them.
+    # ------------------------------------------------
+        $ {2} {0} -n {3} -g 4600 -d 7zdybtDGk --dry-run
+
+VERSION:
+   {1}
+'''.format(base, __version__, CLI, DEFAULT_NAME).strip()
+    afc = argparse.RawTextHelpFormatter
+    parser = argparse.ArgumentParser(formatter_class=afc,
+                                     description=desc[:-2],
+                                     usage=usage,
+                                     epilog=epilog.rstrip() + '\n ')
+    add_common_args(parser, '-g', '-n', '-p')
+    add_query_args(parser)
+    parser.add_argument('-d', '--dashboard',
+                        action='store',
+                        required=True,
+                        metavar=('UID'),
+                        help='''\
+The uid of the dashboard.
+ ''')
+
+    parser.add_argument('-D', '--dry-run',
+                        action='store_true',
+                        help='''\
+Print the panel requests instead of
+sending them.
+ ''')
+
+    parser.add_argument('-o', '--out',
+                        action='store',
+                        default='',
+                        metavar=('FILE'),
+                        help='''\
+Write the report to this JSON file.
+ ''')
+
+    parser.add_argument('--parallel',
+                        action='store',
+                        type=int,
+                        default=6,
+                        metavar=('N'),
+                        help='''\
+The number of panel requests that each
+virtual user sends in parallel. Browsers
+open 6 connections per server.
+
+The default is %(default)s.
+ ''')
+
+    parser.add_argument('-t', '--duration',
+                        action='store',
+                        type=float,
+                        default=60,
+                        metavar=('SECONDS'),
+                        help='''\
+The duration of the test. The dashboard
+loads that are in progress when it ends
+are completed.
+
+The default is %(default)s.
+ ''')
+
+    parser.add_argument('--think',
+                        action='store',
+                        type=float,
+                        default=0,
+                        metavar=('SECONDS'),
+                        help='''\
+The time that each virtual user waits
+between dashboard loads.
+
+The default is %(default)s.
+ ''')
+
+    parser.add_argument('--timeout',
+                        action='store',
+                        type=float,
+                        default=30,
+                        metavar=('SECONDS'),
+                        help='''\
+The timeout of each panel request. A
+request that times out is an error.
+
+The default is %(default)s.
+ ''')
+
+    parser.add_argument('-u', '--users',
+                        action='store',
+                        type=int,
+                        default=10,
+                        metavar=('N'),
+                        help='''\
+The number of concurrent virtual users.
+
+The default is %(default)s.
+ ''')
+
+    opts = parser.parse_args()
+    return opts
+
+
+def get_requests(opts: argparse.Namespace, datasources: list,
+                 dash: dict) -> List[Tuple[str, dict]]:
+    '''Build the /api/ds/query requests of the panels of a dashboard.
+
+    Args:
+        opts: The command line options, they define the time range
+            and the template variable overrides.
+        datasources: The datasource records from api/datasources.
+        dash: The dashboard.
+
+    Returns:
+        requests: The panel name and the request body of each panel
+            that has queries.
+    '''
+    dsmap = {}
+    default = None
+    for rec in datasources:
+        dsmap[rec['name']] = rec
+        dsmap[rec.get('uid', '')] = rec
+        if rec.get('isDefault'):
+            default = rec
+
+    def resolve(ref: Any) -> dict:
+        if ref is None or ref == 'default':
+            return default or {}
+        if isinstance(ref, dict):
+            ref = ref.get('uid') or ref.get('name')
+        return dsmap.get(str(ref), {})
+
+    variables = get_variables(dash, get_overrides(opts))
+    lower, upper = get_time_range(opts, dash)
+
+    result = []
+    for panel in get_panels(dash):
+        queries = get_panel_queries(panel, resolve, variables, lower, upper)
+        if queries:
+            name = f'{panel.get("title", "")} ({panel.get("id", "")})'
+            result.append((name, {
+                'queries': queries,
+                'from': str(int(lower.timestamp() * 1000)),
+                'to': str(int(upper.timestamp() * 1000)),
+            }))
+    return result
+
+
+def get_panel_queries(panel: dict,
+                      resolve: Callable[[Any], dict],
+                      variables: Dict[str, Tuple[List[str], bool]],
+                      lower: datetime.datetime,
+                      upper: datetime.datetime) -> List[dict]:
+    '''Build the queries of the request of a panel.
+
+    Args:
+        panel: The panel.
+        resolve: Function that gets the datasource record of a
+            datasource reference, it returns an empty record for
+            an unknown datasource.
+        variables: The template variables from get_variables.
+        lower: The start of the time range.
+        upper: The end of the time range.
+
+    Returns:
+        queries: The queries of the targets that are not hidden and
+            that have a known datasource.
+    '''
+    pds = panel.get('datasource')
+    mixed = MIXED in (pds, pds.get('uid') if isinstance(pds, dict) else '')
+    interval = get_interval(lower, upper, panel.get('interval', ''))
+    builtins = {'__interval': format_interval(interval),
+                '__interval_ms': str(int(interval * 1000))}
+    queries = []
+    for target in panel['targets']:
+        if target.get('hide'):
+            continue
+        datasource = resolve(target.get('datasource') if mixed or pds is None else pds)
+        if not datasource:
+            continue
+        query = copy.deepcopy(target)
+        for field in TEXT_FIELDS:
+            if isinstance(query.get(field), str):
+                query[field] = expand_variables(query[field], variables, builtins)
+        query['datasource'] = {'uid': datasource.get('uid', ''),
+                               'type': datasource.get('type', '')}
+        if 'id' in datasource:
+            # Old datasources do not have a uid.
+            query['datasourceId'] = datasource['id']
+        query['intervalMs'] = int(interval * 1000)
+        query['maxDataPoints'] = panel.get('maxDataPoints', MAX_DATA_POINTS)
+        queries.append(query)
+    return queries
+
+
+def percentile(values: List[float], pct: float) -> float:
+    '''Get a percentile using the nearest rank method.
+
+    Args:
+        values: The sorted values.
+        pct: The percentile.
+
+    Returns:
+        value: The percentile value or 0 if there are no values.
+    '''
+    if not values:
+        return 0.0
+    rank = max(1, -int(-pct * len(values) // 100))
+    return values[rank - 1]
+
+
+def summarize(latencies: List[float], errors: List[str]) -> Dict[str, Any]:
+    '''Summarize the latencies of a panel or of the dashboard loads.
+
+    Args:
+        latencies: The latencies in seconds.
+        errors: The error messages of the failed requests.
+
+    Returns:
+        summary: The count, the errors and the latency percentiles
+            and maximum in milliseconds.
+    '''
+    values = sorted(latencies)
+    summary: Dict[str, Any] = {'count': len(values), 'errors': len(errors)}
+    for pct in PERCENTILES:
+        summary[f'p{pct}'] = round(percentile(values, pct) * 1000, 1)
+    summary['max'] = round(values[-1] * 1000, 1) if values else 0.0
+    return summary
+
+
+class LoadTest:
+    '''A load test of the panel requests of a dashboard.
+
+    Each virtual user runs in its own thread with its own HTTP
+    session and a pool of threads for the parallel panel requests.
+    '''
+    def __init__(self,  # pylint: disable=too-many-arguments,too-many-positional-arguments
+                 burl: str,
+                 session: requests.Session,
+                 panels: List[Tuple[str, dict]],
+                 parallel: int,
+                 timeout: float):
+        '''Initialize the load test.
+
+        Args:
+            burl: The base URL of the grafana server.
+            session: The authenticated session, its credentials are
+                copied to the session of each virtual user.
+            panels: The panel names and request bodies.
+            parallel: The number of parallel requests per user.
+            timeout: The timeout of each request in seconds.
+        '''
+        self.m_url = f'{burl}/api/ds/query'
+        self.m_session = session
+        self.m_panels = panels
+        self.m_parallel = max(1, min(parallel, len(panels)))
+        self.m_timeout = timeout
+        self.m_lock = threading.Lock()
+        # The latencies and the error messages of each panel and of
+        # the dashboard loads.
+        self.m_stats: Dict[str, Tuple[List[float], List[str]]] = {
+            name: ([], []) for name in [name for name, _ in panels] + [DASHBOARD]}
+
+    def new_session(self) -> requests.Session:
+        '''Create a session for a virtual user.
+
+        Returns:
+            session: A session with the credentials of the
+                authenticated session.
+        '''
+        session = requests.Session()
+        session.headers.update(self.m_session.headers)
+        session.cookies.update(self.m_session.cookies)
+        session.auth = self.m_session.auth
+        return session
+
+    def send(self, session: requests.Session, name: str, body: dict) -> bool:
+        '''Send a panel request and record its latency.
+
+        Args:
+            session: The virtual user session.
+            name: The panel name.
+            body: The request body.
+
+        Returns:
+            failed: True if the request failed or timed out.
+        '''
+        error = ''
+        start = time.time()
+        try:
+            response = session.post(self.m_url, json=body, timeout=self.m_timeout)
+            if response.status_code != 200:
+                error = f'status {response.status_code}: {response.text[:200]}'
+            else:
+                for rec in response.json().get('results', {}).values():
+                    if rec.get('error'):
+                        error = rec['error']
+        except requests.Timeout:
+            error = f'timed out after {self.m_timeout}s'
+        except requests.RequestException as exc:
+            error = str(exc)
+        elapsed = time.time() - start
+        with self.m_lock:
+            samples, errors = self.m_stats[name]
+            if error:
+                errors.append(error)
+            else:
+                samples.append(elapsed)
+        return bool(error)
+
+    def user(self, deadline: float, think: float):
+        '''Run a virtual user until the deadline.
+
+        Args:
+            deadline: The time when the test ends.
+            think: The time to wait between dashboard loads.
+        '''
+        session = self.new_session()
+        with ThreadPoolExecutor(max_workers=self.m_parallel) as pool:
+            while time.time() < deadline:
+                start = time.time()
+                futures = [pool.submit(self.send, session, name, body)
+                           for name, body in self.m_panels]
+                failed = [future.result() for future in futures]
+                with self.m_lock:
+                    samples, errors = self.m_stats[DASHBOARD]
+                    samples.append(time.time() - start)
+                    if any(failed):
+                        errors.append(f'{sum(failed)} panel requests failed')
+                if think:
+                    time.sleep(think)
+
+    def first_error(self) -> str:
+        '''Get the first error of the first panel that failed.
+
+        Returns:
+            error: The panel name and the error message or an empty
+                string if there were no errors.
+        '''
+        for name, _ in self.m_panels:
+            errors = self.m_stats[name][1]
+            if errors:
+                return f'{name}: {errors[0]}'
+        return ''
+
+    def run(self, users: int, duration: float, think: float) -> Dict[str, Any]:
+        '''Run the load test.
+
+        Args:
+            users: The number of virtual users.
+            duration: The duration in seconds.
+            think: The time to wait between dashboard loads.
+
+        Returns:
+            report: The overall and per panel results.
+        '''
+        start = time.time()
+        deadline = start + duration
+        threads = [threading.Thread(target=self.user, args=(deadline, think), daemon=True)
+                   for _ in range(users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+        panels = {name: summarize(*self.m_stats[name]) for name, _ in self.m_panels}
+        errors = sum(rec['errors'] for rec in panels.values())
+        requests_sent = sum(rec['count'] for rec in panels.values()) + errors
+        loads, load_errors = self.m_stats[DASHBOARD]
+        return {
+            'timestamp': datetime.datetime.utcnow().isoformat(timespec='seconds'),
+            'users': users,
+            'duration': round(elapsed, 1),
+            'requests': requests_sent,
+            'errors': errors,
+            'throughput': round(requests_sent / elapsed, 1),
+            'dashboard': summarize(loads, load_errors),
+            'panels': panels,
+        }
+
+
+def report(result: Dict[str, Any]):
+    '''Print the load test report.
+
+    Args:
+        result: The load test result.
+    '''
+    print(f'{result["users"]} users, {result["duration"]}s, {result["requests"]} requests, '
+          f'{result["errors"]} errors, {result["throughput"]} requests/s')
+    cols = ['count', 'errors'] + [f'p{pct}' for pct in PERCENTILES] + ['max']
+    print(''.join(f'{col:>9}' for col in cols) + '  panel')
+    rows = list(result['panels'].items())
+    rows.append((DASHBOARD, result['dashboard']))
+    for name, rec in rows:
+        print(''.join(f'{rec[col]:>9}' for col in cols) + f'  {name}')
+
+
+def main():
+    '''Load test command main.
+
+    This is the command line entry point for the loadtest command.
+    '''
+    opts = getopts()
+    initv(opts.verbose)
+    info(f'load testing dashboard {opts.dashboard} of {opts.base}')
+    conf = get_conf(opts.base, '', opts.grxport, opts.pgxport)
+    datasources = save_gr_read(conf, 'api/datasources')
+    dash = save_gr_read(conf, f'api/dashboards/uid/{opts.dashboard}')['dashboard']
+    panels = get_requests(opts, datasources, dash)
+    info(f'found {len(panels)} panels with queries in "{dash.get("title", "")}"')
+    if not panels:
+        err(f'no panels with queries in dashboard: {opts.dashboard}')
+
+    if opts.dry_run:
+        for name, body in panels:
+            print(f'# {name}')
+            print(json.dumps(body, indent=2))
+        return
+
+    burl = f'http://{conf["gr"]["host"]}:{conf["gr"]["xport"]}'
+    test = LoadTest(burl, get_session(burl, get_auth(conf)), panels, opts.parallel, opts.timeout)
+    info(f'running {opts.users} virtual users for {opts.duration} seconds')
+    result = test.run(opts.users, opts.duration, opts.think)
+    result['uid'] = opts.dashboard
+    result['title'] = dash.get('title', '')
+    report(result)
+    if result['errors']:
+        warn(f'{result["errors"]} requests failed, the first one: {test.first_error()}')
+    if opts.out:
+        info(f'writing {opts.out}')
+        with open(opts.out, 'w', encoding='utf-8') as ofp:
+            json.dump(result, ofp, indent=2)
+    info('done')
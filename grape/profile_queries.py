@@ -0,0 +1,423 @@
+'''
+The profile-queries operation profiles the SQL queries of the
+postgres panels of the dashboards of a local grape project.
+
+The queries are read from the dashboards in the local grafana server
+or from a saved archive (-f). The grafana macros, for example
+$__timeFilter and $__timeGroup, and the template variables are
+expanded for the time range and then each query is run with
+EXPLAIN (ANALYZE, BUFFERS) in the database of its datasource. The
+queries of datasources whose database is not in the project database
+server, for example imported datasources, are skipped.
+
+The panels are ranked by the execution time, the number of rows
+scanned or the number of sequential scans so that the slow panels of
+a dashboard and the reason why they are slow can be found quickly.
+
+The queries are run in transactions that are rolled back.
+'''
+import argparse
+import datetime
+import os
+import sys
+from typing import Any, Dict, List, Tuple
+
+from grape.common.args import DEFAULT_NAME, CLI, add_common_args, args_get_text
+from grape.common.log import initv, info, warn, err
+from grape.common.conf import get_conf
+from grape.common.filters import get_filters, filter_services
+from grape.common.pg import explain, query
+from grape.common.queries import expand, get_dbname, get_interval, get_targets, get_variables
+from grape.common.queries import parse_time
+from grape.common.zip import load as zp_load
+from grape.save import save_gr_all
+from grape import __version__
+
+
+# The default time range, it is the grafana default.
+DEFAULT_FROM = 'now-6h'
+DEFAULT_TO = 'now'
+
+# The ranking keys.
+SORT_KEYS = {
+    'time': lambda rec: rec['time'],
+    'rows': lambda rec: rec['rows'],
+    'seqscans': lambda rec: (len(rec['seqscans']), rec['time']),
+}
+
+
+def getopts() -> argparse.Namespace:
+    '''Process the command line options.
+
+    Returns:
+       opts: The argument namespace.
+    '''
+    argparse._ = args_get_text  # type: ignore
+    base = os.path.basename(sys.argv[0])
+    usage = '\n {0} [OPTIONS]'.format(base)
+    desc = 'DESCRIPTION:{0}'.format('\n  '.join(__doc__.split('\n')))
+    epilog = '''
+EXAMPLES:
+    # ------------------------------------------------
+    # Example 1: Help.
+    # ------------------------------------------------
+        $ {2} {0} -h
+
+    # ------------------------------------------------
+    # Example 2: Profile the panel queries of all of
+    #            the dashboards for the dashboard
+    #            time ranges.
+    # ------------------------------------------------
+        $ {2} {0} -v -n {3} -g 4600
+
+    # ------------------------------------------------
+    # Example 3: Profile the panel queries of one
+    #            dashboard over the last 7 days and
+    #            show the 10 panels that scan the
+    #            most rows.
+    # ------------------------------------------------
+        $ {2} {0} -v -n {3} -g 4600 --uid ops --from now-7d --to now \\
+              --sort rows --top 10
+
+    # ------------------------------------------------
+    # Example 4: Profile the panel queries from an
+    #            archive with a template variable set.
+    # ------------------------------------------------
+        $ {2} {0} -v -n {3} -f {3}.zip --var host=web01,web02
+
+    # ------------------------------------------------
+    # Example 5: Print the expanded queries without
+    #            running them.
+    # ------------------------------------------------
+        $ {2} {0} -n {3} -g 4600 --dry-run
+
+VERSION:
+   {1}
+'''.format(base, __version__, CLI, DEFAULT_NAME).strip()
+    afc = argparse.RawTextHelpFormatter
+    parser = argparse.ArgumentParser(formatter_class=afc,
+                                     description=desc[:-2],
+                                     usage=usage,
+                                     epilog=epilog.rstrip() + '\n ')
+    add_common_args(parser, '--filter', '-f', '-g', '-n', '-p')
+    add_query_args(parser)
+    parser.add_argument('-D', '--dry-run',
+                        action='store_true',
+                        help='''\
+Print the expanded queries instead of
+running them.
+ ''')
+
+    parser.add_argument('--sort',
+                        action='store',
+                        choices=list(SORT_KEYS),
+                        default='time',
+                        help='''\
+The ranking:
+   time     - the execution time.
+   rows     - the rows scanned.
+   seqscans - the number of sequential
+              scans.
+
+The default is %(default)s.
+ ''')
+
+    parser.add_argument('--timeout',
+                        action='store',
+                        type=float,
+                        default=60,
+                        metavar=('SECONDS'),
+                        help='''\
+The statement timeout for each query.
+Queries that time out are reported as
+errors.
+
+The default is %(default)s.
+ ''')
+
+    parser.add_argument('--top',
+                        action='store',
+                        type=int,
+                        default=0,
+                        metavar=('N'),
+                        help='''\
+Only report the top N panel queries.
+
+The default is to report all of them.
+ ''')
+
+    opts = parser.parse_args()
+    return opts
+
+
+def add_query_args(parser: argparse.ArgumentParser):
+    '''Add the options that define how the panel queries are expanded.
+
+    They are shared by the commands that analyze the panel queries.
+
+    Args:
+        parser: The parser object.
+    '''
+    parser.add_argument('--from',
+                        action='store',
+                        dest='time_from',
+                        metavar=('TIME'),
+                        help='''\
+The start of the time range. It is a
+grafana time like now-6h or now/d or an
+absolute time.
+
+The default is the start of the dashboard
+time range or {0} if it does not have one.
+ '''.format(DEFAULT_FROM))
+
+    parser.add_argument('--to',
+                        action='store',
+                        dest='time_to',
+                        metavar=('TIME'),
+                        help='''\
+The end of the time range.
+
+The default is the end of the dashboard
+time range or {0} if it does not have one.
+ '''.format(DEFAULT_TO))
+
+    parser.add_argument('--var',
+                        action='append',
+                        default=[],
+                        metavar=('NAME=VALUE'),
+                        help='''\
+Set the value of a template variable.
+Multiple values are comma separated.
+It can be specified multiple times.
+
+The default is the current value of the
+variable in the dashboard.
+ ''')
+
+
+def read_services(conf: dict, filters: Dict[str, Any]) -> dict:
+    '''Read the datasources and the dashboards.
+
+    They are read from the archive if one is specified, otherwise
+    they are read from the local grafana server.
+
+    Args:
+        conf: The configuration data.
+        filters: The dashboard filters.
+
+    Returns:
+        state: The grafana datasources, folders and dashboards.
+    '''
+    if not conf['file']:
+        return save_gr_all(conf, filters)
+    zgr = zp_load(conf)['gr']
+    if not zgr:
+        err(f'archive does not contain the grafana state, it is a snapshot: {conf["file"]}')
+    return filter_services(filters, zgr)
+
+
+def get_overrides(opts: argparse.Namespace) -> Dict[str, str]:
+    '''Get the template variable values from the command line.
+
+    Args:
+        opts: The command line options.
+
+    Returns:
+        overrides: The values by variable name.
+    '''
+    overrides = {}
+    for item in opts.var:
+        name, sep, value = item.partition('=')
+        if not sep:
+            err(f'invalid variable, expected NAME=VALUE: "{item}"')
+        overrides[name.lstrip('$')] = value
+    return overrides
+
+
+def get_time_range(opts: argparse.Namespace,
+                   dash: dict) -> Tuple[datetime.datetime, datetime.datetime]:
+    '''Get the time range of a dashboard.
+
+    Args:
+        opts: The command line options.
+        dash: The dashboard.
+
+    Returns:
+        lower: The start of the time range.
+        upper: The end of the time range.
+    '''
+    drange = dash.get('time', {})
+    lower = parse_time(opts.time_from or drange.get('from', DEFAULT_FROM))
+    upper = parse_time(opts.time_to or drange.get('to', DEFAULT_TO), end=True)
+    if lower >= upper:
+        err(f'the start time {lower} is not before the end time {upper}')
+    return lower, upper
+
+
+def get_queries(opts: argparse.Namespace, zgr: dict) -> List[dict]:
+    '''Get the expanded SQL queries of the postgres panel targets.
+
+    Args:
+        opts: The command line options, they define the time range
+            and the template variable overrides.
+        zgr: The grafana datasources and dashboards.
+
+    Returns:
+        queries: The target records from get_targets with the
+            expanded SQL, the time range and the database of the
+            datasource.
+    '''
+    overrides = get_overrides(opts)
+    queries = get_targets(zgr['datasources'], zgr['dashboards'])
+    for rec in queries:
+        dash = rec['dashboard']
+        lower, upper = get_time_range(opts, dash)
+        interval = get_interval(lower, upper, rec['panel'].get('interval', ''))
+        variables = get_variables(dash, overrides)
+        rec['name'] = f'{dash.get("title", "")} / {rec["panel"].get("title", "")} ({rec["refId"]})'
+        rec['range'] = (lower, upper)
+        rec['expanded'] = expand(rec['sql'], variables, lower, upper, interval)
+        rec['dbname'] = get_dbname(rec['datasource'])
+    return queries
+
+
+def get_project_queries(conf: dict, queries: List[dict]) -> List[dict]:
+    '''Get the queries whose databases are in the project database server.
+
+    The other datasources, for example imported datasources, refer to
+    databases in other servers so their queries cannot be explained,
+    they are skipped with a warning.
+
+    Args:
+        conf: The configuration data.
+        queries: The query records from get_queries, the database of
+            the datasources that do not name one is set to the project
+            database.
+
+    Returns:
+        queries: The query records of the project databases.
+    '''
+    dbnames = {row[0] for row in query(conf, 'SELECT datname FROM pg_database WHERE datallowconn')}
+    result = []
+    skipped: Dict[Tuple[str, str], int] = {}
+    for rec in queries:
+        rec['dbname'] = rec['dbname'] or conf['pg']['dbname']
+        if rec['dbname'] in dbnames:
+            result.append(rec)
+        else:
+            key = (rec['datasource']['name'], rec['dbname'])
+            skipped[key] = skipped.get(key, 0) + 1
+    for (name, dbname), num in skipped.items():
+        warn(f'skipping {num} queries of datasource "{name}", '
+             f'database "{dbname}" is not in the project database server')
+    return result
+
+
+def walk_plan(node: dict, stats: dict):
+    '''Collect the scan statistics of a plan node and its children.
+
+    Args:
+        node: The plan node.
+        stats: The statistics, rows and seqscans, they are updated.
+    '''
+    if 'Relation Name' in node:
+        loops = node.get('Actual Loops', 1)
+        rows = node.get('Actual Rows', 0) + node.get('Rows Removed by Filter', 0)
+        stats['rows'] += rows * loops
+        if node['Node Type'] == 'Seq Scan':
+            stats['seqscans'].append(node['Relation Name'])
+    for child in node.get('Plans', []):
+        walk_plan(child, stats)
+
+
+def profile(conf: dict, rec: dict, timeout: float) -> dict:
+    '''Profile a query.
+
+    Args:
+        conf: The configuration data.
+        rec: The query record.
+        timeout: The statement timeout in seconds.
+
+    Returns:
+        rec: The query record with the time (ms), the rows scanned,
+            the sequentially scanned tables, the shared buffers and
+            the error if the query failed.
+    '''
+    plan, error = explain(conf, rec['expanded'], timeout=timeout, dbname=rec['dbname'])
+    stats: Dict[str, Any] = {'time': 0.0, 'rows': 0, 'seqscans': [], 'buffers': 0, 'error': error}
+    if plan:
+        top = plan[0]
+        stats['time'] = top.get('Planning Time', 0) + top.get('Execution Time', 0)
+        stats['buffers'] = (top['Plan'].get('Shared Hit Blocks', 0) +
+                            top['Plan'].get('Shared Read Blocks', 0))
+        walk_plan(top['Plan'], stats)
+    rec.update(stats)
+    return rec
+
+
+def report(recs: List[dict], sort: str, top: int) -> Tuple[int, int]:
+    '''Print the ranked panel queries.
+
+    Args:
+        recs: The profiled query records.
+        sort: The ranking key.
+        top: The number of queries to report or 0 for all.
+
+    Returns:
+        reported: The number of reported queries.
+        failed: The number of queries that failed.
+    '''
+    ranked = sorted([rec for rec in recs if not rec['error']], key=SORT_KEYS[sort], reverse=True)
+    if top:
+        ranked = ranked[:top]
+    print(f'{"rank":>4}  {"time (ms)":>10}  {"rows scanned":>12}  {"buffers":>9}  '
+          f'{"seqscans":>8}  panel')
+    for i, rec in enumerate(ranked, start=1):
+        print(f'{i:>4}  {rec["time"]:>10.1f}  {rec["rows"]:>12}  {rec["buffers"]:>9}  '
+              f'{len(rec["seqscans"]):>8}  {rec["name"]}')
+        if rec['seqscans']:
+            print(f'{"":>4}  {"":>10}  {"":>12}  {"":>9}  {"":>8}  '
+                  f'seq scan: {", ".join(sorted(set(rec["seqscans"])))}')
+    failed = [rec for rec in recs if rec['error']]
+    for rec in failed:
+        first = rec['error'].splitlines()[0]
+        print(f'{"":>4}  {"failed":>10}  {"":>12}  {"":>9}  {"":>8}  {rec["name"]}: {first}')
+    return len(ranked), len(failed)
+
+
+def main():
+    '''Profile queries command main.
+
+    This is the command line entry point for the profile-queries
+    command.
+    '''
+    opts = getopts()
+    initv(opts.verbose)
+    info(f'profiling the panel queries of {opts.base}')
+    conf = get_conf(opts.base, opts.fname, opts.grxport, opts.pgxport)
+    zgr = read_services(conf, get_filters(opts))
+    queries = get_queries(opts, zgr)
+    info(f'found {len(queries)} postgres panel queries')
+    if not queries:
+        warn('no postgres panel queries found')
+        return
+
+    if opts.dry_run:
+        for rec in queries:
+            lower, upper = rec['range']
+            print(f'-- {rec["name"]}: {lower.isoformat()} to {upper.isoformat()}')
+            print(rec['expanded'].strip().rstrip(';') + ';\n')
+        return
+
+    queries = get_project_queries(conf, queries)
+    if not queries:
+        warn('no panel queries of the project databases found')
+        return
+    for i, rec in enumerate(queries, start=1):
+        info(f'explaining {i} of {len(queries)}: {rec["name"]}')
+        profile(conf, rec, opts.timeout)
+    _, failed = report(queries, opts.sort, opts.top)
+    if failed:
+        warn(f'{failed} of {len(queries)} queries failed')
+    info('done')
@@ -10,6 +10,7 @@ import json
 import os
 import sys
 from functools import reduce
+from typing import Any, Dict, List, Optional
 from zipfile import ZipFile
 
 import requests
@@ -17,7 +18,11 @@ import requests
 from grape.common.args import DEFAULT_NAME, CLI, add_common_args, args_get_text
 from grape.common.log import initv, info, err
 from grape.common.conf import get_conf
+from grape.common.filters import get_filters, is_filtered
+from grape.common.gr import get_auth, read_selected_dashboards, send
+from grape.common.journal import Journal
 from grape.common.pg import save as save_pg
+from grape.common.snapshot import save_grdb, save_pgdata
 from grape import __version__
 
 
@@ -68,6 +73,27 @@ EXAMPLES:
         $ zip example.zip conf.json gr.json pg.sql
         $ unzip -l example.zip
 
+    # ------------------------------------------------
+    # Example 4: Save the grafana state using a direct
+    #            snapshot of the grafana database.
+    #            This is much faster for projects with
+    #            many dashboards.
+    # ------------------------------------------------
+        $ {2} {0} -v -n {3} -g 4700 -f example.zip --snapshot gr
+
+    # ------------------------------------------------
+    # Example 5: Save the grafana and database state
+    #            using direct snapshots of both. This
+    #            is much faster for large databases.
+    # ------------------------------------------------
+        $ {2} {0} -v -n {3} -g 4700 -f example.zip --snapshot gr --snapshot pg
+
+    # ------------------------------------------------
+    # Example 6: Save the dashboards in one folder
+    #            that have a specific tag.
+    # ------------------------------------------------
+        $ {2} {0} -v -n {3} -g 4700 -f team.zip --folder Team --tag prod
+
 VERSION:
    {1}
 '''.format(base, __version__, CLI, DEFAULT_NAME).strip()
@@ -76,12 +102,39 @@ VERSION:
                                      description=desc[:-2],
                                      usage=usage,
                                      epilog=epilog.rstrip() + '\n ')
-    add_common_args(parser, '-f', '-g', '-n', '-p', '-w')
+    add_common_args(parser, '--filter', '-f', '-g', '-n', '-p', '-w')
+    parser.add_argument('--snapshot',
+                        action='append',
+                        choices=['gr', 'pg'],
+                        default=[],
+                        help='''\
+Save a snapshot of the service storage
+instead of reading the service.
+
+   gr - save a consistent copy of the
+        grafana database (gr.db) instead
+        of reading the datasources, folders
+        and dashboards through the REST API
+        (gr.json).
+
+   pg - save a tar of the postgres data
+        directory (pg.tar) instead of the
+        SQL from pg_dumpall (pg.sql). The
+        database container is stopped while
+        the data directory is captured. If
+        the filesystem supports reflinks
+        it is only stopped for the time it
+        takes to clone the directory.
+
+The load operation detects snapshots
+automatically. The dashboard filters are
+ignored for snapshots.
+ ''')
     opts = parser.parse_args()
     return opts
 
 
-def save_gr_read(conf: dict, service: str) -> dict:
+def save_gr_read(conf: dict, service: str) -> Any:
     '''
     Read a single grafana service.
 
@@ -93,14 +146,12 @@ def save_gr_read(conf: dict, service: str) -> dict:
         response: The JSON from the URL request.
     '''
     port = conf['gr']['xport']
-    auth = (conf['gr']['username'], conf['gr']['password'])
     host = conf['gr']['host']
-    headers = {'Content-Type': 'application/json',
-               'Accept': 'application/json'}
-    url = f'http://{host}:{port}/{service}'
+    burl = f'http://{host}:{port}'
+    url = f'{burl}/{service}'
     info(f'reading {url}')
     try:
-        response = requests.get(url, auth=auth, headers=headers)
+        response = send(burl, get_auth(conf), 'get', url)
     except requests.ConnectionError as exc:
         err(str(exc))
     if response.status_code != 200:
@@ -110,12 +161,14 @@ def save_gr_read(conf: dict, service: str) -> dict:
     return result
 
 
-def save_gr_all(conf: dict) -> dict:
+def save_gr_all(conf: dict, filters: Optional[Dict[str, Any]] = None) -> dict:
     '''
     Read the grafana state from a local server and save it.
 
     Args:
         conf: The configuration data.
+        filters: The optional dashboard filters. If specified, only
+            the selected dashboards and their folders are read.
 
     Returns:
         state: The grafana datasources, folders and dashboards.
@@ -128,6 +181,21 @@ def save_gr_all(conf: dict) -> dict:
     # Read the folders.
     folders = save_gr_read(conf, 'api/folders?limit=100')
     info(f'read {len(folders)} folders')
+    if filters and is_filtered(filters):
+        # Only read the selected dashboards and their folders.
+        dashboards = read_selected_dashboards(lambda s: save_gr_read(conf, s),
+                                              filters, folders, Journal(''))
+        selected = {rec['folderId'] for rec in dashboards}
+        result = {
+            'datasources': datasources,
+            'folders': [rec for rec in folders if rec['id'] in selected],
+            'dashboards': dashboards,
+        }
+        info(f'{len(result["datasources"])} datasources')
+        info(f'{len(result["folders"])} folders')
+        info(f'{len(result["dashboards"])} dashboards')
+        return result
+
     fids = reduce(lambda x, y: x+[y] if not y in x else x,
                   [fid['id'] for fid in folders],
                   [])
@@ -161,21 +229,29 @@ def save_gr_all(conf: dict) -> dict:
     return result
 
 
-def save(conf: dict):
+def save(conf: dict,
+         filters: Optional[Dict[str, Any]] = None,
+         snapshot: Optional[List[str]] = None,
+         wait: float = 60):
     '''Save the grape project state.
 
     Save the database and grafana server state into a zip archive.
 
     Args:
         conf: The configuration.
+        filters: The optional dashboard filters.
+        snapshot: The services to save as storage snapshots.
+        wait: The container create wait time for restarting
+            the database after a pg snapshot.
     '''
     ofn = conf['file']
     if os.path.exists(ofn):
         err(f'archive file already exists: {ofn}')
+    snapshot = snapshot or []
 
     # Load the data from the servers.
-    grr = save_gr_all(conf)
-    sql = save_pg(conf)
+    grr = save_gr_all(conf, filters) if 'gr' not in snapshot else {}
+    sql = save_pg(conf) if 'pg' not in snapshot else ''
 
     # Now create the zip bundle.
     info(f'writing to {ofn}')
@@ -183,8 +259,14 @@ def save(conf: dict):
         # Do zip
         with ZipFile(ofn, 'w') as zfp:
             zfp.writestr('conf.json', json.dumps(conf))
-            zfp.writestr('gr.json', json.dumps(grr))
-            zfp.writestr('pg.sql', sql)
+            if 'gr' in snapshot:
+                save_grdb(conf, zfp)
+            else:
+                zfp.writestr('gr.json', json.dumps(grr))
+            if 'pg' in snapshot:
+                save_pgdata(conf, zfp, wait)
+            else:
+                zfp.writestr('pg.sql', sql)
         # One can unzip the individual files like this:
         #   $ unzip -p /mnt/example.zip conf.json > /mnt/conf.json
         #   $ unzip -p /mnt/example.zip gr.json > /mnt/gr.json
@@ -202,5 +284,5 @@ def main():
     initv(opts.verbose)
     info(f'save {opts.base}')
     conf = get_conf(opts.base, opts.fname, opts.grxport, opts.pgxport)
-    save(conf)
+    save(conf, get_filters(opts), opts.snapshot, opts.wait)
     info('done')
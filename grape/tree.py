@@ -19,7 +19,7 @@ from docker.models.containers import Container  # type: ignore
 
 from grape.common.args import CLI, add_common_args, args_get_text
 from grape.common.log import initv, info, err
-from grape.common.gr import read_all_services
+from grape.common.gr import Auth, read_all_services
 from grape.common.conf import DEFAULT_AUTH
 from grape import __version__
 
@@ -335,7 +335,7 @@ def collect_folders(root: TreeReportNode, services: dict):
             TreeReportNode(key, dashboards)
 
 
-def collect(burl: str, auth: Tuple[str, str], name: str) -> TreeReportNode:
+def collect(burl: str, auth: Auth, name: str) -> TreeReportNode:
     '''List the grafana structure.
 
     Args:
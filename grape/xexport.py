@@ -11,11 +11,13 @@ automatically because grafana does not export passwords.
 import argparse
 import os
 import sys
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
 from grape.common.args import DEFAULT_NAME, CLI, add_common_args, args_get_text
-from grape.common.log import initv, info
+from grape.common.log import initv, info, err
+from grape.common.filters import get_filters, filter_services
 from grape.common.gr import load_all as gr_load_all
+from grape.common.journal import Journal
 from grape.common.conf import get_conf
 from grape.common.xconf import get_xconf
 from grape.common.zip import load as zp_load
@@ -47,6 +49,18 @@ EXAMPLES:
         $ {2} {0} -v -b {3} -g 4900 -f export.zip
         $ {2} {0} -v -b {3} -g 4900 -f export.zip -x export.yaml
 
+    # ------------------------------------------------
+    # Example 3. Resume an interrupted export.
+    #            Only the objects that were not
+    #            already uploaded are sent.
+    # ------------------------------------------------
+        $ {2} {0} -v -b {3} -g 4900 -f export.zip -x export.yaml -r
+
+    # ------------------------------------------------
+    # Example 4. Only export two dashboards.
+    # ------------------------------------------------
+        $ {2} {0} -v -b {3} -g 4900 -f export.zip -x export.yaml --uid abc --uid xyz
+
 VERSION:
    {1}
 '''.format(base, __version__, CLI, DEFAULT_NAME).strip()
@@ -55,12 +69,39 @@ VERSION:
                                      description=desc[:-2],
                                      usage=usage,
                                      epilog=epilog.rstrip() + '\n ')
-    add_common_args(parser, '-f', '-g', '-n', '-p', '-w', '-x')
+    add_common_args(parser, '--filter', '-f', '-g', '-n', '-p', '-r', '-w', '-x')
     opts = parser.parse_args()
     return opts
 
 
-def xexport(conf: dict, xconf: str):
+def get_password_map(iconf: dict) -> Dict[str, Any]:
+    '''
+    Get the database passwords of the import yaml file.
+
+    Args:
+        iconf: The external grafana configuration data.
+
+    Returns:
+        pmap: The passwords by database key and value.
+    '''
+    pmap : Dict[str, Any] = {}
+    if 'databases' in iconf:
+        for database in iconf['databases']:
+            for key in database:
+                # Allow the user to specify an arbitrary key like
+                # 'name' or 'database'.
+                if key == 'password':
+                    continue
+                name = database[key]
+                password = database['password']
+                if key not in pmap:
+                    pmap[key] = {}
+                pmap[key][name] = password
+    return pmap
+
+
+def xexport(conf: dict, xconf: str, resume: bool = False,
+            filters: Optional[Dict[str, Any]] = None):
     '''
     Export to an external grafana server system.
 
@@ -70,9 +111,14 @@ def xexport(conf: dict, xconf: str):
     This operation requires an import conf file
     as well as a load zip file.
 
+    Each object that is uploaded is recorded in a checkpoint
+    journal so that an interrupted export can be resumed.
+
     Args:
         conf: The configuration data.
         xconf: The external grafana configuration data.
+        resume: Resume from the checkpoint journal.
+        filters: The optional dashboard filters.
     '''
     info('export')
 
@@ -80,23 +126,13 @@ def xexport(conf: dict, xconf: str):
     # Create a password map so that the passwords
     # for the databases can be restored.
     iconf = get_xconf(xconf)
-    pmap : Dict[str, Any] = {}
-    if 'databases' in iconf:
-        for database in iconf['databases']:
-            for key in database:
-                # Allow the user to specify an arbitrary key like
-                # 'name' or 'database'.
-                if key == 'password':
-                    continue
-                name = database[key]
-                password = database['password']
-                if key not in pmap:
-                    pmap[key] = {}
-                pmap[key][name] = password
+    pmap = get_password_map(iconf)
 
     # Collect the data in the save zip file.
     result = zp_load(conf)
-    zgr = result['gr']
+    if not result['gr']:
+        err(f'archive does not contain gr.json, it cannot be exported: {conf["file"]}')
+    zgr = filter_services(filters, result['gr']) if filters else result['gr']
 
     # Fix the passwords in zgr.
     # Everything else s/b fine.
@@ -118,6 +154,7 @@ def xexport(conf: dict, xconf: str):
     # Fix the conf to write to the external source.
     conf['gr']['username'] = iconf['username']
     conf['gr']['password'] = iconf['password']
+    conf['gr']['token'] = iconf['token']
     conf['gr']['url'] = iconf['url']
 
     # Remove the local datasource.
@@ -127,7 +164,9 @@ def xexport(conf: dict, xconf: str):
         del zgr['datasources'][name]
 
     # Write the grafana configuration out.
-    gr_load_all(conf, zgr)
+    journal = Journal(conf['file'] + '.journal', 'export', iconf['url'], resume)
+    gr_load_all(conf, zgr, journal)
+    journal.close()
 
 
 def main():
@@ -139,5 +178,5 @@ def main():
     initv(opts.verbose)
     info(f'export using {opts.xconf}')
     conf = get_conf(opts.base, opts.fname, opts.grxport, opts.pgxport)
-    xexport(conf, opts.xconf)
+    xexport(conf, opts.xconf, opts.resume, get_filters(opts))
     info('done')
@@ -18,11 +18,14 @@ import argparse
 import json
 import os
 import sys
+from typing import Any, Dict, Optional
 from zipfile import ZipFile
 
 from grape.common.args import DEFAULT_NAME, CLI, add_common_args, args_get_text
 from grape.common.log import initv, info, err
+from grape.common.filters import get_filters
 from grape.common.gr import read_all_services
+from grape.common.journal import Journal
 from grape.common.pg import save as save_pg
 from grape.common.conf import get_conf
 from grape.common.xconf import get_xconf
@@ -58,7 +61,21 @@ EXAMPLES:
         $ {2} load   -v -n example -g 4800 -f import.zip
 
     # ------------------------------------------------
-    # Example 3: Modify the contents of an existing zip
+    # Example 3: Resume an interrupted import.
+    #            Only the objects that were not
+    #            already read are requested.
+    # ------------------------------------------------
+        $ {2} import -v -n example -g 4800 -f import.zip -x import.yaml
+        ^C
+        $ {2} import -v -n example -g 4800 -f import.zip -x import.yaml -r
+
+    # ------------------------------------------------
+    # Example 4: Only import the dashboards of one team.
+    # ------------------------------------------------
+        $ {2} import -v -n example -g 4800 -f team.zip -x import.yaml --folder Team
+
+    # ------------------------------------------------
+    # Example 5: Modify the contents of an existing zip
     #            file then load it.
     # ------------------------------------------------
         $ ## See whats in the zip file.
@@ -82,12 +99,13 @@ VERSION:
                                      description=desc[:-2],
                                      usage=usage,
                                      epilog=epilog.rstrip() + '\n ')
-    add_common_args(parser, '-f', '-g', '-n', '-p', '-w', '-x')
+    add_common_args(parser, '--filter', '-f', '-g', '-n', '-p', '-r', '-w', '-x')
     opts = parser.parse_args()
     return opts
 
 
-def ximport(conf: dict, xconf: str):
+def ximport(conf: dict, xconf: str, resume: bool = False,
+            filters: Optional[Dict[str, Any]] = None):
     '''
     Import an external grafana server system.
 
@@ -95,9 +113,15 @@ def ximport(conf: dict, xconf: str):
 
     This operation requires an import conf file.
 
+    Each object that is read is recorded in a checkpoint journal
+    so that an interrupted import can be resumed.
+
     Args:
         conf: The configuration data.
         xconf: The external grafana configuration data.
+        resume: Resume from the checkpoint journal.
+        filters: The optional dashboard filters. If specified, only
+            the selected dashboards are requested.
     '''
     info('import')
     ofn = conf['file']
@@ -106,8 +130,9 @@ def ximport(conf: dict, xconf: str):
 
     iconf =  get_xconf(xconf)
     conf['import'] = iconf
-    auth = (iconf['username'], iconf['password'])
-    grr = read_all_services(iconf['url'], auth)
+    auth = iconf['token'] or (iconf['username'], iconf['password'])
+    journal = Journal(ofn + '.journal', 'import', iconf['url'], resume)
+    grr = read_all_services(iconf['url'], auth, journal, filters)
     sql = save_pg(conf)
     info(f'writing to {ofn}')
     if 'zip' in ofn.lower():
@@ -122,6 +147,7 @@ def ximport(conf: dict, xconf: str):
         #   $ unzip -p /mnt/example.zip pg.sql > /mnt/pg.sql
     else:
         err('only zip files are supported')
+    journal.close()
 
 
 def main():
@@ -133,5 +159,5 @@ def main():
     initv(opts.verbose)
     info(f'import from {opts.xconf}')
     conf = get_conf(opts.base, opts.fname, opts.grxport, opts.pgxport)
-    ximport(conf, opts.xconf)
+    ximport(conf, opts.xconf, opts.resume, get_filters(opts))
     info('done')
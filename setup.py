@@ -40,6 +40,10 @@ setup(
                       'psycopg2-binary',
                       'PyYAML',
                       'requests'],
+    extras_require={
+        # Read zstd compressed CSV files in csv2sql and ingest.
+        'zstd': ['zstandard'],
+    },
     packages=find_packages(),
     package_data={PROJECT: ['__version__']},
     license='MIT',
@@ -0,0 +1,93 @@
+'''
+Test the sizing of /dev/shm and the round trip of the postgres server
+settings through settings.json and the conf.json of an archive.
+'''
+import json
+import os
+from zipfile import ZipFile
+
+from grape.common.conf import MIN_SHM_SIZE, get_conf, get_pg_settings_path, get_shm_size
+from grape.common.conf import save_pg_settings, set_ephemeral, set_pg_settings
+from grape.common.log import initv
+from grape.common.zip import load as zp_load
+from grape.create import PG_PROFILES
+from grape.load import set_archive_settings
+
+
+initv(0)
+
+MB = 1024 ** 2
+
+
+def get_command(conf: dict) -> dict:
+    '''Get the postgres container settings.
+
+    Args:
+        conf: The configuration data.
+
+    Returns:
+        settings: The -c settings of the container command by name.
+    '''
+    command = conf['pg']['client.containers.run'].get('command', ['postgres'])
+    return dict(arg.split('=', 1) for arg in command[2::2])
+
+
+def test_conf_get_shm_size():
+    'the size is the shared buffers with the docker default as the minimum'
+    assert get_shm_size({}) == 0
+    assert get_shm_size({'shared_buffers': 'lots'}) == 0
+    assert get_shm_size({'shared_buffers': '1000kB'}) == MIN_SHM_SIZE
+    assert get_shm_size({'shared_buffers': '16384'}) == 128 * MB  # 8kB pages
+    assert get_shm_size({'shared_buffers': ' 2 GB '}) == 2048 * MB
+    assert get_shm_size(PG_PROFILES['small']) == 256 * MB
+    assert get_shm_size(PG_PROFILES['large']) == 8192 * MB
+
+
+def test_conf_settings_json(tmp_path, monkeypatch):
+    'the settings recorded in the project directory are reused'
+    monkeypatch.chdir(tmp_path)
+    conf = get_conf('example', '', 4600, 0)
+    assert 'command' not in conf['pg']['client.containers.run']
+    assert 'shm_size' not in conf['pg']['client.containers.run']
+    set_pg_settings(conf, PG_PROFILES['small'])
+    set_ephemeral(conf, ['pg'])
+    save_pg_settings(conf)
+    path = get_pg_settings_path(conf)
+    with open(path, 'r', encoding='utf-8') as ifp:
+        assert json.load(ifp) == PG_PROFILES['small']  # the ephemeral settings are not recorded
+
+    conf = get_conf('example', '', 4600, 0)
+    assert conf['pg']['settings'] == PG_PROFILES['small']
+    assert get_command(conf) == PG_PROFILES['small']
+    assert conf['pg']['client.containers.run']['shm_size'] == 256 * MB
+
+    conf['pg']['settings'] = {}
+    save_pg_settings(conf)
+    assert not os.path.exists(path)
+
+
+def test_conf_archive_settings(tmp_path, monkeypatch):
+    'the settings in the conf.json of an archive replace the recorded settings'
+    monkeypatch.chdir(tmp_path)
+    src = get_conf('src', 'src.zip', 4600, 0)
+    set_pg_settings(src, PG_PROFILES['large'])
+    with ZipFile(src['file'], 'w') as zfp:
+        zfp.writestr('conf.json', json.dumps(src))  # what the save operation does
+
+    dst = get_conf('dst', 'src.zip', 4700, 0)
+    set_pg_settings(dst, {'work_mem': '1GB', 'fsync': 'off'})
+    save_pg_settings(dst)
+    set_archive_settings(dst, zp_load(dst)['conf'])
+    assert dst['pg']['settings'] == PG_PROFILES['large']
+    assert get_command(dst) == PG_PROFILES['large']
+    assert dst['pg']['client.containers.run']['shm_size'] == 8192 * MB
+
+    # The create operation records them for the next commands.
+    save_pg_settings(dst)
+    assert get_conf('dst', '', 4700, 0)['pg']['settings'] == PG_PROFILES['large']
+
+    # An archive without settings resets them.
+    set_archive_settings(dst, {'pg': {}})
+    assert not dst['pg']['settings']
+    assert 'command' not in dst['pg']['client.containers.run']
+    assert 'shm_size' not in dst['pg']['client.containers.run']
@@ -0,0 +1,81 @@
+'''
+Test the postgres tuning profiles.
+'''
+import os
+
+import pytest
+
+from grape.common.conf import MIN_SHM_SIZE, get_shm_size
+from grape.common.log import initv
+from grape.create import PG_PROFILES, get_auto_profile, get_profile
+
+
+initv(0)
+
+MB = 1024 ** 2
+
+
+def set_host(monkeypatch, mem: int, cores):
+    '''Set the memory and the cores of the host.
+
+    Args:
+        monkeypatch: The pytest monkeypatch fixture.
+        mem: The memory in MB.
+        cores: The number of cores or None if it is unknown.
+    '''
+    pages = {'SC_PAGE_SIZE': 4096, 'SC_PHYS_PAGES': mem * MB // 4096}
+    monkeypatch.setattr(os, 'sysconf', lambda name: pages[name])
+    monkeypatch.setattr(os, 'cpu_count', lambda: cores)
+
+
+def test_create_auto_profile_large(monkeypatch):
+    'a large host gets the maximum shared buffers and parallel workers'
+    set_host(monkeypatch, 64 * 1024, 32)
+    settings = get_auto_profile()
+    assert settings == {
+        'shared_buffers': '16384MB',
+        'effective_cache_size': '49152MB',
+        'work_mem': '20MB',
+        'maintenance_work_mem': '2048MB',
+        'max_worker_processes': '32',
+        'max_parallel_workers': '32',
+        'max_parallel_workers_per_gather': '8',
+        'wal_buffers': '16MB',
+        'min_wal_size': '1GB',
+        'max_wal_size': '4GB',
+        'checkpoint_completion_target': '0.9',
+    }
+    assert get_shm_size(settings) == 16384 * MB
+
+
+def test_create_auto_profile_small(monkeypatch):
+    'a small host gets a quarter of the memory and no parallel workers'
+    set_host(monkeypatch, 2048, 1)
+    settings = get_auto_profile()
+    assert settings['shared_buffers'] == '512MB'
+    assert settings['effective_cache_size'] == '1536MB'
+    assert settings['work_mem'] == '5MB'
+    assert settings['maintenance_work_mem'] == '128MB'
+    assert settings['max_worker_processes'] == '8'
+    assert settings['max_parallel_workers'] == '1'
+    assert settings['max_parallel_workers_per_gather'] == '0'
+    assert (settings['min_wal_size'], settings['max_wal_size']) == ('80MB', '1GB')
+    assert get_shm_size(settings) == 512 * MB
+
+
+def test_create_auto_profile_tiny(monkeypatch):
+    'the work memory and the size of /dev/shm have minimums'
+    set_host(monkeypatch, 128, None)
+    settings = get_auto_profile()
+    assert settings['shared_buffers'] == '32MB'
+    assert settings['work_mem'] == '4MB'
+    assert settings['max_parallel_workers'] == '1'
+    assert get_shm_size(settings) == MIN_SHM_SIZE
+
+
+@pytest.mark.parametrize('name', ['small', 'large'])
+def test_create_get_profile(monkeypatch, name):
+    'the fixed profiles do not depend on the host'
+    set_host(monkeypatch, 1024, 2)
+    assert get_profile(name) == PG_PROFILES[name]
+    assert get_profile('auto')['shared_buffers'] == '256MB'
@@ -0,0 +1,191 @@
+'''
+Test the csv2sql conversion of CSV data to SQL statements.
+'''
+import argparse
+import datetime
+import io
+import os
+from typing import List
+
+from grape.common import csv2sql, csvio
+from grape.common.log import initv
+
+
+initv(0)
+
+
+def make_args(paths: List[str], *opts: str) -> argparse.Namespace:
+    '''Make the conversion arguments.
+
+    Args:
+        paths: The CSV file paths.
+        opts: The command line options.
+
+    Returns:
+        args: The checked command line arguments.
+    '''
+    parser = argparse.ArgumentParser()
+    csv2sql.add_csv_args(parser)
+    args = parser.parse_args(list(opts))
+    csv2sql.check_csv_args(args, paths)
+    return args
+
+
+def make_csv(path: str, rows: List[str]) -> str:
+    '''Write a CSV file.
+
+    Args:
+        path: The file path.
+        rows: The lines of the file, the first is the header.
+
+    Returns:
+        path: The file path.
+    '''
+    with open(path, 'w', encoding='utf-8') as ofp:
+        ofp.write('\n'.join(rows) + '\n')
+    return path
+
+
+def get_statements(text: str) -> List[str]:
+    '''Split the SQL output into statements.
+
+    Args:
+        text: The SQL output.
+
+    Returns:
+        stmts: The statements without the terminating semicolons.
+    '''
+    return [stmt.strip() for stmt in text.split(';\n') if stmt.strip()]
+
+
+def test_csv2sql_widen_first_row(tmp_path):
+    'a first row that does not fit the schema types is widened before the insert'
+    schema = os.path.join(tmp_path, 't2.json')
+    src = make_csv(os.path.join(tmp_path, 'src.csv'), ['a,b', '1,2', '3,4'])
+    args = make_args([src], '-t', 't2', '--schema-out', schema)
+    csv2sql.sql(args, [src], io.StringIO())
+
+    # Both columns are widened by the first row.
+    path = make_csv(os.path.join(tmp_path, 't2.csv'), ['a,b', 'x,y', '5,6'])
+    args = make_args([path], '-t', 't2', '--schema', schema)
+    ofp = io.StringIO()
+    csv2sql.sql(args, [path], ofp)
+    stmts = get_statements(ofp.getvalue())
+    kinds = [stmt.split()[0] for stmt in stmts]
+    assert kinds == ['DROP', 'CREATE', 'ALTER', 'ALTER', 'INSERT']
+    assert stmts[2].startswith('ALTER TABLE t2 ALTER COLUMN a TYPE TEXT')
+    assert stmts[3].startswith('ALTER TABLE t2 ALTER COLUMN b TYPE TEXT')
+    assert stmts[4].endswith("('x', 'y'),\n  ('5', '6')")
+
+
+def test_csv2sql_widen_later_row(tmp_path):
+    'a later row that does not fit ends the insert before the column is widened'
+    rows = ['a'] + [str(i) for i in range(10)] + ['x', '11']
+    path = make_csv(os.path.join(tmp_path, 't3.csv'), rows)
+    args = make_args([path], '-t', 't3', '--sample', '2')
+    ofp = io.StringIO()
+    csv2sql.sql(args, [path], ofp)
+    stmts = get_statements(ofp.getvalue())
+    kinds = [stmt.split()[0] for stmt in stmts]
+    assert kinds == ['DROP', 'CREATE', 'INSERT', 'ALTER', 'INSERT']
+    assert stmts[2].endswith('(9)')
+    assert stmts[4].endswith("('x'),\n  ('11')")
+
+
+def test_csv2sql_widen_upsert(tmp_path):
+    'a widened column is widened in the staging table and in the table'
+    rows = ['k,v'] + [f'{i},{i}' for i in range(10)] + ['10,x']
+    path = make_csv(os.path.join(tmp_path, 't4.csv'), rows)
+    args = make_args([path], '-t', 't4', '--sample', '2', '--upsert', 'k')
+    ofp = io.StringIO()
+    csv2sql.sql(args, [path], ofp)
+    stmts = get_statements(ofp.getvalue())
+    alters = [stmt for stmt in stmts if stmt.startswith('ALTER')]
+    assert alters == ['ALTER TABLE t4_stage ALTER COLUMN v TYPE TEXT USING v::TEXT',
+                      'ALTER TABLE t4 ALTER COLUMN v TYPE TEXT USING v::TEXT']
+    assert stmts.index(alters[1]) < next(i for i, stmt in enumerate(stmts)
+                                         if stmt.startswith('INSERT INTO t4 '))
+
+
+def test_csv2sql_copy_escape():
+    'backslash, tab, newline and carriage return are escaped for the COPY text format'
+    assert csvio.copy_escape('a\tb\nc\rd\\e') == 'a\\tb\\nc\\rd\\\\e'
+    assert csvio.copy_escape('\\N') == '\\\\N'  # a string, not NULL
+    assert csvio.copy_escape('plain') == 'plain'
+
+
+def test_csv2sql_copy_rows(tmp_path):
+    'the COPY data has one escaped line per row'
+    path = make_csv(os.path.join(tmp_path, 't5.csv'),
+                    ['k,v', '1,"a\tb"', '2,"x\ny"', '3,c:\\d', '4,\\N', "5,it's"])
+    args = make_args([path], '-t', 't5', '-F', 'copy')
+    ofp = io.StringIO()
+    csv2sql.sql(args, [path], ofp)
+    text = ofp.getvalue()
+    start = text.index('COPY t5 (k, v) FROM STDIN;\n')
+    lines = text[start:].strip().splitlines()
+    assert lines[1:] == ['1\ta\\tb', '2\tx\\ny', '3\tc:\\\\d', '4\t\\\\N', "5\tit's", '\\.']
+
+
+def test_csv2sql_batch(tmp_path):
+    'the rows are split into INSERT statements of at most N rows'
+    path = make_csv(os.path.join(tmp_path, 't6.csv'), ['k,v'] + [f"{i},it's {i}" for i in range(5)])
+    args = make_args([path], '-t', 't6', '-b', '2')
+    ofp = io.StringIO()
+    csv2sql.sql(args, [path], ofp)
+    inserts = [stmt for stmt in get_statements(ofp.getvalue()) if stmt.startswith('INSERT')]
+    assert [stmt.count('\n  (') for stmt in inserts] == [2, 2, 1]
+    assert inserts[2].endswith("(4, 'it''s 4')")
+
+
+def test_csv2sql_partition_buckets():
+    'the day, week and month intervals are aligned and roll over'
+    value = datetime.datetime(2024, 12, 31, 23, 59, 59)
+    assert csv2sql.get_bucket(value, 'day') == datetime.date(2024, 12, 31)
+    assert csv2sql.get_bucket(value, 'week') == datetime.date(2024, 12, 30)  # a Monday
+    assert csv2sql.get_bucket(value, 'month') == datetime.date(2024, 12, 1)
+    assert csv2sql.get_bucket_end(datetime.date(2024, 12, 31), 'day') == datetime.date(2025, 1, 1)
+    assert csv2sql.get_bucket_end(datetime.date(2024, 12, 30), 'week') == datetime.date(2025, 1, 6)
+    for month, end in [(1, datetime.date(2024, 2, 1)),
+                       (2, datetime.date(2024, 3, 1)),
+                       (12, datetime.date(2025, 1, 1))]:
+        assert csv2sql.get_bucket_end(datetime.date(2024, month, 1), 'month') == end
+
+
+def test_csv2sql_partition_ddl(tmp_path):
+    'a partition is created for each week with rows and the index is on the parent table'
+    rows = ['ts,v', '2024-12-30 10:00:00,1', '2025-01-05 23:59:59,2',
+            '2025-01-06 00:00:00,3', '2025-02-01,4']
+    path = make_csv(os.path.join(tmp_path, 't7.csv'), rows)
+    args = make_args([path], '-t', 't7', '--partition', 'ts', '--partition-interval', 'week',
+                     '--time-index', 'brin')
+    ofp = io.StringIO()
+    csv2sql.sql(args, [path], ofp)
+    stmts = get_statements(ofp.getvalue())
+    assert stmts[1].endswith('PRIMARY KEY (id, ts)) PARTITION BY RANGE (ts)')
+    assert stmts[2:6] == [
+        "CREATE TABLE t7_p20241230 PARTITION OF t7\n"
+        "  FOR VALUES FROM ('2024-12-30') TO ('2025-01-06')",
+        "CREATE TABLE t7_p20250106 PARTITION OF t7\n"
+        "  FOR VALUES FROM ('2025-01-06') TO ('2025-01-13')",
+        "CREATE TABLE t7_p20250127 PARTITION OF t7\n"
+        "  FOR VALUES FROM ('2025-01-27') TO ('2025-02-03')",
+        'CREATE TABLE t7_default PARTITION OF t7 DEFAULT',
+    ]
+    assert stmts[-1] == 'CREATE INDEX IF NOT EXISTS t7_ts_idx ON t7 USING brin (ts)'
+
+
+def test_csv2sql_partition_append(tmp_path):
+    'the monthly partitions and the B-tree index are only created if they do not exist'
+    path = make_csv(os.path.join(tmp_path, 't8.csv'), ['ts,v', '2024-12-31,1', '2025-01-01,2'])
+    args = make_args([path], '-t', 't8', '--partition', 'ts', '-a', '--time-index', 'btree')
+    ofp = io.StringIO()
+    csv2sql.sql(args, [path], ofp)
+    stmts = get_statements(ofp.getvalue())
+    assert not any(stmt.startswith('DROP') for stmt in stmts)
+    assert [stmt.split('\n')[1] for stmt in stmts if 'FOR VALUES' in stmt] == [
+        "  FOR VALUES FROM ('2024-12-01') TO ('2025-01-01')",
+        "  FOR VALUES FROM ('2025-01-01') TO ('2025-02-01')",
+    ]
+    assert 'CREATE TABLE IF NOT EXISTS t8_default PARTITION OF t8 DEFAULT' in stmts
+    assert stmts[-1] == 'CREATE INDEX IF NOT EXISTS t8_ts_idx ON t8 USING btree (ts)'
@@ -0,0 +1,80 @@
+'''
+Test the reading of the compressed CSV and JSON Lines input files.
+'''
+import bz2
+import gzip
+import lzma
+import os
+
+import pytest
+
+from grape.common import csvio
+from grape.common.log import initv
+
+
+initv(0)
+
+CSV = 'a,b\n1,"x\r\ny"\n2,z\n'
+ROWS = [['a', 'b'], ['1', 'x\r\ny'], ['2', 'z']]
+
+
+def write_file(path: str, data: bytes) -> str:
+    '''Write an input file.
+
+    Args:
+        path: The file path.
+        data: The file contents.
+
+    Returns:
+        path: The file path.
+    '''
+    with open(path, 'wb') as ofp:
+        ofp.write(data)
+    return path
+
+
+def test_csvio_split_ext():
+    'the input and compression extensions are recognized'
+    assert csvio.split_ext('/d/a.csv') == ('/d/a', '.csv')
+    assert csvio.split_ext('/d/a.ndjson.GZ') == ('/d/a', '.ndjson.GZ')
+    assert csvio.split_ext('/d/a.txt.gz') == ('/d/a.txt', '')
+    assert csvio.is_jsonl('a.jsonl.xz')
+    assert not csvio.is_jsonl('a.csv.zst')
+
+
+def test_csvio_compressed(tmp_path):
+    'the compression is recognized by the magic bytes, not by the extension'
+    data = CSV.encode('utf-8')
+    paths = [
+        write_file(os.path.join(tmp_path, 'plain.csv'), data),
+        write_file(os.path.join(tmp_path, 'gzip.csv'), gzip.compress(data)),
+        write_file(os.path.join(tmp_path, 'bzip2.csv.xz'), bz2.compress(data)),
+        write_file(os.path.join(tmp_path, 'xz.csv.gz'), lzma.compress(data)),
+    ]
+    for path in paths:
+        assert list(csvio.read_rows(path)) == ROWS, path
+
+
+def test_csvio_zstd(tmp_path):
+    'zstd files are read if the zstandard package is installed'
+    zstandard = pytest.importorskip('zstandard')
+    data = zstandard.ZstdCompressor().compress(CSV.encode('utf-8'))
+    path = write_file(os.path.join(tmp_path, 'zstd.csv.zst'), data)
+    assert list(csvio.read_rows(path)) == ROWS
+
+
+def test_csvio_jsonl(tmp_path):
+    'the keys of the first record are the header and the values are converted'
+    lines = [
+        '{"ts": "2024-01-01", "n": 1, "ok": true, "tags": ["a"], "x": null}',
+        '',
+        '{"n": 2.5, "ts": "2024-01-02", "extra": 1}',
+    ]
+    data = ('\n'.join(lines) + '\n').encode('utf-8')
+    for name, payload in [('r.jsonl', data), ('r.ndjson.gz', gzip.compress(data))]:
+        path = write_file(os.path.join(tmp_path, name), payload)
+        assert csvio.read_header(path) == ['ts', 'n', 'ok', 'tags', 'x']
+        assert list(csvio.read_rows(path))[1:] == [
+            ['2024-01-01', '1', 'true', '["a"]', ''],
+            ['2024-01-02', '2.5', '', '', ''],
+        ]
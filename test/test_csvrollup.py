@@ -0,0 +1,88 @@
+'''
+Test the streaming time bucket rollups of the CSV to SQL conversion.
+'''
+import argparse
+import datetime
+import io
+import os
+from typing import Dict, List
+
+from grape.common import csv2sql
+from grape.common.csvrollup import get_bucket_size
+from grape.common.log import initv
+
+
+initv(0)
+
+# The first three rows define the column types (--sample 3). The
+# fourth row is in the 10:00 UTC bucket, it has a non-numeric w. The
+# fifth row has no time and the last row has no w.
+ROWS = [
+    'ts,host,v,w',
+    '2024-01-01T10:59:59Z,a,1,5',
+    '2024-01-01T11:00:00Z,a,10,7',
+    '2024-01-01T11:15:00Z,b,4,2',
+    '2024-01-01T12:30:00+02:00,a,3,x',
+    'not a time,a,100,100',
+    '2024-01-01T11:20:00Z,a,6',
+]
+
+
+def get_rollups(tmp_path: str, rows: List[str], *opts: str) -> Dict[str, List[str]]:
+    '''Convert a CSV file to rollup tables.
+
+    Args:
+        tmp_path: The directory of the CSV file.
+        rows: The lines of the CSV file, the first is the header.
+        opts: The command line options.
+
+    Returns:
+        tables: The rows of the INSERT statement of each table.
+    '''
+    path = os.path.join(tmp_path, 'r.csv')
+    with open(path, 'w', encoding='utf-8') as ofp:
+        ofp.write('\n'.join(rows) + '\n')
+    parser = argparse.ArgumentParser()
+    csv2sql.add_csv_args(parser)
+    args = parser.parse_args(['-t', 'r', '--no-raw'] + list(opts))
+    csv2sql.check_csv_args(args, [path])
+    out = io.StringIO()
+    csv2sql.sql(args, [path], out)
+    tables = {}
+    for stmt in out.getvalue().split(';\n'):
+        if stmt.startswith('INSERT INTO '):
+            tables[stmt.split()[2]] = [line.strip().rstrip(',') for line in stmt.splitlines()[2:]]
+    return tables
+
+
+def test_csvrollup_rows(tmp_path):
+    'the rows are grouped by bucket and dimension with the aggregates of the numbers'
+    tables = get_rollups(tmp_path, ROWS, '--sample', '3', '--rollup', '1h', '--rollup', '1d',
+                         '--rollup-agg', 'v=sum,min,max,first,last')
+    # ts, host, v_sum, v_min, v_max, v_first, v_last, w_avg, count
+    assert tables['r_1h'] == [
+        "('2024-01-01 10:00:00', 'a', '4', '1', '3', '3', '1', '5.0', '2')",
+        "('2024-01-01 11:00:00', 'a', '16', '6', '10', '10', '6', '7.0', '2')",
+        "('2024-01-01 11:00:00', 'b', '4', '4', '4', '4', '4', '2.0', '1')",
+    ]
+    assert tables['r_1d'] == [
+        "('2024-01-01 00:00:00', 'a', '20', '1', '10', '3', '6', '6.0', '4')",
+        "('2024-01-01 00:00:00', 'b', '4', '4', '4', '4', '4', '2.0', '1')",
+    ]
+
+
+def test_csvrollup_buckets(tmp_path):
+    'the bucket boundaries are aligned to midnight of a Monday'
+    rows = ['ts,v', '2024-01-03 23:59:59,1', '2024-01-07 23:59:59,2', '2024-01-08 00:00:00,4']
+    tables = get_rollups(tmp_path, rows, '--rollup', '1w', '--rollup', '2d')
+    assert tables['r_1w'] == [
+        "('2024-01-01 00:00:00', '1.5', '2')",
+        "('2024-01-08 00:00:00', '4.0', '1')",
+    ]
+    # The 2 day buckets start on the odd days of January 2024.
+    assert tables['r_2d'] == [
+        "('2024-01-03 00:00:00', '1.0', '1')",
+        "('2024-01-07 00:00:00', '3.0', '2')",
+    ]
+    assert get_bucket_size('15m') == datetime.timedelta(minutes=15)
+    assert get_bucket_size('1w') == datetime.timedelta(days=7)
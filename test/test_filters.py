@@ -0,0 +1,92 @@
+'''
+Test the dashboard selection filters and their push-down into the
+grafana search API.
+'''
+import argparse
+from urllib.parse import parse_qsl, urlparse
+
+from grape.common.filters import SEARCH_LIMIT, filter_services, get_filters, match_search
+from grape.common.filters import search_service, title_query
+from grape.common.gr import read_selected_dashboards
+from grape.common.journal import Journal
+from grape.common.log import initv
+
+
+initv(0)
+
+
+def make_filters(**kwargs) -> dict:
+    '''Make the filters from option values.
+
+    Args:
+        kwargs: The option values by dest.
+
+    Returns:
+        filters: The filters.
+    '''
+    return get_filters(argparse.Namespace(**kwargs))
+
+
+def test_filters_search_service():
+    'the folder, tag, uid and literal title filters are pushed down'
+    filters = make_filters(tag=['ops', 'prod'], uid=['abc'], title_regex='Latency')
+    url = urlparse(search_service(filters, [3, 0], page=2))
+    assert url.path == 'api/search'
+    params = parse_qsl(url.query)
+    assert ('limit', str(SEARCH_LIMIT)) in params
+    assert ('page', '2') in params
+    assert [val for key, val in params if key == 'folderIds'] == ['3', '0']
+    assert [val for key, val in params if key == 'tag'] == ['ops', 'prod']
+    assert ('dashboardUIDs', 'abc') in params
+    assert ('query', 'Latency') in params
+
+
+def test_filters_title_regex():
+    'a title regular expression is matched after the search'
+    filters = make_filters(title_regex='^Ops.*latency$')
+    assert title_query(filters) == ''
+    assert 'query' not in search_service(filters, [])
+    assert match_search(filters, {'title': 'Ops API latency'})
+    assert not match_search(filters, {'title': 'Dev API latency'})
+    assert match_search(make_filters(), {'title': 'anything'})
+
+
+def test_filters_search_pages():
+    'the search is paged until a short page is returned'
+    uids = [f'd{i}' for i in range(SEARCH_LIMIT + 2)]
+    services = []
+
+    def read(service: str):
+        services.append(service)
+        if service.startswith('api/search'):
+            page = int(dict(parse_qsl(urlparse(service).query))['page'])
+            chunk = uids[(page - 1) * SEARCH_LIMIT:page * SEARCH_LIMIT]
+            return [{'uid': uid, 'title': uid, 'folderId': 0} for uid in chunk]
+        return {'uid': service.rsplit('/', 1)[-1]}
+
+    filters = make_filters(tag=['ops'])
+    dashboards = read_selected_dashboards(read, filters, [], Journal(''))
+    assert len(dashboards) == len(uids)
+    assert dashboards[-1]['uid'] == uids[-1]
+    assert len([service for service in services if service.startswith('api/search')]) == 2
+
+
+def test_filters_archive():
+    'the filters are applied to the archive data'
+    zgr = {
+        'datasources': [{'name': 'pg'}],
+        'folders': [{'id': 1, 'uid': 'f1', 'title': 'Ops'}, {'id': 2, 'uid': 'f2', 'title': 'Dev'}],
+        'dashboards': [
+            {'folderId': 1, 'dashboard': {'uid': 'a', 'title': 'Ops API', 'tags': ['api']}},
+            {'folderId': 2, 'dashboard': {'uid': 'b', 'title': 'Dev API', 'tags': ['api']}},
+            {'folderId': 0, 'dashboard': {'uid': 'c', 'title': 'Home', 'tags': []}},
+        ],
+    }
+    result = filter_services(make_filters(folder=['Ops', 'General']), zgr)
+    assert [rec['dashboard']['uid'] for rec in result['dashboards']] == ['a', 'c']
+    assert [rec['id'] for rec in result['folders']] == [1]
+    assert result['datasources'] == zgr['datasources']
+
+    result = filter_services(make_filters(tag=['api'], title_regex='^Dev'), zgr)
+    assert [rec['dashboard']['uid'] for rec in result['dashboards']] == ['b']
+    assert filter_services(make_filters(), zgr) is zgr
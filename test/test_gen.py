@@ -0,0 +1,104 @@
+'''
+Test the time ranges and the spec checks of the time series generator.
+'''
+import datetime
+import re
+from typing import List, Tuple
+
+import pytest
+
+from grape.common.log import initv
+from grape.gen import check_spec, create_sql_chunks, get_steps
+
+
+initv(0)
+
+START = datetime.datetime(2024, 1, 1)
+
+
+def get_spec(**kwargs) -> dict:
+    '''Get a checked generator spec.
+
+    Args:
+        kwargs: The spec keys that override the defaults.
+
+    Returns:
+        spec: The generator spec.
+    '''
+    spec = {
+        'table': 'gen',
+        'start': START,
+        'end': START + datetime.timedelta(hours=1),
+        'interval': 60,
+        'series': {'metric': 2},
+        'values': {'value': {'dist': 'uniform'}},
+    }
+    spec.update(kwargs)
+    check_spec(spec)
+    return spec
+
+
+def get_ranges(spec: dict, num: int) -> List[Tuple[datetime.datetime, datetime.datetime]]:
+    '''Get the generate_series time range of each chunk.
+
+    Args:
+        spec: The generator spec.
+        num: The number of chunks.
+
+    Returns:
+        ranges: The first and the last time of each chunk.
+    '''
+    ranges = []
+    for sql in create_sql_chunks(spec, num):
+        match = re.search(r"generate_series\('([^']+)'::timestamptz, '([^']+)'::timestamptz", sql)
+        assert match
+        ranges.append((datetime.datetime.fromisoformat(match.group(1)),
+                       datetime.datetime.fromisoformat(match.group(2))))
+    return ranges
+
+
+@pytest.mark.parametrize('minutes,interval,num', [
+    (60, 60, 1),
+    (60, 60, 7),
+    (61, 60, 4),  # the last step is before the end
+    (3, 60, 8),  # more chunks than steps
+    (1, 0.25, 3),  # 250ms
+])
+def test_gen_chunks(minutes, interval, num):
+    'the chunks are contiguous, do not overlap and end at the last step'
+    spec = get_spec(end=START + datetime.timedelta(minutes=minutes), interval=interval)
+    steps = get_steps(spec)
+    step = datetime.timedelta(seconds=interval)
+    ranges = get_ranges(spec, num)
+    assert len(ranges) == min(num, steps)
+    assert ranges[0][0] == START
+    assert ranges[-1][1] == START + (steps - 1) * step
+    assert ranges[-1][1] < spec['end'] <= ranges[-1][1] + step
+    for (lower, upper), (next_lower, _) in zip(ranges, ranges[1:]):
+        assert lower <= upper
+        assert next_lower == upper + step
+    assert sum(int((upper - lower) / step) + 1 for lower, upper in ranges) == steps
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'end': START},
+    {'interval': 0},
+    {'series': {'metric': 0}},
+    {'series': {'metric': []}},
+    {'series': {'metric': 'a'}},
+    {'values': {'value': {'dist': 'poisson'}}},
+    {'values': {'value': {'dist': 'sine', 'period': '0s'}}},
+])
+def test_gen_check_spec(kwargs):
+    'an invalid spec is rejected'
+    with pytest.raises(SystemExit):
+        get_spec(**kwargs)
+
+
+def test_gen_check_spec_defaults():
+    'the distribution parameters are filled in'
+    spec = get_spec(values={'value': {'dist': 'sine', 'period': '1h'}, 'n': {'min': 5}})
+    assert spec['values']['value']['amplitude'] == 25
+    assert spec['values']['n']['dist'] == 'uniform'
+    assert spec['values']['n']['min'] == 5
+    assert spec['values']['n']['type'] == 'DOUBLE PRECISION'
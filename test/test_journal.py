@@ -0,0 +1,69 @@
+'''
+Test the checkpoint journal used to resume interrupted import and
+export operations.
+'''
+import json
+import os
+
+from grape.common.journal import Journal
+from grape.common.log import initv
+
+
+initv(0)
+
+
+def test_journal_resume(tmp_path):
+    'the completed entries of an interrupted run are reused'
+    path = str(tmp_path / 'example.zip.journal')
+    journal = Journal(path, 'export', 'http://localhost:4600')
+    assert journal.cached('dashboard', 'abc', lambda: {'uid': 'abc'}) == {'uid': 'abc'}
+    journal.add('folder', 7)
+    journal.close(remove=False)
+
+    # Simulate a process that was killed while it was appending.
+    with open(path, 'a', encoding='utf-8') as ofp:
+        ofp.write('{"kind": "dashboard", "key": "xy')
+
+    journal = Journal(path, 'export', 'http://localhost:4600', resume=True)
+    assert journal.has('dashboard', 'abc')
+    assert journal.has('folder', '7')
+    assert not journal.has('dashboard', 'xy')
+    calls = []
+    assert journal.cached('dashboard', 'abc', lambda: calls.append(1)) == {'uid': 'abc'}
+    assert not calls
+    journal.add('dashboard', 'def', {'uid': 'def'})
+    journal.close(remove=False)
+
+    # The truncated entry was terminated so the new entry is intact.
+    with open(path, 'r', encoding='utf-8') as ifp:
+        lines = ifp.read().splitlines()
+    assert json.loads(lines[-1]) == {'kind': 'dashboard', 'key': 'def', 'data': {'uid': 'def'}}
+
+    journal = Journal(path, 'export', 'http://localhost:4600', resume=True)
+    assert journal.get('dashboard', 'def') == {'uid': 'def'}
+    journal.close()
+    assert not os.path.exists(path)
+
+
+def test_journal_mismatch(tmp_path):
+    'a journal of a different operation or without --resume is discarded'
+    path = str(tmp_path / 'example.zip.journal')
+    journal = Journal(path, 'import', 'http://localhost:4600')
+    journal.add('datasource', 'pg')
+    journal.close(remove=False)
+
+    journal = Journal(path, 'import', 'http://localhost:4700', resume=True)
+    assert not journal.has('datasource', 'pg')
+    journal.close(remove=False)
+
+    journal = Journal(path, 'import', 'http://localhost:4700')
+    assert not journal.has('datasource', 'pg')
+    journal.close()
+
+
+def test_journal_disabled():
+    'a journal without a path never records anything'
+    journal = Journal('')
+    assert journal.cached('dashboard', 'abc', lambda: 1) == 1
+    assert journal.has('dashboard', 'abc')  # in memory only
+    journal.close()
@@ -0,0 +1,119 @@
+'''
+Test the dashboard lint rules and the --fail-on exit status.
+'''
+import argparse
+import sys
+
+import pytest
+
+from grape import lint
+from grape.common.log import initv
+
+
+initv(0)
+
+DATASOURCES = [{'name': 'examplepg', 'uid': 'p1', 'type': 'postgres', 'isDefault': True}]
+
+
+def get_dashboard() -> dict:
+    '''Get a dashboard that breaks every rule.
+
+    Returns:
+        rec: The dashboard record from api/dashboards/uid.
+    '''
+    panels = [
+        {'id': 1, 'type': 'timeseries', 'targets': [
+            {'refId': 'A', 'rawSql': 'SELECT ts AS time, v FROM m'}]},
+        {'id': 2, 'type': 'timeseries', 'targets': [
+            {'refId': 'A', 'rawSql': 'SELECT $__timeGroup(ts, 5m), avg(v) FROM m '
+                                     'WHERE $__timeFilter(ts) GROUP BY 1'}]},
+        {'id': 3, 'type': 'table', 'targets': [
+            {'refId': 'A', 'format': 'table',
+             'rawSql': 'SELECT * FROM m WHERE $__timeFilter(ts)'}]},
+        {'id': 4, 'type': 'timeseries', 'targets': [
+            {'refId': 'A', 'rawSql': 'SELECT ts AS time, v FROM m WHERE $__timeFilter(ts)'},
+            {'refId': 'B', 'rawSql': 'SELECT ts, v FROM hidden', 'hide': True}]},
+        {'id': 5, 'type': 'row', 'panels': [
+            {'id': 6, 'type': 'stat', 'targets': [{'refId': 'A', 'rawSql': 'SELECT 1'}]}]},
+    ]
+    dash = {
+        'uid': 'd1',
+        'title': 'Ops',
+        'refresh': '5s',
+        'panels': panels,
+        'templating': {'list': [
+            {'name': 'host', 'type': 'query', 'refresh': 2},
+            {'name': 'region', 'type': 'query', 'refresh': 1},
+            {'name': 'span', 'type': 'interval', 'refresh': 2},
+        ]},
+    }
+    return {'dashboard': dash, 'folderId': 0}
+
+
+def get_opts(**kwargs) -> argparse.Namespace:
+    '''Get the lint options.
+
+    Args:
+        kwargs: The options that override the defaults.
+
+    Returns:
+        opts: The options.
+    '''
+    opts = {'disable': [], 'fail_on': 'error', 'max_panels': 4, 'min_refresh': '30s'}
+    opts.update(kwargs)
+    return argparse.Namespace(**opts)
+
+
+def test_lint_rules():
+    'each rule reports its severity and the offending panels'
+    zgr = {'datasources': DATASOURCES, 'dashboards': [get_dashboard()]}
+    findings = lint.lint(get_opts(), zgr)
+    assert [(rec['severity'], rec['rule'], rec['panels']) for rec in findings] == [
+        ('error', 'refresh', []),
+        ('warning', 'panels', []),
+        ('error', 'no-time-filter', [1]),
+        ('warning', 'no-time-group', [1, 4]),
+        ('warning', 'variable-refresh', []),
+    ]
+    assert findings[0]['dashboard'] == 'Ops (d1)'
+    assert findings[1]['message'] == '5 panels, the maximum is 4'
+    assert 'host' in findings[4]['message']
+
+
+def test_lint_rules_pass():
+    'a slow refresh, few panels and disabled rules have no findings'
+    rec = get_dashboard()
+    dash = rec['dashboard']
+    dash['refresh'] = '1m'
+    assert not lint.check_refresh(get_opts(), dash, [])
+    dash['refresh'] = False  # refresh is off
+    assert not lint.check_refresh(get_opts(), dash, [])
+    assert not lint.check_panels(get_opts(max_panels=5), dash, [])
+    assert not lint.check_variable_refresh(get_opts(), {'templating': {'list': []}}, [])
+    opts = get_opts(disable=['no-time-filter', 'no-time-group'])
+    zgr = {'datasources': DATASOURCES, 'dashboards': [rec]}
+    assert [rec['rule'] for rec in lint.lint(opts, zgr)] == ['panels', 'variable-refresh']
+
+
+@pytest.mark.parametrize('args,status', [
+    (['--fail-on', 'error'], 1),
+    (['--fail-on', 'error', '--disable', 'refresh', '--disable', 'no-time-filter'], None),
+    (['--fail-on', 'warning', '--disable', 'refresh', '--disable', 'no-time-filter'], 1),
+    (['--fail-on', 'warning', '--max-panels', '5', '--min-refresh', '5s',
+      '--disable', 'no-time-filter', '--disable', 'no-time-group',
+      '--disable', 'variable-refresh'], None),
+])
+def test_lint_fail_on(monkeypatch, capsys, args, status):
+    'the exit status is 1 if there are findings with the --fail-on severity or worse'
+    zgr = {'datasources': DATASOURCES, 'folders': [], 'dashboards': [get_dashboard()]}
+    monkeypatch.setattr(sys, 'argv', ['lint', '-n', 'example'] + args)
+    monkeypatch.setattr(lint, 'get_conf', lambda *args: {})
+    monkeypatch.setattr(lint, 'read_services', lambda conf, filters: zgr)
+    if status is None:
+        lint.main()
+    else:
+        with pytest.raises(SystemExit) as exc:
+            lint.main()
+        assert exc.value.code == status
+    out = capsys.readouterr().out
+    assert out.splitlines()[-1].endswith('in 1 dashboards')
@@ -0,0 +1,98 @@
+'''
+Test the splitting of the pg_dumpall scripts for the bulk restore and
+the parsing of the psql output.
+'''
+import os
+import pathlib
+
+from grape.common.log import initv
+from grape.common.pg import EXPLAIN_ERROR, EXPLAIN_MARKER, PHASE_SELECT
+from grape.common.pg import get_connect_dbname, get_phase_times, parse_explain_output, split_dump
+
+
+initv(0)
+
+
+def read_dump() -> str:
+    '''Read the pg_dumpall fixture.
+
+    Returns:
+        sql: The pg_dumpall script.
+    '''
+    path = os.path.join(pathlib.Path(__file__).parent.absolute(), 'test_pg_dumpall.sql')
+    with open(path, 'r', encoding='utf-8') as ifp:
+        return ifp.read()
+
+
+def test_pg_split_dump():
+    'the script is split at the connects and around CREATE DATABASE'
+    segments = split_dump(read_dump(), 'postgres')
+    assert [(seg['dbname'], seg['single']) for seg in segments] == [
+        ('postgres', True),
+        ('template1', True),
+        ('template1', False),
+        ('template1', True),
+        ('my db', True),
+    ]
+    assert segments[2]['sql'] == ('\\restrict k3y\n'
+                                  'CREATE DATABASE "my db" WITH TEMPLATE = template0 '
+                                  "ENCODING = 'UTF8';\n"
+                                  '\\unrestrict k3y\n')
+    for seg in segments[:-1]:
+        # The restricted mode is carried over the segment boundaries.
+        assert seg['sql'].endswith('\\unrestrict k3y\n')
+    for seg in segments[1:]:
+        assert seg['sql'].startswith('\\restrict k3y\n')
+    assert '\\connect' not in ''.join(seg['sql'] for seg in segments[:-1])
+
+
+def test_pg_split_dump_phases():
+    'the phase markers are inserted at the section boundaries but not in the COPY data'
+    sql = split_dump(read_dump(), 'postgres')[-1]['sql']
+    phases = [line[len(PHASE_SELECT):].split(':')[0]
+              for line in sql.splitlines() if line.startswith(PHASE_SELECT)]
+    assert phases == ['pre-data', 'data', 'post-data', 'end']
+    assert '2\t\\connect not a meta-command\n\\.\n' in sql
+    assert sql.index('COPY public.t1') < sql.index('post-data') < sql.index('ADD CONSTRAINT')
+
+
+def test_pg_get_connect_dbname():
+    'the plain, quoted and connection string database names are unquoted'
+    assert get_connect_dbname('\\connect example\n') == 'example'
+    assert get_connect_dbname('\\connect "my ""db"""\n') == 'my "db"'
+    assert get_connect_dbname('\\connect -reuse-previous=on "dbname=\'it\'\'s\'"\n') == "it's"
+
+
+def test_pg_get_phase_times():
+    'the time between the markers is added to the phase that they start'
+    out = ('grape-phase:pre-data:100.5\nSET\n'
+           'grape-phase:data:101.0\nCOPY 2\n'
+           'grape-phase:post-data:103.0\n'
+           'grape-phase:end:103.25\n')
+    times = {'pre-data': 1.0}
+    get_phase_times(out, times)
+    assert times == {'pre-data': 1.5, 'data': 2.0, 'post-data': 0.25}
+
+
+def test_pg_parse_explain_output():
+    'a failed query only fails its own result'
+    plan = '[\n  {\n    "Plan": {\n      "Node Type": "Seq Scan",\n      "Total Cost": 35.5\n' \
+        '    }\n  }\n]'
+    out = '\n'.join([
+        '1',  # the setup output
+        EXPLAIN_MARKER, plan,
+        EXPLAIN_MARKER, f'{EXPLAIN_ERROR} relation "nosuch" does not exist',
+        EXPLAIN_MARKER, plan,
+    ]) + '\n'
+    results = parse_explain_output(out, 3)
+    assert [error for _, error in results] == ['', 'relation "nosuch" does not exist', '']
+    assert results[0][0][0]['Plan']['Total Cost'] == 35.5
+    assert results[1][0] == []
+    assert results[2] == results[0]
+
+
+def test_pg_parse_explain_output_unexpected():
+    'a missing query output fails all of the results'
+    results = parse_explain_output(f'{EXPLAIN_MARKER}\n[]\n', 2)
+    assert len(results) == 2
+    assert all(not plan and error.startswith('unexpected psql output') for plan, error in results)
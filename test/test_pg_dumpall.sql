@@ -0,0 +1,82 @@
+--
+-- PostgreSQL database cluster dump
+--
+
+\restrict k3y
+
+SET default_transaction_read_only = off;
+
+SET client_encoding = 'UTF8';
+SET standard_conforming_strings = on;
+
+--
+-- Roles
+--
+
+CREATE ROLE postgres;
+ALTER ROLE postgres WITH SUPERUSER INHERIT CREATEROLE CREATEDB LOGIN REPLICATION BYPASSRLS;
+
+--
+-- Databases
+--
+
+\connect template1
+
+--
+-- PostgreSQL database dump
+--
+
+SET statement_timeout = 0;
+
+--
+-- PostgreSQL database dump complete
+--
+
+--
+-- Name: my db; Type: DATABASE; Schema: -; Owner: postgres
+--
+
+CREATE DATABASE "my db" WITH TEMPLATE = template0 ENCODING = 'UTF8';
+
+
+ALTER DATABASE "my db" OWNER TO postgres;
+
+\connect -reuse-previous=on "dbname='my db'"
+
+SET statement_timeout = 0;
+
+--
+-- Name: t1; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE public.t1 (
+    id integer NOT NULL,
+    name text
+);
+
+--
+-- Data for Name: t1; Type: TABLE DATA; Schema: public; Owner: postgres
+--
+
+COPY public.t1 (id, name) FROM stdin;
+1	-- not a comment
+2	\connect not a meta-command
+\.
+
+--
+-- Name: t1 t1_pkey; Type: CONSTRAINT; Schema: public; Owner: postgres
+--
+
+ALTER TABLE ONLY public.t1
+    ADD CONSTRAINT t1_pkey PRIMARY KEY (id);
+
+--
+-- PostgreSQL database dump complete
+--
+
+\unrestrict k3y
+
+--
+-- PostgreSQL database cluster dump complete
+--
+
@@ -0,0 +1,109 @@
+'''
+Test the expansion of the grafana macros and template variables and
+the normalization of the panel queries.
+'''
+import datetime
+
+from grape.common.log import initv
+from grape.common.queries import expand, get_dbname, get_targets, get_variables, normalize
+from grape.common.queries import parse_time
+
+
+initv(0)
+
+UTC = datetime.timezone.utc
+LOWER = datetime.datetime(2024, 1, 2, 3, 0, 0, tzinfo=UTC)
+UPPER = datetime.datetime(2024, 1, 2, 9, 0, 0, tzinfo=UTC)
+
+
+def test_queries_parse_time_absolute():
+    'epoch milliseconds and absolute times are converted to UTC'
+    assert parse_time('1704164400000') == LOWER
+    assert parse_time('2024-01-02 03:00:00') == LOWER
+    assert parse_time('2024-01-02T04:00:00+01:00') == LOWER
+
+
+def test_queries_parse_time_relative():
+    'relative times are offset from now and rounded to the unit'
+    now = datetime.datetime.now(UTC)
+    value = parse_time('now-6h')
+    assert abs((now - datetime.timedelta(hours=6) - value).total_seconds()) < 5
+    start = parse_time('now/d')
+    assert start.tzinfo == UTC
+    assert (start.hour, start.minute, start.second, start.microsecond) == (0, 0, 0, 0)
+    end = parse_time('now/d', end=True)
+    assert end - start == datetime.timedelta(days=1, milliseconds=-1)
+    month = parse_time('now-1M/M')
+    assert (month.day, month.hour) == (1, 0)
+    week = parse_time('now/w')
+    assert week.weekday() == 0
+
+
+def test_queries_expand_macros():
+    'the time macros are expanded for the time range and the interval'
+    sql = ('SELECT $__timeGroupAlias(ts, $__interval), avg(v) FROM t '
+           'WHERE $__timeFilter(ts) AND x > $__unixEpochFrom() GROUP BY 1')
+    assert expand(sql, {}, LOWER, UPPER, 60) == (
+        'SELECT floor(extract(epoch from ts)/60)*60 AS "time", avg(v) FROM t '
+        "WHERE ts BETWEEN '2024-01-02T03:00:00Z' AND '2024-01-02T09:00:00Z' "
+        'AND x > 1704164400 GROUP BY 1')
+    assert expand("SELECT $__timeGroup(ts, '5m')", {}, LOWER, UPPER, 60) == \
+        'SELECT floor(extract(epoch from ts)/300)*300'
+    assert expand('SELECT $__nosuch(ts)', {}, LOWER, UPPER, 60) == 'SELECT $__nosuch(ts)'
+
+
+def test_queries_expand_variables():
+    'the template variables are formatted like the grafana SQL datasources'
+    dash = {
+        'templating': {'list': [
+            {'name': 'host', 'multi': True, 'current': {'value': ['a', "b'c"]}},
+            {'name': 'metric', 'current': {'value': 'cpu'}},
+            {'name': 'env', 'includeAll': True, 'allValue': "'%'",
+             'current': {'value': ['$__all']}},
+        ]},
+    }
+    variables = get_variables(dash, {'metric': 'mem'})
+    sql = ('SELECT * FROM t WHERE host IN ($host) AND m = \'$metric\' '
+           'AND e LIKE $env AND h = ${host:csv} AND k = [[metric]] '
+           'AND u = $unknown AND i = \'$__interval\' AND f > $__from')
+    assert expand(sql, variables, LOWER, UPPER, 300) == (
+        "SELECT * FROM t WHERE host IN ('a','b''c') AND m = 'mem' "
+        "AND e LIKE '%' AND h = a,b'c AND k = mem "
+        "AND u = $unknown AND i = '5m' AND f > 1704164400000")
+
+
+def test_queries_normalize():
+    'the literals, parameters, comments and whitespace are normalized'
+    sql = "SELECT v  FROM t -- comment\nWHERE $__timeFilter(ts) AND n = 'x''y' AND k > -1.5e3;"
+    panel = expand(sql, {}, LOWER, UPPER, 60)
+    stat = 'select v from t /* c */ where ts between $1 and $2 and n = $3 and k > $4'
+    assert normalize(panel) == normalize(stat)
+    assert normalize(stat) == 'select v from t where ts between ? and ? and n=? and k>?'
+    assert normalize('SELECT t1.c2 FROM t1') == 'select t1.c2 from t1'
+
+
+def test_queries_get_dbname():
+    'each target has the database of its own datasource'
+    datasources = [
+        {'name': 'examplepg', 'uid': 'p1', 'type': 'postgres', 'database': 'postgres',
+         'isDefault': True},
+        {'name': 'sales', 'uid': 'p2', 'type': 'grafana-postgresql-datasource', 'database': '',
+         'jsonData': {'database': 'sales'}},
+        {'name': 'bare', 'uid': 'p3', 'type': 'postgres'},
+        {'name': 'prom', 'uid': 'm1', 'type': 'prometheus'},
+    ]
+    panels = [
+        {'id': 1, 'targets': [{'refId': 'A', 'rawSql': 'SELECT 1'}]},
+        {'id': 2, 'datasource': {'type': 'postgres', 'uid': 'p2'},
+         'targets': [{'refId': 'A', 'rawSql': 'SELECT 2'}]},
+        {'id': 3, 'datasource': {'uid': '-- Mixed --'}, 'targets': [
+            {'refId': 'A', 'rawSql': 'SELECT 3', 'datasource': 'bare'},
+            {'refId': 'B', 'rawSql': 'SELECT 4', 'datasource': {'type': 'prometheus', 'uid': 'm1'}},
+        ]},
+    ]
+    targets = get_targets(datasources, [{'dashboard': {'panels': panels}}])
+    assert [(rec['sql'], get_dbname(rec['datasource'])) for rec in targets] == [
+        ('SELECT 1', 'postgres'),
+        ('SELECT 2', 'sales'),
+        ('SELECT 3', ''),
+    ]
@@ -15,6 +15,7 @@ test would slow things down too much.
 import inspect
 import os
 import pathlib
+import shutil
 import sys
 import time
 from subprocess import Popen, PIPE
@@ -32,6 +33,7 @@ from grape import ximport
 from grape import xexport
 from grape import status
 from grape import tree
+from grape import ingest
 
 
 GPORT = 4700
@@ -40,6 +42,13 @@ NAME = 'grape_test1'
 GPORT2 = 4710
 NAME2 = 'grape_test2'
 
+# The commands whose help is tested, including the aliases.
+COMMANDS = [
+    'create', 'cr', 'delete', 'del', 'load', 'save', 'import', 'export',
+    'clone', 'ingest', 'gen', 'profile-queries', 'advise', 'loadtest',
+    'lint', 'dbstats',
+]
+
 
 def debug(msg: str, level: int = 1):
     '''
@@ -124,7 +133,7 @@ def test_run_cli(capsys: Any):
         assert exc.value.code == 0
 
     # now test cli operations help
-    for cmd in ['create', 'cr', 'delete', 'del', 'load', 'save', 'import', 'export']:
+    for cmd in COMMANDS:
         for opt in ['-h', '--help', '-V', '--version', 'help', 'version']:
             sys.argv = [fct, cmd, opt]
             with pytest.raises(SystemExit) as exc:
@@ -137,7 +146,7 @@ def test_run_cli(capsys: Any):
             assert exc.value.code == 0
 
     # Test: help COMMAND
-    for cmd in ['create', 'cr', 'delete', 'del', 'load', 'save', 'import', 'export']:
+    for cmd in COMMANDS:
         sys.argv = [fct, 'help', cmd]
         with pytest.raises(SystemExit) as exc:
             cli.main()
@@ -553,6 +562,40 @@ def test_run_runpga(name: str):
     assert not containers
 
 
+def check_ingest(capsys: Any, name: str, container: Any, csvfile: str):
+    '''Ingest the CSV data directly and verify the table row counts.
+
+    The data is ingested into one table and then two copies of it are
+    ingested in parallel into another table.
+
+    Args:
+        capsys: Pytest fixture for capturing stdout/stderr.
+        name: The grape project name for this test.
+        container: The database container.
+        csvfile: The CSV data file.
+    '''
+    fct = inspect.stack()[0].function
+    shards = os.path.join(os.path.dirname(csvfile), name, 'shards')
+    os.makedirs(shards, exist_ok=True)
+    for shard in ['a.csv', 'b.csv']:
+        shutil.copyfile(csvfile, os.path.join(shards, shard))
+    runs = [
+        ('all_weekly_excess_deaths_ingest', 7387, [csvfile]),
+        ('all_weekly_excess_deaths_shards', 14774, ['-j', '2', shards]),
+    ]
+    for table, count, args in runs:
+        sys.argv = [fct, '-v', '-n', name, '-t', table] + args
+        ingest.main()
+        out, err = capsys.readouterr()
+        debug(f'out=[{len(out)}]<<<{repr(out)}>>>')
+        debug(f'err=[{len(err)}]<<<{repr(err)}>>>')
+        assert out.startswith(f'{count} rows')
+        cmd = f'psql -U postgres -d postgres -At -c "SELECT count(*) FROM {table}"'
+        result = container.exec_run(cmd)
+        assert result.output.decode('utf-8').strip() == str(count)
+    shutil.rmtree(shards)
+
+
 @pytest.mark.depends(on=['test_run_runpga'])
 @pytest.mark.parametrize(
     'name,gport',
@@ -636,6 +679,9 @@ def test_run_dash_import_csv(capsys, name: str, gport: int):
     debug(f'out=[{len(out)}]<<<{repr(out)}>>>')
     debug(f'err=[{len(err)}]<<<{repr(err)}>>>')
 
+    # Ingest the same data directly into other tables.
+    check_ingest(capsys, name, container, csvfile)
+
     # At this point the database container is ready to roll
     # so it is time to create the dashboard.
     # $ jq '.__inputs[].name' test/test_run_dash_import_csv.json
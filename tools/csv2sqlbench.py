@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+'''
+Benchmark the csv2sql.py tool.
+
+It generates a CSV file with integer, float, date, timestamp and
+string columns, runs the csv2sql.py type inference pass and the full
+SQL generation on it and reports the rows per second for each.
+
+If a grape postgres container is specified (-p), it also loads the
+SQL for each output format into the database using psql and reports
+the rows per second for each format.
+
+The generated CSV file is kept if -k is specified so that it can be
+reused, for example to compare against another version of the tool.
+'''
+import argparse
+import datetime
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from grape.common import csv2sql, csvio, csvtypes
+from grape.common.log import initv
+
+
+def args_get_text(string: str):
+    '''Convert to argparse section titles upper case to make things
+    consistent.
+
+    Args:
+        string: The string from argparse.
+
+    Returns:
+        string: The string in uppercase if it matches known patterns.
+    '''
+    lookup = {
+        'usage: ': 'USAGE:',
+        'positional arguments': 'POSITIONAL ARGUMENTS',
+        'optional arguments': 'OPTIONAL ARGUMENTS',
+        'show this help message and exit': 'Show this help message and exit.\n ',
+    }
+    return lookup.get(string, string)
+
+
+def getargs() -> argparse.Namespace:
+    '''
+    Get the command line options.
+
+    Returns:
+        args: The arguments.
+    '''
+    argparse._ = args_get_text  # type: ignore
+    base = os.path.basename(sys.argv[0])
+    usage = '\n {0} [OPTIONS]'.format(base)
+    desc = 'DESCRIPTION:{0}'.format('\n  '.join(__doc__.split('\n')))
+    epilog = '''
+EXAMPLES:
+    # ------------------------------------------------
+    # Example 1: Help.
+    # ------------------------------------------------
+        $ {0} -h
+
+    # ------------------------------------------------
+    # Example 2: Benchmark a one million row CSV file.
+    # ------------------------------------------------
+        $ pipenv run python {0}
+
+    # ------------------------------------------------
+    # Example 3: Only benchmark the type inference and
+    #            keep the CSV file.
+    # ------------------------------------------------
+        $ pipenv run python {0} -H -k -c /tmp/bench.csv
+
+    # ------------------------------------------------
+    # Example 4: Benchmark the load time of the output
+    #            formats in a grape database.
+    # ------------------------------------------------
+        $ pipenv run grape create -v -n bench -g 4800
+        $ pipenv run python {0} -p benchpg
+'''.format(base).strip()
+    afc = argparse.RawTextHelpFormatter
+    parser = argparse.ArgumentParser(formatter_class=afc,
+                                     description=desc[:-2],
+                                     usage=usage,
+                                     epilog=epilog.rstrip() + '\n ')
+
+    parser.add_argument('-c', '--csv',
+                        action='store',
+                        default='',
+                        help='''\
+The CSV file path.
+
+If it exists, it is used as is, otherwise
+it is generated. The default is a temporary
+file.
+ ''')
+
+    parser.add_argument('-H', '--header',
+                        action='store_true',
+                        dest='header_only',
+                        help='''\
+Only benchmark the type inference.
+ ''')
+
+    parser.add_argument('-k', '--keep',
+                        action='store_true',
+                        help='''\
+Keep the generated CSV file.
+ ''')
+
+    parser.add_argument('-n', '--num',
+                        action='store',
+                        type=int,
+                        default=1000000,
+                        help='''\
+The number of rows to generate.
+
+The default is %(default)s.
+ ''')
+
+    parser.add_argument('-p', '--pg',
+                        action='store',
+                        default='',
+                        metavar=('CONTAINER'),
+                        help='''\
+The grape postgres container to load
+the SQL into for the load benchmark.
+
+The benchmark table is dropped when
+the benchmark is done.
+ ''')
+
+    parser.add_argument('-v', '--verbose',
+                        action='count',
+                        default=0,
+                        help='''\
+Increase the level of verbosity.
+ ''')
+    return parser.parse_args()
+
+
+def get_csv_args(path: str, *opts: str) -> argparse.Namespace:
+    '''Get the conversion arguments.
+
+    Args:
+        path: The CSV file path.
+        opts: The conversion options.
+
+    Returns:
+        args: The conversion arguments.
+    '''
+    parser = argparse.ArgumentParser()
+    csv2sql.add_csv_args(parser)
+    args = parser.parse_args(['-t', 'bench'] + list(opts))
+    csv2sql.check_csv_args(args, [path])
+    return args
+
+
+def generate(path: str, num: int):
+    '''Generate the CSV file.
+
+    Args:
+        path: The CSV file path.
+        num: The number of rows.
+    '''
+    start = datetime.date(2020, 1, 1)
+    rnd = random.Random(42)
+    with open(path, 'w', encoding='utf-8') as ofp:
+        ofp.write('num,value,day,stamp,us_date,name\n')
+        for i in range(num):
+            day = start + datetime.timedelta(days=i % 1000)
+            ofp.write(f'{i},{rnd.random():.6f},{day.isoformat()},'
+                      f'{day.isoformat()} {i % 24:02d}:{i % 60:02d}:00,'
+                      f'{day.month}/{day.day}/{day.year},name{i % 500}\n')
+
+
+def bench(name: str, num: int, fct) -> float:
+    '''Run a benchmark.
+
+    Args:
+        name: The benchmark name.
+        num: The number of rows.
+        fct: The function to run.
+
+    Returns:
+        rate: The rows per second.
+    '''
+    start = time.time()
+    fct()
+    elapsed = time.time() - start
+    rate = num / elapsed
+    print(f'{name:<10} {num:>9} rows {elapsed:>8.2f}s {rate:>12.1f} rows/s')
+    return rate
+
+
+def bench_load(path: str, num: int, container: str):
+    '''Benchmark loading each of the output formats into postgres.
+
+    Args:
+        path: The CSV file path.
+        num: The number of rows.
+        container: The postgres container name.
+    '''
+    cmd = ['docker', 'exec', '-i', container,
+           'psql', '-U', 'postgres', '-d', 'postgres', '-q', '-v', 'ON_ERROR_STOP=1']
+    formats = [
+        ('insert', []),
+        ('insert-10k', ['-b', '10000']),
+        ('copy', ['-F', 'copy']),
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, opts in formats:
+            sqlfile = os.path.join(tmp, name + '.sql')
+            args = get_csv_args(path, *opts)
+            with open(sqlfile, 'w', encoding='utf-8') as ofp:
+                csv2sql.sql(args, [path], ofp)
+
+            def load(sqlfile=sqlfile):
+                with open(sqlfile, encoding='utf-8') as ifp:
+                    subprocess.run(cmd, stdin=ifp, stdout=subprocess.DEVNULL, check=True)
+            bench(name, num, load)
+    subprocess.run(cmd + ['-c', 'DROP TABLE IF EXISTS bench'],
+                   stdout=subprocess.DEVNULL, check=True)
+
+
+def main():
+    'main'
+    args = getargs()
+    initv(0)
+    path = args.csv
+    tmp = ''
+    if not path:
+        tmp = tempfile.mkdtemp()
+        path = os.path.join(tmp, 'bench.csv')
+    if not os.path.exists(path):
+        if args.verbose:
+            sys.stderr.write(f'generating {args.num} rows in {path}\n')
+        generate(path, args.num)
+    with open(path, encoding='utf-8') as ifp:
+        num = sum(1 for _ in ifp) - 1
+
+    opts = get_csv_args(path)
+    _, crecs = csvtypes.define_column_recs(csvio.read_header(path))
+    bench('inference', num, lambda: csvtypes.set_column_types(opts, path, crecs))
+    if args.verbose:
+        for crec in crecs:
+            sys.stderr.write(f'   {crec["title"]:<10} {crec["type"]}\n')
+    if not args.header_only:
+        with open(os.devnull, 'w', encoding='utf-8') as ofp:
+            bench('sql', num, lambda: csv2sql.sql(opts, [path], ofp))
+    if args.pg:
+        bench_load(path, num, args.pg)
+
+    if tmp and not args.keep:
+        os.unlink(path)
+        os.rmdir(tmp)
+    elif tmp:
+        print(f'kept {path}')
+
+
+if __name__ == '__main__':
+    main()
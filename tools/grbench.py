@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+'''
+Benchmark the grafana authentication modes used by grape.
+
+It sends the same read request to a grafana server repeatedly for
+each authentication mode and reports the requests per second.
+
+The modes are:
+   basic    - HTTP basic auth on every request without a session,
+              this is how grape worked before sessions were added.
+   session  - the username and password are exchanged once for a
+              login session cookie.
+   token    - an API key or service account token (only if -T is
+              specified).
+
+Basic authentication makes grafana hash the password on every request
+so the difference depends on the password hashing cost of the server.
+No reference numbers are recorded, run it against the server of
+interest.
+'''
+import argparse
+import os
+import sys
+import time
+from typing import Callable
+
+import requests
+
+from grape.common.gr import get_session
+from grape.common.log import initv, info
+
+
+def args_get_text(string: str):
+    '''Convert to argparse section titles upper case to make things
+    consistent.
+
+    Args:
+        string: The string from argparse.
+
+    Returns:
+        string: The string in uppercase if it matches known patterns.
+    '''
+    lookup = {
+        'usage: ': 'USAGE:',
+        'positional arguments': 'POSITIONAL ARGUMENTS',
+        'optional arguments': 'OPTIONAL ARGUMENTS',
+        'show this help message and exit': 'Show this help message and exit.\n ',
+    }
+    return lookup.get(string, string)
+
+
+def getargs() -> argparse.Namespace:
+    '''
+    Get the command line options.
+
+    Returns:
+        args: The arguments.
+    '''
+    argparse._ = args_get_text  # type: ignore
+    base = os.path.basename(sys.argv[0])
+    usage = '\n {0} [OPTIONS]'.format(base)
+    desc = 'DESCRIPTION:{0}'.format('\n  '.join(__doc__.split('\n')))
+    epilog = '''
+EXAMPLES:
+    # ------------------------------------------------
+    # Example 1: Help.
+    # ------------------------------------------------
+        $ {0} -h
+
+    # ------------------------------------------------
+    # Example 2: Benchmark a local grape grafana server.
+    # ------------------------------------------------
+        $ pipenv run grape create -v -n bench -g 4800
+        $ pipenv run python {0} -g http://localhost:4800 -n 500
+'''.format(base).strip()
+    afc = argparse.RawTextHelpFormatter
+    parser = argparse.ArgumentParser(formatter_class=afc,
+                                     description=desc[:-2],
+                                     usage=usage,
+                                     epilog=epilog.rstrip() + '\n ')
+
+    parser.add_argument('-g', '--grafana',
+                        action='store',
+                        default='http://localhost:4600',
+                        help='''\
+The grafana server URL.
+
+The default is %(default)s.
+ ''')
+
+    parser.add_argument('-n', '--num',
+                        action='store',
+                        type=int,
+                        default=200,
+                        help='''\
+The number of requests per mode.
+
+The default is %(default)s.
+ ''')
+
+    parser.add_argument('-P', '--password',
+                        action='store',
+                        default='admin',
+                        help='''\
+The grafana password.
+
+The default is %(default)s.
+ ''')
+
+    parser.add_argument('-s', '--service',
+                        action='store',
+                        default='api/search',
+                        help='''\
+The grafana REST service to read.
+
+The default is %(default)s.
+ ''')
+
+    parser.add_argument('-t', '--timeout',
+                        action='store',
+                        type=float,
+                        default=30,
+                        help='''\
+The timeout of each request in seconds.
+
+The default is %(default)s.
+ ''')
+
+    parser.add_argument('-T', '--token',
+                        action='store',
+                        default='',
+                        help='''\
+An API key or service account token.
+If specified, the token mode is also run.
+ ''')
+
+    parser.add_argument('-U', '--username',
+                        action='store',
+                        default='admin',
+                        help='''\
+The grafana username.
+
+The default is %(default)s.
+ ''')
+
+    parser.add_argument('-v', '--verbose',
+                        action='count',
+                        default=0,
+                        help='''\
+Increase the level of verbosity.
+ ''')
+    return parser.parse_args()
+
+
+def bench(name: str, num: int, fct: Callable[[], requests.Response]) -> float:
+    '''Run a benchmark mode.
+
+    Args:
+        name: The mode name.
+        num: The number of requests.
+        fct: The function that sends one request.
+
+    Returns:
+        rate: The requests per second.
+    '''
+    start = time.time()
+    for _ in range(num):
+        response = fct()
+        if response.status_code != 200:
+            sys.stderr.write(f'ERROR: {name} request failed with status '
+                             f'{response.status_code}\n')
+            sys.exit(1)
+    elapsed = time.time() - start
+    rate = num / elapsed
+    print(f'{name:<8} {num:>6} requests {elapsed:>8.2f}s {rate:>10.1f} req/s')
+    return rate
+
+
+def main():
+    'main'
+    args = getargs()
+    initv(args.verbose)
+    burl = args.grafana.rstrip('/')
+    url = f'{burl}/{args.service}'
+    auth = (args.username, args.password)
+    info(f'benchmarking {url}')
+
+    rates = {}
+    timeout = args.timeout
+    rates['basic'] = bench('basic', args.num,
+                           lambda: requests.get(url, auth=auth, timeout=timeout))
+    session = get_session(burl, auth)
+    rates['session'] = bench('session', args.num, lambda: session.get(url, timeout=timeout))
+    if args.token:
+        tsession = get_session(burl, args.token)
+        rates['token'] = bench('token', args.num, lambda: tsession.get(url, timeout=timeout))
+
+    for key, rate in rates.items():
+        if key != 'basic':
+            print(f'{key} speedup: {rate / rates["basic"]:0.1f}x')
+
+
+if __name__ == '__main__':
+    main()